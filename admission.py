@@ -0,0 +1,166 @@
+"""
+Admission control: a bounded worker pool with a request queue, load
+shedding and per-user rate limits.
+
+Ledger requests (those that take locks or do heavy formatting; see
+server.admit) run on worker_threads threads, taken in arrival order from
+a queue of at most work_queue_size requests. Cheaper requests run where
+they arrive. A request is shed, answered at once with "Server busy, retry
+after N ms" without running, when the queue is full or when the oldest
+queued request has already waited longer than queue_latency_slo_ms. The
+workers are then not keeping up, and queueing more would only make every
+request late. N estimates how long the queue takes to drain.
+
+rate_limit_per_user (requests per second; 0, the default, turns it off)
+gives each user a token bucket holding up to rate_limit_burst tokens.
+Each request takes one. A user whose bucket is empty is answered "Rate
+limit exceeded for <user>, retry after N ms".
+
+A refused request has not run, so a client may simply send it again after
+N ms (client.ConnectionPool does). EXEMPT_COMMANDS are never refused, so
+an operator can still see what is happening.
+"""
+import collections
+import math
+import threading
+import time
+from concurrent.futures import Executor, Future
+
+from metrics import METRICS
+from protocol import RATE_LIMITED, SERVER_BUSY
+
+EXEMPT_COMMANDS = {'stats', 'set_lock_logging', 'trace_dump', 'profile'}
+
+# Rate limit buckets kept before idle (full) ones are dropped.
+MAX_BUCKETS = 10000
+
+
+class Busy(Exception):
+    """Raised when a request is shed."""
+
+    def __init__(self, retry_after_ms):
+        super().__init__(f"{SERVER_BUSY}, retry after {retry_after_ms} ms")
+        self.retry_after_ms = retry_after_ms
+
+
+def retry_after_ms(seconds):
+    return max(1, math.ceil(seconds * 1000))
+
+
+class WorkerPool(Executor):
+    """
+    `workers` threads fed from one queue. admit() sheds load; submit()
+    (the Executor interface, used by run_in_executor) always queues, for
+    work that belongs to a request already admitted.
+    """
+
+    def __init__(self, workers=32, max_queue=1024, slo_ms=0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.slo = slo_ms / 1000.0          # 0: shed only when the queue is full
+        self.cond = threading.Condition()
+        self.queue = collections.deque()    # (enqueued, future, fn, args, kwargs)
+        self.service = 0.0                  # moving average of seconds per request
+        self.stopped = False
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def depth(self):
+        return len(self.queue)
+
+    def admit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) and return its Future, or raise Busy if the request is shed."""
+        now = time.perf_counter()
+        with self.cond:
+            depth = len(self.queue)
+            waited = now - self.queue[0][0] if depth else 0.0
+            if depth >= self.max_queue:
+                reason = "queue_full"
+            elif self.slo and waited > self.slo:
+                reason = "slo"
+            else:
+                return self._put(now, fn, args, kwargs)
+        METRICS.inc("bank_requests_shed_total", labels=(("reason", reason),))
+        # The longer of: the time the workers need to get through the queue
+        # (once there is an average to go by), what the oldest request has
+        # waited so far, and the SLO.
+        raise Busy(retry_after_ms(max(depth * self.service / self.workers, waited, self.slo)))
+
+    def submit(self, fn, *args, **kwargs):
+        with self.cond:
+            if self.stopped:
+                raise RuntimeError("cannot submit to a pool that was shut down")
+            return self._put(time.perf_counter(), fn, args, kwargs)
+
+    def _put(self, now, fn, args, kwargs):
+        # Caller holds cond.
+        future = Future()
+        self.queue.append((now, future, fn, args, kwargs))
+        self.cond.notify()
+        return future
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.stopped:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                enqueued, future, fn, args, kwargs = self.queue.popleft()
+            started = time.perf_counter()
+            METRICS.observe("bank_queue_wait_seconds", started - enqueued)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            # Updated without a lock: a lost update only nudges an estimate.
+            elapsed = time.perf_counter() - started
+            self.service = self.service + (elapsed - self.service) * 0.05 if self.service else elapsed
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self.cond:
+            self.stopped = True
+            if cancel_futures:
+                for _, future, _, _, _ in self.queue:
+                    future.cancel()
+                self.queue.clear()
+            self.cond.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+class RateLimiter:
+    """Token bucket per user: rate tokens a second, holding at most burst."""
+
+    def __init__(self, rate, burst=0):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst or rate))
+        self.lock = threading.Lock()
+        self.buckets = {}   # user -> [tokens, time they were counted]
+
+    def refuse(self, user):
+        """None if user may send a request now (taking a token), else the reply refusing it."""
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(user)
+            if bucket is None:
+                if len(self.buckets) >= MAX_BUCKETS:
+                    self._purge(now)
+                bucket = self.buckets[user] = [self.burst, now]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return None
+            bucket[0] = tokens
+        METRICS.inc("bank_rate_limited_total")
+        return f"{RATE_LIMITED} for {user}, retry after {retry_after_ms((1 - tokens) / self.rate)} ms"
+
+    def _purge(self, now):
+        # A bucket that has refilled is the same as a new one. Caller holds lock.
+        self.buckets = {user: bucket for user, bucket in self.buckets.items()
+                        if bucket[0] + (now - bucket[1]) * self.rate < self.burst}
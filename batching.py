@@ -0,0 +1,163 @@
+"""
+Per-account write batching for single-account commands (deposit, withdraw,
+pay_loan_check).
+
+Each command is queued on its account instead of taking the account lock
+itself. The thread that finds the queue empty becomes the combiner: it
+takes the lock once and applies up to write_batch_max queued commands in
+arrival order. Each command is validated against the balance left by the
+ones before it, so an insufficient-funds check sees every earlier
+withdrawal in the batch. The batch then gets one history append and one
+write-ahead log record, and waits for durability once. Every command still
+gets its own response.
+
+Before taking its batch, a combiner yields once (a bounded collection
+window), so threads that are about to queue get to do so. Without it, under
+CPython's GIL the combiner finishes before anyone else runs, and batches
+stay at one command. When a batch is applied and more commands have queued
+up, the first waiting thread is woken to combine the next batch while this
+one waits for its log record to become durable. No thread keeps serving
+other threads' work indefinitely.
+
+Batching is off by default (write_batch_max 1: each command takes the lock
+itself). It pays off with the write-ahead log on and many concurrent
+writers to one account: each batch is one log record, so fewer records are
+appended and fewer waiters woken per fsync (see
+benchmarks/bench_batching.py).
+"""
+import threading
+import time
+
+import tracing
+from history_store import check_entry
+
+
+class _Op:
+    __slots__ = ('apply', 'data_dict', 'response', 'error', 'combine', 'done')
+
+    def __init__(self, apply, data_dict):
+        self.apply = apply
+        self.data_dict = data_dict
+        self.response = None
+        self.error = None
+        self.combine = False
+        # One-shot signal for an op queued behind a combiner: held until the
+        # op is applied or handed the next batch. The combiner's own op needs none.
+        self.done = None
+
+
+class WriteBatcher:
+    def __init__(self, bank, max_batch=256):
+        self.bank = bank
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.queues = {}   # acct_num -> pending ops; present while a combiner is active
+        self.batches = 0
+        self.ops = 0
+
+    def submit(self, account, apply, data_dict, purpose=""):
+        """
+        Run apply(account, data_dict) under account's lock, batched with other
+        queued commands. apply returns (response, change) where change is an
+        (account, delta, history_entry) tuple, or None if it was rejected; it
+        does not touch the balance. The batcher checks the history entry and
+        only then adds delta to the balance. Returns the response. purpose
+        names the command in lock log lines.
+        """
+        if self.max_batch <= 1:
+            return self._apply_one(account, apply, data_dict, purpose)
+        op = _Op(apply, data_dict)
+        with self.lock:
+            queue = self.queues.get(account.acct_num)
+            if queue is None:
+                queue = self.queues[account.acct_num] = []
+                op.combine = True
+            else:
+                op.done = threading.Lock()
+                op.done.acquire()
+            queue.append(op)
+        if op.done is not None:
+            op.done.acquire()
+            tracing.mark('lock_wait')
+        if op.combine:
+            self._drain(account, queue)
+        if op.error is not None:
+            raise op.error
+        return op.response
+
+    def depth(self):
+        """Commands queued behind a combiner, over all accounts."""
+        with self.lock:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def _drain(self, account, queue):
+        """
+        Apply the next batch from queue and hand the rest to the next waiting
+        thread. The batch is only released once its log record is durable,
+        but the next batch does not wait for that.
+        """
+        if len(queue) < self.max_batch:
+            # The collection window: let threads that are about to queue run.
+            time.sleep(0)
+        with self.lock:
+            batch = queue[:self.max_batch]
+            del queue[:self.max_batch]
+        lsn = None
+        try:
+            lsn = self._apply(account, batch)
+        finally:
+            with self.lock:
+                self.batches += 1
+                self.ops += len(batch)
+                if queue:
+                    queue[0].combine = True
+                    queue[0].done.release()
+                else:
+                    del self.queues[account.acct_num]
+            try:
+                self.bank.wait_durable(lsn)
+            finally:
+                for op in batch:
+                    if op.done is not None:
+                        op.done.release()
+
+    def _apply_one(self, account, apply, data_dict, purpose):
+        """Batching off: apply one command under its own hold of the account lock."""
+        bank = self.bank
+        lsn = None
+        with bank.locked(account, purpose=purpose):
+            response, change = apply(account, data_dict)
+            if change is not None:
+                check_entry(account.acct_num, change[2])
+                account.balance += change[1]
+                bank.record(account, change[2])
+                lsn = bank.commit_changes(change)
+        bank.wait_durable(lsn)
+        return response
+
+    def _apply(self, account, batch):
+        """Apply batch under one hold of account's lock; returns the lsn to wait for."""
+        bank = self.bank
+        changes = []
+        lsn = None
+        try:
+            with bank.locked(account, purpose=f"{len(batch)} queued operations"):
+                for op in batch:
+                    try:
+                        op.response, change = op.apply(account, op.data_dict)
+                        if change is not None:
+                            check_entry(account.acct_num, change[2])
+                    except Exception as e:
+                        op.error = e
+                        continue
+                    if change is not None:
+                        account.balance += change[1]
+                        changes.append(change)
+                if changes:
+                    bank.history.append_batch([(change[0].acct_num, change[2]) for change in changes])
+                    lsn = bank.commit_changes(*changes)
+        except Exception as e:
+            for op in batch:
+                op.error = op.error or e
+            raise
+        return lsn
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark: a burst of clients against the threaded server with and without
+admission limits. Each of --clients connections asks for a page of the
+audit report over and over (text protocol), so the server has more work
+than it can do. Without limits (as before: every connection's request
+runs at once) they all share the CPU and every reply is late. With limits,
+at most worker_threads run, and requests beyond the queue or the latency
+SLO are answered "Server busy" at once. Reports the latency of answered
+requests, how many were shed, and how quickly the shed ones heard so.
+Errors counts clients whose connection failed.
+
+Usage: python3 benchmarks/bench_admission.py [--requests 4000] [--clients 200] [--slo-ms 50]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import protocol
+from bench_bulk_load import write_accounts
+from loadgen import percentile, start_server, wait_for_port
+
+HOST = socket.gethostbyname(socket.gethostname())
+BASE_PORT = 9650
+ACCOUNTS = 10000
+# A request with some CPU work in it: a page of the audit report.
+REQUEST = "user=Audit command=show_bank acct_num=0 limit=1000"
+
+
+async def client(port, count, answered, shed):
+    """One client: count text requests, one after another, on one connection."""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            writer.write(REQUEST.encode())
+            await writer.drain()
+            response = await reader.readuntil(b"END")
+            latency = time.perf_counter() - start
+            (shed if response.startswith(protocol.SERVER_BUSY.encode()) else answered).append(latency)
+    finally:
+        writer.close()
+
+
+async def burst(port, total, clients):
+    answered, shed = [], []
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client(port, total // clients, answered, shed) for _ in range(clients)),
+                                   return_exceptions=True)
+    errors = sum(isinstance(result, Exception) for result in results)
+    return answered, shed, errors, time.perf_counter() - start
+
+
+def run(label, port, args, **settings):
+    with tempfile.TemporaryDirectory() as workdir:
+        seed_file = os.path.join(workdir, "accounts.csv")
+        write_accounts(seed_file, ACCOUNTS)
+        proc = start_server("threaded", port, workdir, seed_file=seed_file, auto_interest_interval=3600, **settings)
+        try:
+            wait_for_port(HOST, port, timeout=60)
+            answered, shed, errors, elapsed = asyncio.run(burst(port, args.requests, args.clients))
+        finally:
+            proc.terminate()
+            proc.wait()
+    print(f"{label:>10} {len(answered) / elapsed:>10.0f} {percentile(answered, 50) * 1e3:>9.1f} "
+          f"{percentile(answered, 99) * 1e3:>9.1f} {len(shed):>7} {percentile(shed, 50) * 1e3:>12.1f} {errors:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Burst latency with and without admission limits")
+    parser.add_argument("--requests", type=int, default=4000, help="total, split evenly over the clients")
+    parser.add_argument("--clients", type=int, default=200, help="connections, each with one request in flight")
+    parser.add_argument("--workers", type=int, default=8, help="worker_threads with limits on")
+    parser.add_argument("--queue", type=int, default=256, help="work_queue_size with limits on")
+    parser.add_argument("--slo-ms", type=float, default=50, help="queue_latency_slo_ms with limits on")
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests from {args.clients} clients, CPUs: {os.cpu_count()}")
+    print(f"{'limits':>10} {'answered/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'shed':>7} {'shed p50 ms':>12} {'errors':>7}")
+    # Fresh ports for every run: the server does not reuse ports in TIME_WAIT.
+    run("off", BASE_PORT, args, worker_threads=args.clients, work_queue_size=args.requests,
+        queue_latency_slo_ms=0, max_connections=args.clients)
+    run("on", BASE_PORT + 1, args, worker_threads=args.workers, work_queue_size=args.queue,
+        queue_latency_slo_ms=args.slo_ms, max_connections=args.clients)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark: ops/sec on one hot account for several write_batch_max settings,
+in memory and with the write-ahead log on. Threads send a payroll-style
+burst of deposits with some withdrawals mixed in; the average batch size
+the WriteBatcher actually formed is reported alongside.
+
+Usage: python3 benchmarks/bench_batching.py [--threads 16] [--seconds 2] [--batches 1 8 64 256]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logging
+logging.disable(logging.INFO)
+
+import persistence
+import server
+
+
+def run(batch_max, threads, seconds, durable):
+    server.config["write_batch_max"] = batch_max
+    bank = server.Bank()
+    workdir = None
+    if durable:
+        workdir = tempfile.TemporaryDirectory()
+        persistence.attach(bank, dict(server.config, data_dir=workdir.name, snapshot_interval=0))
+    deposit = {'user': 'Alice', 'acct_num': 1001, 'amount': 2}
+    withdraw = {'user': 'Alice', 'acct_num': 1001, 'amount': 1}
+    counts = [0] * threads
+    stop = time.perf_counter() + seconds
+
+    def worker(i):
+        n = 0
+        while time.perf_counter() < stop:
+            if n % 4 == 3:
+                bank.withdraw(withdraw)
+            else:
+                bank.deposit(deposit)
+            n += 1
+        counts[i] = n
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    batcher = bank.batcher
+    average = batcher.ops / batcher.batches if batcher.batches else 1.0
+    if bank.wal is not None:
+        bank.wal.close()
+    return sum(counts) / elapsed, average
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot-account throughput by write batch size")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--batches", type=int, nargs="*", default=[1, 8, 64, 256])
+    args = parser.parse_args()
+
+    print(f"threads: {args.threads}")
+    print(f"{'wal':>4} {'batch max':>10} {'ops/s':>10} {'avg batch':>10}")
+    for durable in (False, True):
+        for batch_max in args.batches:
+            rate, average = run(batch_max, args.threads, args.seconds, durable)
+            print(f"{'on' if durable else 'off':>4} {batch_max:>10} {rate:>10.0f} {average:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Benchmark: onboarding N accounts one create_account at a time against
+bulk_load streaming the same accounts from a CSV file, in rows per second.
+Also times a bank recovering the loaded accounts from a snapshot.
+
+Usage: python3 benchmarks/bench_bulk_load.py [N]   (default: 1000000)
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logging
+logging.disable(logging.INFO)
+
+import bulk_load
+import persistence
+import server
+
+
+def write_accounts(path, n):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(bulk_load.ACCOUNT_COLUMNS)
+        for i in range(n):
+            writer.writerow([100000 + i, "checking", f"user{i}", f"user{i}", 1000 + i % 5000])
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "accounts.csv")
+        write_accounts(path, n)
+        print(f"accounts: {n}")
+
+        bank = server.Bank()
+        start = time.perf_counter()
+        for i in range(n):
+            bank.create_account({'user': f"user{i}", 'command': 'create_account', 'acct_num': 100000 + i,
+                                 'amount': 1000 + i % 5000})
+        elapsed = time.perf_counter() - start
+        print(f"create_account loop: {elapsed:8.2f} s  {n / elapsed:>10.0f} rows/s")
+        bank.history.close()
+
+        bank = server.Bank()
+        report, _ = bulk_load.load_file(bank, path)
+        assert report["loaded"] == n
+        print(f"bulk_load from CSV:  {report['seconds']:8.2f} s  {report['rows_per_second']:>10.0f} rows/s")
+
+        config = dict(server.config, data_dir=os.path.join(workdir, "data"), snapshot_interval=0)
+        persistence.attach(bank, config)
+        persistence.snapshot(bank)
+        bank.wal.close()
+        recovered = server.Bank()
+        start = time.perf_counter()
+        persistence.load_snapshot(recovered, config["data_dir"])
+        elapsed = time.perf_counter() - start
+        print(f"snapshot recovery:   {elapsed:8.2f} s  {len(recovered.accounts) / elapsed:>10.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
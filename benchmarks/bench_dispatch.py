@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-request cost of parsing and dispatching, without any
+sockets. Times parsing a text request from a receive buffer (as a
+memoryview, the way handle_client does, and the old bytes.decode() way),
+decoding a framed request body, and dispatch() through the command table,
+for a few cheap commands, so the parse and lookup overhead is not hidden
+behind ledger work. Reports nanoseconds per request.
+
+Usage: python3 benchmarks/bench_dispatch.py [N]   (default: 200000 per case)
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logging
+logging.disable(logging.INFO)
+
+import protocol
+import server
+
+REQUESTS = [
+    "user=Alice command=deposit acct_num=1001 amount=0",    # balance inquiry, lock-free
+    "user=Alice command=show_accountholders acct_num=1001 amount=0",
+    "user=Audit command=show_totals acct_num=0 amount=0",
+    "user=Alice command=no_such_command acct_num=1001 amount=0",
+]
+
+
+def per_call(n, fn, *args):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(*args)
+    return (time.perf_counter() - start) / n * 1e9
+
+
+def decode_split(data):
+    """How requests were parsed before: copy out as bytes, decode, split."""
+    return dict(pair.split('=') for pair in bytes(data).decode().split())
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    bank = server.Bank()
+    buffer = memoryview(bytearray(1024))
+    print(f"requests per case: {n}")
+    print(f"{'command':<20} {'decode+split':>13} {'memoryview':>11} {'framed':>8} {'dispatch':>9} {'parse+dispatch':>15}   (ns/request)")
+    for text in REQUESTS:
+        raw = text.encode()
+        buffer[:len(raw)] = raw
+        view = buffer[:len(raw)]
+        body = protocol.encode_fields(server.parse_request(view))
+        command = server.parse_request(view)['command']
+
+        def parse_and_dispatch():
+            server.dispatch(bank, server.parse_request(view))
+
+        print(f"{command:<20} {per_call(n, decode_split, view):>13.0f} {per_call(n, server.parse_request, view):>11.0f} "
+              f"{per_call(n, protocol.decode_fields, body):>8.0f} "
+              f"{per_call(n, server.dispatch, bank, server.parse_request(view)):>9.0f} "
+              f"{per_call(n, parse_and_dispatch):>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
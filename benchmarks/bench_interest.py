@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark: one interest pass over N loan accounts, comparing the original
+per-account loop (lock, compute, record one at a time) with the batched
+InterestEngine. It also reports the median and longest single lock hold,
+which bound how long a concurrent writer can be blocked.
+
+Usage: python3 benchmarks/bench_interest.py [N]   (default: 1000000)
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logging
+logging.disable(logging.INFO)
+
+import interest
+import server
+
+
+def loan_bank(n):
+    bank = server.Bank()
+    for i in range(n):
+        account = bank.new_account(100000 + i, 'loan', f"user{i}", [f"user{i}"], -(100 + i % 10000))
+        bank.accounts.append(account)
+        bank._index_account(account)
+    return bank
+
+
+def legacy_pass(bank, rate):
+    """The original Bank.apply_interest loop, minus its per-account logging."""
+    holds = []
+    for account in bank.accounts:
+        if account.acct_type == 'loan':
+            with account.lock:
+                start = time.perf_counter()
+                old_balance = account.balance
+                new_balance = int(old_balance * (1 + rate))
+                bank.record(account, ("System", "interest", new_balance - old_balance))
+                account.balance = new_balance
+                holds.append(time.perf_counter() - start)
+    return holds
+
+
+def timed_locks(bank):
+    """Wrap every lock stripe to record each hold time during a pass."""
+    holds = []
+
+    class TimedLock:
+        def __init__(self, lock):
+            self.lock = lock
+
+        def __enter__(self):
+            self.lock.acquire()
+            self.start = time.perf_counter()
+
+        def __exit__(self, *exc):
+            holds.append(time.perf_counter() - self.start)
+            self.lock.release()
+
+    bank.lock_stripes = [TimedLock(lock) for lock in bank.lock_stripes]
+    return holds
+
+
+def hold_summary(holds):
+    holds = sorted(holds)
+    return f"lock holds: {len(holds):>8}  median {holds[len(holds) // 2] * 1000:7.3f} ms  max {holds[-1] * 1000:8.3f} ms"
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rate = server.config.get("interest_rate", 0.05)
+    print(f"loan accounts: {n}   numpy: {'yes' if interest.np is not None else 'no (pure Python fallback)'}")
+
+    bank = loan_bank(n)
+    start = time.perf_counter()
+    holds = legacy_pass(bank, rate)
+    legacy = time.perf_counter() - start
+    legacy_balances = [account.balance for account in bank.accounts]
+    print(f"per-account loop: {legacy:8.2f} s   {hold_summary(holds)}")
+
+    bank = loan_bank(n)
+    holds = timed_locks(bank)
+    start = time.perf_counter()
+    bank.apply_interest()
+    batched = time.perf_counter() - start
+    assert [account.balance for account in bank.accounts] == legacy_balances
+    print(f"InterestEngine:   {batched:8.2f} s   {hold_summary(holds)}")
+
+
+if __name__ == "__main__":
+    main()
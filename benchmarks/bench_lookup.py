@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark: account lookup latency, linear scan vs. the Bank hash indexes.
+
+Seeds a Bank with N synthetic accounts (on top of the built-in ones), each
+also held by the previous account's owner, and times looking up random
+accounts by acct_num and by init_acct_holder, and every account a user
+holds (as my_accounts does), both ways.
+
+Usage: python3 benchmarks/bench_lookup.py [N ...]   (default: 1000 100000 1000000)
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logging
+logging.disable(logging.INFO)
+
+from server import Bank
+
+LOOKUPS = 2000
+SCAN_LOOKUPS = 50  # linear scans are slow at 1M accounts, so sample fewer
+
+
+def seed(bank, n):
+    for i in range(n):
+        bank.create_account({'user': f"user{i}", 'acct_num': 100000 + i, 'amount': 100})
+        if i:
+            bank.add_holder({'user': f"user{i}", 'acct_num': 100000 + i, 'holder': f"user{i - 1}"})
+
+
+def linear_by_num(bank, acct_num):
+    for account in bank.accounts:
+        if account.acct_num == acct_num:
+            return account
+    return None
+
+
+def linear_by_holder(bank, user):
+    for account in bank.accounts:
+        if account.init_acct_holder == user:
+            return account
+    return None
+
+
+def linear_for_holder(bank, user):
+    return [account for account in bank.accounts if user in account.holders]
+
+
+def per_op_us(func, args):
+    start = time.perf_counter()
+    for arg in args:
+        func(arg)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def run(n):
+    bank = Bank()
+    start = time.perf_counter()
+    seed(bank, n)
+    seed_secs = time.perf_counter() - start
+
+    nums = [100000 + random.randrange(n) for _ in range(LOOKUPS)]
+    users = [f"user{num - 100000}" for num in nums]
+
+    return {
+        'n': n,
+        'seed_s': seed_secs,
+        'scan_num_us': per_op_us(lambda a: linear_by_num(bank, a), nums[:SCAN_LOOKUPS]),
+        'index_num_us': per_op_us(bank.find_account, nums),
+        'scan_holder_us': per_op_us(lambda u: linear_by_holder(bank, u), users[:SCAN_LOOKUPS]),
+        'index_holder_us': per_op_us(bank.find_init_account, users),
+        'scan_held_us': per_op_us(lambda u: linear_for_holder(bank, u), users[:SCAN_LOOKUPS]),
+        'index_held_us': per_op_us(bank.accounts_for_holder, users),
+    }
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 100000, 1000000]
+    print(f"{'accounts':>10} {'seed s':>8} {'scan num us':>12} {'index num us':>13} "
+          f"{'scan holder us':>15} {'index holder us':>16} {'scan held us':>13} {'index held us':>14}")
+    for n in sizes:
+        r = run(n)
+        print(f"{r['n']:>10} {r['seed_s']:>8.2f} {r['scan_num_us']:>12.1f} {r['index_num_us']:>13.3f} "
+              f"{r['scan_holder_us']:>15.1f} {r['index_holder_us']:>16.3f} "
+              f"{r['scan_held_us']:>13.1f} {r['index_held_us']:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark: bytes per account for the original dict-based account records
+versus the compact Account (__slots__, interned holders, striped locks).
+
+Every fourth account gets a history entry; for Account records that lives in
+the Bank's memory-mapped HistoryStore rather than on the heap.
+
+Usage: python3 benchmarks/bench_memory.py [N]   (default: 1000000)
+"""
+import os
+import sys
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logging
+logging.disable(logging.INFO)
+
+from server import Bank
+
+HOLDERS = ["Alice", "Bob", "Charlie", "Dave", "Eve", "Frank", "Grace", "Heidi"]
+
+
+def holders_for(i):
+    # Build fresh strings each time, as a parser would, so interning matters.
+    return [''.join(HOLDERS[(i + k) % len(HOLDERS)]) for k in range(3)]
+
+
+def build_dicts(n):
+    accounts = []
+    for i in range(n):
+        holders = holders_for(i)
+        account = {'acct_num': 100000 + i, 'acct_type': 'checking' if i % 2 else 'loan',
+                   'init_acct_holder': holders[0], 'acct_holder': holders,
+                   'balance': i % 10000, 'history': [], 'lock': threading.Lock()}
+        if i % 4 == 0:
+            account['history'].append((holders[0], 'deposit', 100))
+        accounts.append(account)
+    return accounts
+
+
+def build_slots(n):
+    bank = Bank()
+    accounts = []
+    for i in range(n):
+        holders = holders_for(i)
+        account = bank.new_account(100000 + i, 'checking' if i % 2 else 'loan', holders[0], holders, i % 10000)
+        if i % 4 == 0:
+            bank.record(account, (account.init_acct_holder, 'deposit', 100))
+        accounts.append(account)
+    # Keep the bank (and its history indexes) alive while memory is measured.
+    return bank, accounts
+
+
+def bytes_per_account(builder, n):
+    tracemalloc.start()
+    built = builder(n)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del built
+    return current / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    before = bytes_per_account(build_dicts, n)
+    after = bytes_per_account(build_slots, n)
+    print(f"accounts:             {n}")
+    print(f"dict records:         {before:8.1f} bytes/account")
+    print(f"Account (__slots__):  {after:8.1f} bytes/account")
+    print(f"reduction:            {100 * (1 - after / before):8.1f} %")
+
+
+if __name__ == "__main__":
+    main()
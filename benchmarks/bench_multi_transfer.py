@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark: posting a split payment (one debit, N credits) as N sequential
+transfer_to commands against one multi_transfer, in memory and with the
+write-ahead log on. Threads each pay out of their own account to N shared
+payees; reports split payments per second and p50/p99 latency per split.
+Over a network connection every transfer_to is also a round trip of its own.
+
+Usage: python3 benchmarks/bench_multi_transfer.py [--threads 8] [--seconds 2] [--payees 2 8 32]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logging
+logging.disable(logging.INFO)
+
+import persistence
+import server
+
+
+def run(mode, payees, threads, seconds, durable):
+    bank = server.Bank()
+    workdir = None
+    if durable:
+        workdir = tempfile.TemporaryDirectory()
+        persistence.attach(bank, dict(server.config, data_dir=workdir.name, snapshot_interval=0))
+    for i in range(threads):
+        bank.create_account({'user': f"payer{i}", 'command': 'create_account', 'acct_num': 900000 + i, 'amount': 10 ** 9})
+    targets = [900100 + i for i in range(payees)]
+    for acct_num in targets:
+        bank.create_account({'user': f"payee{acct_num}", 'command': 'create_account', 'acct_num': acct_num, 'amount': 0})
+    latencies = [[] for _ in range(threads)]
+    stop = time.perf_counter() + seconds
+
+    def worker(i):
+        user = f"payer{i}"
+        legs = f"{900000 + i}:-{payees}," + ",".join(f"{acct_num}:1" for acct_num in targets)
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            if mode == "multi_transfer":
+                server.dispatch(bank, {'user': user, 'command': 'multi_transfer', 'acct_num': 0, 'legs': legs})
+            else:
+                for acct_num in targets:
+                    server.dispatch(bank, {'user': user, 'command': 'transfer_to', 'acct_num': acct_num, 'amount': 1})
+            latencies[i].append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if durable:
+        bank.wal.close()
+        workdir.cleanup()
+    ops = sorted(latency for per_thread in latencies for latency in per_thread)
+    return len(ops) / elapsed, ops[len(ops) // 2], ops[min(len(ops) - 1, int(len(ops) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split payments as sequential transfers vs one multi_transfer")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--payees", type=int, nargs="*", default=[2, 8, 32])
+    args = parser.parse_args()
+
+    print(f"threads: {args.threads}")
+    print(f"{'log':>4} {'payees':>6} {'mode':>15} {'splits/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for durable in (False, True):
+        for payees in args.payees:
+            for mode in ("transfer_to", "multi_transfer"):
+                rate, p50, p99 = run(mode, payees, args.threads, args.seconds, durable)
+                print(f"{'on' if durable else 'off':>4} {payees:>6} {mode:>15} {rate:>10.0f} {p50 * 1e3:>8.3f} {p99 * 1e3:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: requests/sec for the original one-connection-per-request text
+protocol against the framed protocol pipelined over a single connection.
+
+Starts server.py (via loadgen.start_server) in each requested server_mode.
+
+Usage: python3 benchmarks/bench_pipeline.py [--requests 5000] [--depth 64] [--modes threaded asyncio]
+"""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+import protocol
+from loadgen import start_server, wait_for_port
+
+REQUEST = {'user': 'Alice', 'command': 'deposit', 'acct_num': 1001, 'amount': 0}
+
+
+def one_shot_text(addr, n):
+    request = " ".join(f"{key}={value}" for key, value in REQUEST.items()).encode()
+    for _ in range(n):
+        sock = socket.create_connection(addr)
+        sock.sendall(request)
+        response = b""
+        while not response.endswith(b"END"):
+            chunk = sock.recv(1024)
+            if not chunk:
+                break
+            response += chunk
+        sock.close()
+
+
+def pipelined_framed(addr, n, depth):
+    connection = protocol.FramedConnection(socket.create_connection(addr))
+    sent = 0
+    while sent < n:
+        batch = min(depth, n - sent)
+        connection.request_many([REQUEST] * batch)
+        sent += batch
+    connection.close()
+
+
+def rate(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return args[1] / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text one-shot vs. framed pipelined throughput")
+    parser.add_argument("--host", default=socket.gethostbyname(socket.gethostname()))
+    parser.add_argument("--port", type=int, default=9876)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--depth", type=int, default=64, help="requests in flight per pipelined batch")
+    parser.add_argument("--modes", nargs="*", default=["threaded", "asyncio"])
+    args = parser.parse_args()
+    addr = (args.host, args.port)
+
+    print(f"{'mode':>10} {'text one-shot req/s':>20} {'framed pipelined req/s':>23}")
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as workdir:
+            proc = start_server(mode, args.port, workdir)
+            try:
+                wait_for_port(*addr)
+                text = rate(one_shot_text, addr, args.requests)
+                framed = rate(pipelined_framed, addr, args.requests, args.depth)
+                print(f"{mode:>10} {text:>20.0f} {framed:>23.0f}")
+            finally:
+                proc.terminate()
+                proc.wait()
+
+
+if __name__ == "__main__":
+    main()
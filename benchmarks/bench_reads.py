@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark: read latency under writer contention. Threads run a mix of
+consistent two-account balance reads and transfers between a few hot
+accounts, at 95/5 and 50/50 read/write ratios. Reads are done two ways:
+
+    locked     take both account locks (in stripe order) and read, the only
+               way to get a consistent pair before versioned balances
+    lock-free  Bank.read_balances, which reads committed versions
+
+Reports read p50/p99 and total operations per second.
+
+Usage: python3 benchmarks/bench_reads.py [--threads 8] [--seconds 3] [--hot 4]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logging
+logging.disable(logging.INFO)
+
+import server
+
+
+def locked_read(bank, accounts):
+    locks = bank.ordered_locks(*accounts)
+    for lock in locks:
+        lock.acquire()
+    try:
+        return [account.balance for account in accounts]
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
+def run(read, read_share, threads, seconds, hot):
+    bank = server.Bank()
+    accounts = [account for account in bank.accounts if account.acct_type == 'checking'][:hot]
+    latencies = [[] for _ in range(threads)]
+    ops = [0] * threads
+    stop = time.perf_counter() + seconds
+
+    def worker(i):
+        rng = random.Random(i)
+        while time.perf_counter() < stop:
+            source, target = rng.sample(accounts, 2)
+            if rng.random() < read_share:
+                start = time.perf_counter()
+                read(bank, [source, target])
+                latencies[i].append(time.perf_counter() - start)
+            else:
+                bank.transfer_to({'user': source.init_acct_holder, 'acct_num': target.acct_num, 'amount': 1})
+            ops[i] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    reads = sorted(latency for per_thread in latencies for latency in per_thread)
+    return reads[len(reads) // 2], reads[min(len(reads) - 1, int(len(reads) * 0.99))], sum(ops) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read p99 under writer contention, locked vs lock-free")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--hot", type=int, default=4, help="number of hot accounts the threads share")
+    args = parser.parse_args()
+
+    print(f"threads: {args.threads}  hot accounts: {args.hot}")
+    print(f"{'mix r/w':>8} {'reads':>10} {'p50 us':>9} {'p99 us':>9} {'ops/s':>10}")
+    for read_share in (0.95, 0.5):
+        mix = f"{read_share * 100:.0f}/{(1 - read_share) * 100:.0f}"
+        for label, read in (("locked", locked_read), ("lock-free", server.Bank.read_balances)):
+            p50, p99, rate = run(read, read_share, args.threads, args.seconds, args.hot)
+            print(f"{mix:>8} {label:>10} {p50 * 1e6:>9.1f} {p99 * 1e6:>9.1f} {rate:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
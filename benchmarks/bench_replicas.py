@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark: read throughput against the number of read replicas. For each
+replica count, starts a primary (log on, no fsync) and that many replica
+server.py processes on loopback. A writer keeps depositing on the primary
+while client processes send show_history and show_accountholders through
+client.RoutingPool, which spreads the reads over the replicas. Reports reads
+per second, p50/p99 read latency, and how many reads the primary had to
+answer itself.
+
+Usage: python3 benchmarks/bench_replicas.py [--replicas 0 1 2 4] [--clients 4] [--threads 8] [--seconds 5]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import client
+import loadgen
+import server
+
+HOST = socket.gethostbyname(socket.gethostname())
+BASE_PORT = 9600
+
+
+def reader(primary_port, threads, seconds, results):
+    """One client process: `threads` threads sending reads through one RoutingPool."""
+    pool = client.RoutingPool((HOST, primary_port), size=threads, verbose=False)
+    accounts = [(row[0], row[3][0]) for row in server.SEED_ACCOUNTS]
+    latencies = [[] for _ in range(threads)]
+    stop = time.perf_counter() + seconds
+
+    def run(i):
+        rng = random.Random(i)
+        while time.perf_counter() < stop:
+            acct_num, holder = rng.choice(accounts)
+            command = rng.choice(("show_history", "show_accountholders"))
+            start = time.perf_counter()
+            pool.send({'user': holder, 'command': command, 'acct_num': acct_num})
+            latencies[i].append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    pool.close()
+    results.put([latency for per_thread in latencies for latency in per_thread])
+
+
+def writer(primary_port, stop):
+    pool = client.ConnectionPool((HOST, primary_port), size=1, verbose=False)
+    while not stop.is_set():
+        pool.send({'user': 'Alice', 'command': 'deposit', 'acct_num': 1001, 'amount': 1})
+    pool.close()
+
+
+def served_by_primary(primary_port):
+    """How many of the benchmark's reads the primary has answered."""
+    pool = client.ConnectionPool((HOST, primary_port), size=1, verbose=False)
+    text = pool.send({'user': 'Audit', 'command': 'stats', 'acct_num': 0, 'format': 'prometheus'})
+    pool.close()
+    return sum(float(line.split()[-1]) for line in text.splitlines()
+               if line.startswith("bank_command_seconds_count")
+               and ("show_history" in line or "show_accountholders" in line))
+
+
+def run(replicas, clients, threads, seconds, port):
+    workdirs = [tempfile.TemporaryDirectory() for _ in range(replicas + 1)]
+    procs = [loadgen.start_server("threaded", port, workdirs[0].name, persistence=True, wal_fsync=False,
+                                  snapshot_interval=0, auto_interest_interval=3600, replication_port=port + 1)]
+    try:
+        loadgen.wait_for_port(HOST, port)
+        for i in range(replicas):
+            procs.append(loadgen.start_server("threaded", port + 2 + i, workdirs[i + 1].name,
+                                              replica_of=f"{HOST}:{port + 1}", auto_interest_interval=3600))
+            loadgen.wait_for_port(HOST, port + 2 + i)
+        time.sleep(1)  # let the replicas copy the bank and catch up
+        before = served_by_primary(port)
+        stop = threading.Event()
+        background = threading.Thread(target=writer, args=(port, stop))
+        background.start()
+        results = multiprocessing.Queue()
+        readers = [multiprocessing.Process(target=reader, args=(port, threads, seconds, results)) for _ in range(clients)]
+        start = time.perf_counter()
+        for p in readers:
+            p.start()
+        latencies = sorted(latency for _ in readers for latency in results.get())
+        elapsed = time.perf_counter() - start
+        for p in readers:
+            p.join()
+        stop.set()
+        background.join()
+        on_primary = served_by_primary(port) - before
+        return len(latencies) / elapsed, latencies[len(latencies) // 2], \
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], on_primary / len(latencies)
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+        for workdir in workdirs:
+            workdir.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read throughput against the number of read replicas")
+    parser.add_argument("--replicas", type=int, nargs="*", default=[0, 1, 2, 4])
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per client process")
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"clients: {args.clients} x {args.threads} threads, CPUs: {os.cpu_count()}")
+    print(f"{'replicas':>8} {'reads/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'on primary':>11}")
+    for i, replicas in enumerate(args.replicas):
+        # Fresh ports for every run: the servers do not reuse ports in TIME_WAIT.
+        rate, p50, p99, share = run(replicas, args.clients, args.threads, args.seconds, BASE_PORT + 20 * i)
+        print(f"{replicas:>8} {rate:>10.0f} {p50 * 1e3:>8.2f} {p99 * 1e3:>8.2f} {share:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark: the Audit report over N accounts. Compares the original
+show_bank (one tabulate table with every account's full history, as a
+single string) against the streamed Bank.bank_report, reporting total time,
+time to the first chunk and peak traced memory. Also times show_totals
+against summing balances with a scan.
+
+Usage: python3 benchmarks/bench_report.py [N]   (default: 200000)
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logging
+logging.disable(logging.INFO)
+
+from tabulate import tabulate
+
+import server
+
+HISTORY_PER_ACCOUNT = 4
+
+
+def big_bank(n):
+    bank = server.Bank()
+    with bank.index_lock:
+        for i in range(n):
+            account = bank.new_account(100000 + i, 'checking' if i % 2 else 'loan', f"user{i}", [f"user{i}"], i % 10000)
+            bank.accounts.append(account)
+            bank._index_account(account)
+    bank.history.append_batch([(100000 + i, (f"user{i}", 'deposit', k))
+                               for i in range(n) for k in range(HISTORY_PER_ACCOUNT)])
+    return bank
+
+
+def legacy_show_bank(bank):
+    """The original show_bank: every row and full history in one tabulate string."""
+    table_data = [[account.acct_num, account.acct_type, account.init_acct_holder, ', '.join(account.acct_holder),
+                   account.balance, bank.history.entries(account.acct_num)] for account in bank.accounts]
+    headers = ["acct_num", "acct_type", "init_holder", "acct_holder", "balance", "history"]
+    return f"All account information is as follows:\n{tabulate(table_data, headers=headers, tablefmt='plain')}"
+
+
+def consume_legacy(bank):
+    response = legacy_show_bank(bank)
+    first = time.perf_counter()
+    for i in range(0, len(response), 1024):
+        response[i:i + 1024].encode()
+    return first
+
+
+def consume_stream(bank, history):
+    first = None
+    for chunk in bank.show_bank({'user': 'Audit', 'history': history}):
+        chunk.encode()
+        first = first or time.perf_counter()
+    return first
+
+
+def measure(label, func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = func(*args)
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {total:8.2f} s  first chunk {first - start:8.3f} s  peak {peak / 2**20:8.1f} MB")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    bank = big_bank(n)
+    print(f"accounts: {n}  history entries per account: {HISTORY_PER_ACCOUNT}")
+    measure("show_bank (tabulate string)", consume_legacy, bank)
+    measure("streamed, no history", consume_stream, bank, 0)
+    measure("streamed, history last 2", consume_stream, bank, 2)
+
+    start = time.perf_counter()
+    scanned = {}
+    for account in bank.accounts:
+        totals = scanned.setdefault(account.acct_type, [0, 0])
+        totals[0] += 1
+        totals[1] += account.balance
+    scan = time.perf_counter() - start
+    start = time.perf_counter()
+    totals = bank.show_totals({'user': 'Audit'})
+    incremental = time.perf_counter() - start
+    assert {k: tuple(v) for k, v in scanned.items()} == bank.totals_snapshot()
+    print(f"totals by scan: {scan * 1000:8.3f} ms   show_totals: {incremental * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
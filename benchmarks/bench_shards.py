@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark: ledger throughput with the Bank sharded over 1, 2, 4 and 8 worker
+processes (plus the unsharded in-process Bank as a baseline).
+
+Client processes each pipeline framed requests over one connection: deposits
+to random seed accounts, with a share of transfers between random accounts
+(most of which cross shards and so run as two-phase commits).
+
+Usage: python3 benchmarks/bench_shards.py [--shards 0 1 2 4 8] [--clients 8] [--seconds 5] [--transfers 0.2]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+import logging
+logging.disable(logging.INFO)
+
+import protocol
+from loadgen import start_server, wait_for_port
+from server import SEED_ACCOUNTS
+
+CHECKING = [(row[0], row[2]) for row in SEED_ACCOUNTS if row[1] == 'checking']
+ACCOUNTS = [row[0] for row in SEED_ACCOUNTS]
+
+
+def make_request(rng, transfers):
+    if rng.random() < transfers:
+        _, user = rng.choice(CHECKING)
+        return {'user': user, 'command': 'transfer_to', 'acct_num': rng.choice(ACCOUNTS), 'amount': 1}
+    acct_num, user = rng.choice(CHECKING)
+    return {'user': user, 'command': 'deposit', 'acct_num': acct_num, 'amount': 1}
+
+
+def client(addr, seconds, depth, transfers, seed, results):
+    rng = random.Random(seed)
+    connection = protocol.FramedConnection(socket.create_connection(addr))
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        connection.request_many([make_request(rng, transfers) for _ in range(depth)])
+        done += depth
+    connection.close()
+    results.put(done)
+
+
+def run(addr, clients, seconds, depth, transfers):
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=client, args=(addr, seconds, depth, transfers, i, results))
+             for i in range(clients)]
+    start = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    total = sum(results.get() for _ in procs)
+    for proc in procs:
+        proc.join()
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the sharded Bank by shard count")
+    parser.add_argument("--host", default=socket.gethostbyname(socket.gethostname()))
+    parser.add_argument("--port", type=int, default=9876)
+    parser.add_argument("--shards", type=int, nargs="*", default=[0, 1, 2, 4, 8],
+                        help="shard counts to run (0: unsharded Bank)")
+    parser.add_argument("--clients", type=int, default=8, help="client processes")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--depth", type=int, default=32, help="pipelined requests per batch")
+    parser.add_argument("--transfers", type=float, default=0.2, help="fraction of requests that are transfers")
+    parser.add_argument("--mode", default="threaded", help="server_mode to run")
+    args = parser.parse_args()
+    addr = (args.host, args.port)
+
+    print(f"cpus: {os.cpu_count()}  clients: {args.clients}  transfers: {args.transfers:.0%}")
+    print(f"{'shards':>7} {'req/s':>10} {'speedup':>8}")
+    baseline = None
+    for shards in args.shards:
+        with tempfile.TemporaryDirectory() as workdir:
+            proc = start_server(args.mode, args.port, workdir, shards=shards)
+            try:
+                wait_for_port(*addr, timeout=30)
+                throughput = run(addr, args.clients, args.seconds, args.depth, args.transfers)
+            finally:
+                proc.terminate()
+                proc.wait()
+        baseline = baseline or throughput
+        print(f"{shards or 'none':>7} {throughput:>10.0f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
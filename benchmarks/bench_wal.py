@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark: write-ahead log commit throughput and recovery time.
+
+1. Commit throughput: concurrent deposits (each thread on its own account)
+   with persistence on, for several group-commit windows. Reports durable
+   ops/sec and the average number of records sharing one fsync.
+2. Recovery time against log size, and after a snapshot has been taken.
+
+Usage: python3 benchmarks/bench_wal.py [--threads 32] [--seconds 3] [--log-sizes 10000 100000 500000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logging
+logging.disable(logging.INFO)
+
+import persistence
+import server
+
+
+def commit_throughput(threads, seconds, group_commit_ms):
+    with tempfile.TemporaryDirectory() as directory:
+        bank = server.Bank()
+        bank.wal = persistence.WriteAheadLog(directory, group_commit_ms=group_commit_ms)
+        accounts = [account.acct_num for account in bank.accounts][:threads]
+        counts = [0] * len(accounts)
+        stop = time.perf_counter() + seconds
+
+        def worker(i):
+            request = {'user': 'Bench', 'acct_num': accounts[i], 'amount': 1}
+            while time.perf_counter() < stop:
+                bank.deposit(request)
+                counts[i] += 1
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(len(accounts))]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+        bank.wal.close()
+        return sum(counts) / elapsed, sum(counts) / max(bank.wal.batches, 1)
+
+
+def write_log(directory, records):
+    wal = persistence.WriteAheadLog(directory, group_commit_ms=0, fsync=False)
+    for i in range(records):
+        acct_num = 1001 + i % 56
+        wal.append({'op': 'apply', 'changes': [[acct_num, 1, ['Bench', 'deposit', 1]]]})
+    wal.close()
+
+
+def recovery_time(directory):
+    bank = server.Bank()
+    start = time.perf_counter()
+    persistence.recover(bank, directory)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WAL commit throughput and recovery time")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--log-sizes", type=int, nargs="*", default=[10000, 100000, 500000])
+    args = parser.parse_args()
+
+    print(f"{'group commit ms':>16} {'durable ops/s':>14} {'records/fsync':>14}")
+    for group_commit_ms in (0, 1, 2, 5):
+        ops, per_batch = commit_throughput(args.threads, args.seconds, group_commit_ms)
+        print(f"{group_commit_ms:>16} {ops:>14.0f} {per_batch:>14.1f}")
+
+    print()
+    print(f"{'log records':>12} {'replay s':>9} {'after snapshot s':>17}")
+    for size in args.log_sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            write_log(directory, size)
+            replay = recovery_time(directory)
+            bank = server.Bank()
+            bank.wal = persistence.attach(bank, {'data_dir': directory, 'snapshot_interval': 0})
+            persistence.snapshot(bank)
+            bank.wal.close()
+            print(f"{size:>12} {replay:>9.2f} {recovery_time(directory):>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Load generator: connections per second and latency percentiles for the
+server's one-request-per-connection pattern (what client.py does).
+
+Either point it at a running server:
+
+    python3 benchmarks/loadgen.py --host 127.0.0.1 --port 9876
+
+or let it start server.py once per server_mode and compare them:
+
+    python3 benchmarks/loadgen.py --modes threaded asyncio
+
+Each mode is launched from a temporary directory holding its own config.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server.py")
+DEFAULT_REQUEST = "user=Alice command=deposit acct_num=1001 amount=0"
+
+
+async def one_request(host, port, request):
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(request.encode())
+    await writer.drain()
+    response = b""
+    while not response.endswith(b"END"):
+        chunk = await reader.read(1024)
+        if not chunk:
+            break
+        response += chunk
+    writer.close()
+    return time.perf_counter() - start
+
+
+async def run_load(host, port, request, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        async with semaphore:
+            try:
+                latencies.append(await one_request(host, port, request))
+            except OSError:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(label, latencies, errors, elapsed):
+    print(f"{label:>10} {len(latencies) / elapsed:>10.0f} {percentile(latencies, 50) * 1000:>9.2f} "
+          f"{percentile(latencies, 99) * 1000:>9.2f} {errors:>7}")
+
+
+def wait_for_port(host, port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start on {host}:{port}")
+
+
+def start_server(mode, port, workdir, **settings):
+    """Start server.py in workdir with a config.json for mode, port and any extra settings."""
+    with open(os.path.join(workdir, "config.json"), "w") as f:
+        json.dump(dict(settings, port=port, server_mode=mode), f)
+    return subprocess.Popen([sys.executable, os.path.abspath(SERVER)], cwd=workdir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connection-rate load generator for server.py")
+    parser.add_argument("--host", default=socket.gethostbyname(socket.gethostname()))
+    parser.add_argument("--port", type=int, default=9876)
+    parser.add_argument("--requests", type=int, default=2000, help="total connections to open")
+    parser.add_argument("--concurrency", type=int, default=200, help="connections in flight at once")
+    parser.add_argument("--request", default=DEFAULT_REQUEST, help="raw request line to send")
+    parser.add_argument("--modes", nargs="*", help="start server.py in each server_mode and compare")
+    args = parser.parse_args()
+
+    print(f"{'mode':>10} {'conn/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    if not args.modes:
+        report("external", *asyncio.run(run_load(args.host, args.port, args.request, args.requests, args.concurrency)))
+        return
+
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as workdir:
+            proc = start_server(mode, args.port, workdir)
+            try:
+                wait_for_port(args.host, args.port)
+                report(mode, *asyncio.run(run_load(args.host, args.port, args.request, args.requests, args.concurrency)))
+            finally:
+                proc.terminate()
+                proc.wait()
+
+
+if __name__ == "__main__":
+    main()
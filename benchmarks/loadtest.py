@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Headless load test for server.py, replacing runbank.sh.
+
+It discovers the bank's accounts with one Audit show_bank, then sends a
+weighted mix of commands for a fixed duration. Account choice follows a
+Zipf distribution, so a few accounts get most of the traffic (--zipf 0 is
+uniform). Two arrival models are supported:
+
+    closed   --concurrency workers, each on its own connection, send a
+             request, wait for the reply, then think for --think-ms
+    open     requests arrive at --rate per second (Poisson, or evenly with
+             --arrivals fixed) whatever the server's speed. Latency is
+             measured from each request's scheduled time, so queueing
+             behind a slow server is counted.
+
+Requests go over the framed protocol, pipelined on --connections sockets,
+or with --protocol text one connection per request like client.py.
+
+The report (stdout, and JSON with --output) has throughput, latency
+percentiles and rejected/error counts, overall and per command. With
+--baseline, a previous JSON report is compared against and the exit status
+is 1 if throughput fell or p99 rose by more than --tolerance.
+
+    python3 benchmarks/loadtest.py --start-server --duration 10 --output run.json
+    python3 benchmarks/loadtest.py --mode open --rate 2000 --mix write_heavy --baseline run.json
+    python3 benchmarks/loadtest.py --mix deposit=5,show_history=1 --zipf 1.2 --port 9876
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import protocol
+from loadgen import start_server, wait_for_port
+
+# Relative weights per command.
+MIXES = {
+    "default": {"deposit": 30, "withdraw": 20, "transfer_to": 20, "pay_loan_check": 5,
+                "pay_loan_transfer_to": 5, "show_history": 19, "show_bank": 1},
+    "read_heavy": {"deposit": 5, "withdraw": 5, "transfer_to": 5, "show_history": 80, "show_bank": 5},
+    "write_heavy": {"deposit": 40, "withdraw": 25, "transfer_to": 25, "pay_loan_check": 5, "pay_loan_transfer_to": 5},
+    "transfers": {"transfer_to": 100},
+}
+
+# Substrings of responses the server gives when it refuses a command
+# (insufficient funds, not a holder, ...); they count as rejected, not as errors.
+REJECTIONS = ("insufficient", "not found", "not been found", "only ", "must be", "denied", "does not exist",
+              "invalid", "cannot")
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def parse_mix(text):
+    """A preset name from MIXES, or "command=weight,command=weight"."""
+    if text in MIXES:
+        return MIXES[text]
+    mix = {}
+    for part in text.split(","):
+        command, _, weight = part.partition("=")
+        mix[command.strip()] = float(weight or 1)
+    return mix
+
+
+def parse_accounts(report):
+    """[(acct_num, acct_type, init_holder, [holders])] from a show_bank reply."""
+    accounts = []
+    for line in report.splitlines():
+        fields = line.split(None, 4)
+        if len(fields) < 5 or not fields[0].isdigit():
+            continue
+        holders = fields[4].split("  [")[0]
+        accounts.append((int(fields[0]), fields[1], fields[2], holders.split(", ")))
+    return accounts
+
+
+class Zipf:
+    """Picks items with probability proportional to 1 / rank ** s (s = 0 is uniform)."""
+
+    def __init__(self, items, s, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)   # so the hottest items are not always the lowest account numbers
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, len(self.items) + 1):
+            total += 1.0 / rank ** s
+            self.cumulative.append(total)
+        self.total = total
+
+    def pick(self, rng):
+        return self.items[bisect.bisect_left(self.cumulative, rng.random() * self.total)]
+
+
+class Workload:
+    """Turns the mix and the account list into request field dicts."""
+
+    def __init__(self, accounts, mix, zipf, seed):
+        self.rng = random.Random(seed)
+        checking = [account for account in accounts if account[1] == 'checking']
+        loans = [account for account in accounts if account[1] == 'loan']
+        if not checking:
+            raise ValueError("the bank has no checking accounts to drive")
+        self.all = Zipf(accounts, zipf, self.rng)
+        self.checking = Zipf(checking, zipf, self.rng)
+        self.loans = Zipf(loans, zipf, self.rng) if loans else None
+        if self.loans is None:
+            mix = {command: weight for command, weight in mix.items() if not command.startswith("pay_loan")}
+        self.commands = list(mix)
+        self.weights = [mix[command] for command in self.commands]
+
+    def next(self):
+        """(command, fields) for the next request."""
+        rng = self.rng
+        command = rng.choices(self.commands, self.weights)[0]
+        amount = rng.randint(1, 100)
+        if command in ("deposit", "withdraw"):
+            acct_num, _, holder, _ = self.checking.pick(rng)
+        elif command == "transfer_to":
+            holder = self.checking.pick(rng)[2]
+            acct_num = self.all.pick(rng)[0]
+        elif command in ("pay_loan_check", "pay_loan_transfer_to"):
+            acct_num, _, holder, _ = self.loans.pick(rng)
+        elif command == "show_history":
+            acct_num, _, holder, _ = self.all.pick(rng)
+            amount = 0
+        elif command == "show_bank":
+            acct_num, holder, amount = 0, "Audit", 0
+        else:
+            acct_num, _, holder, _ = self.all.pick(rng)
+        return command, {"user": holder, "command": command, "acct_num": acct_num, "amount": amount}
+
+
+class FramedClient:
+    """One framed connection with any number of requests in flight, matched to replies by id."""
+
+    async def connect(self, host, port):
+        reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write(protocol.MAGIC)
+        self.frames = protocol.AsyncFrameReader(reader)
+        self.pending = {}
+        self.next_id = 1
+        self.reader_task = asyncio.create_task(self._read_loop())
+        return self
+
+    async def request(self, fields):
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(protocol.pack_request(request_id, fields))
+        await self.writer.drain()
+        return await future
+
+    async def _read_loop(self):
+        try:
+            while True:
+                frame = await self.frames.read_frame()
+                if frame is None:
+                    break
+                request_id, body = frame
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(body.decode())
+        except (ConnectionError, protocol.ProtocolError):
+            pass
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("server closed the connection"))
+        self.pending.clear()
+
+    async def close(self):
+        self.writer.close()
+        self.reader_task.cancel()
+
+
+class TextClient:
+    """The original text protocol: one connection per request, as client.py does."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    async def request(self, fields):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(" ".join(f"{key}={value}" for key, value in fields.items()).encode())
+            response = b""
+            while not response.endswith(b"END"):
+                chunk = await reader.read(65536)
+                if not chunk:
+                    raise ConnectionError("server closed the connection")
+                response += chunk
+            return response[:-3].decode()
+        finally:
+            writer.close()
+
+    async def close(self):
+        pass
+
+
+class Recorder:
+    """Latencies and outcomes per command, for requests scheduled after the warm-up."""
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.latencies = {}
+        self.rejected = {}
+        self.errors = {}
+        self.dropped = 0
+
+    def record(self, command, scheduled, response=None, error=None):
+        if scheduled < self.measure_from:
+            return
+        if error is not None:
+            self.errors[command] = self.errors.get(command, 0) + 1
+            return
+        self.latencies.setdefault(command, []).append(time.perf_counter() - scheduled)
+        lowered = response[:120].lower()
+        if any(marker in lowered for marker in REJECTIONS):
+            self.rejected[command] = self.rejected.get(command, 0) + 1
+
+
+async def issue(client, command, fields, scheduled, recorder, timeout):
+    try:
+        response = await asyncio.wait_for(client.request(fields), timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        recorder.record(command, scheduled, error=e)
+        return
+    recorder.record(command, scheduled, response)
+
+
+async def closed_loop(clients, workload, recorder, args, stop):
+    async def worker(client):
+        while time.perf_counter() < stop:
+            command, fields = workload.next()
+            await issue(client, command, fields, time.perf_counter(), recorder, args.timeout)
+            if args.think_ms:
+                await asyncio.sleep(args.think_ms / 1000.0)
+
+    await asyncio.gather(*(worker(clients[i % len(clients)]) for i in range(args.concurrency)))
+
+
+async def open_loop(clients, workload, recorder, args, stop):
+    rng = random.Random(args.seed + 1)
+    tasks = set()
+    scheduled = time.perf_counter()
+    sent = 0
+    while True:
+        scheduled += rng.expovariate(args.rate) if args.arrivals == "poisson" else 1.0 / args.rate
+        if scheduled >= stop:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= args.max_inflight:
+            # The server has fallen this far behind; count the arrival but do not pile on.
+            if scheduled >= recorder.measure_from:
+                recorder.dropped += 1
+            continue
+        command, fields = workload.next()
+        task = asyncio.create_task(issue(clients[sent % len(clients)], command, fields, scheduled, recorder, args.timeout))
+        sent += 1
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies, rejected, errors, elapsed):
+    ordered = sorted(latencies)
+    summary = {
+        "requests": len(ordered) + errors,
+        "throughput": len(ordered) / elapsed if elapsed else 0.0,
+        "rejected": rejected,
+        "errors": errors,
+        "latency_ms": {f"p{pct:g}": percentile(ordered, pct) * 1000 if ordered else None for pct in PERCENTILES},
+    }
+    summary["latency_ms"]["mean"] = sum(ordered) / len(ordered) * 1000 if ordered else None
+    summary["latency_ms"]["max"] = ordered[-1] * 1000 if ordered else None
+    return summary
+
+
+def build_report(recorder, elapsed, args, target):
+    commands = sorted(set(recorder.latencies) | set(recorder.errors))
+    per_command = {command: summarize(recorder.latencies.get(command, []), recorder.rejected.get(command, 0),
+                                      recorder.errors.get(command, 0), elapsed)
+                   for command in commands}
+    total = summarize([latency for latencies in recorder.latencies.values() for latency in latencies],
+                      sum(recorder.rejected.values()), sum(recorder.errors.values()), elapsed)
+    total["dropped"] = recorder.dropped
+    settings = {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}
+    return {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+        "target": target,
+        "settings": settings,
+        "measured_seconds": elapsed,
+        "total": total,
+        "commands": per_command,
+    }
+
+
+def print_report(report):
+    def row(label, summary):
+        latency = summary["latency_ms"]
+        cells = [f"{latency[key]:>9.2f}" if latency[key] is not None else f"{'-':>9}" for key in ("p50", "p90", "p99", "p99.9")]
+        print(f"{label:<22} {summary['requests']:>9} {summary['throughput']:>10.0f} {' '.join(cells)} "
+              f"{summary['rejected']:>8} {summary['errors']:>7}")
+
+    settings = report["settings"]
+    load = f"rate {settings['rate']}/s {settings['arrivals']}" if settings["mode"] == "open" else \
+        f"concurrency {settings['concurrency']}"
+    print(f"{report['target']}  {settings['mode']} loop, {load}, mix {settings['mix']}, zipf {settings['zipf']}, "
+          f"{report['measured_seconds']:.1f} s measured")
+    print(f"{'command':<22} {'requests':>9} {'req/s':>10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'p99.9 ms':>9} "
+          f"{'rejected':>8} {'errors':>7}")
+    for command, summary in report["commands"].items():
+        row(command, summary)
+    row("total", report["total"])
+    if report["total"]["dropped"]:
+        print(f"dropped arrivals (over --max-inflight): {report['total']['dropped']}")
+
+
+def compare(report, baseline, tolerance):
+    """Regression messages for report against baseline (empty if none)."""
+    problems = []
+    for label, current, previous in [("total", report["total"], baseline["total"])] + [
+            (command, summary, baseline["commands"][command])
+            for command, summary in report["commands"].items() if command in baseline["commands"]]:
+        if previous["throughput"] and current["throughput"] < previous["throughput"] * (1 - tolerance):
+            problems.append(f"{label}: throughput {current['throughput']:.0f}/s, was {previous['throughput']:.0f}/s")
+        before, after = previous["latency_ms"]["p99"], current["latency_ms"]["p99"]
+        if before and after and after > before * (1 + tolerance):
+            problems.append(f"{label}: p99 {after:.2f} ms, was {before:.2f} ms")
+    return problems
+
+
+async def run(args, host, port):
+    discovery = await FramedClient().connect(host, port)
+    accounts = parse_accounts(await discovery.request({"user": "Audit", "command": "show_bank", "acct_num": 0}))
+    await discovery.close()
+    workload = Workload(accounts, parse_mix(args.mix), args.zipf, args.seed)
+
+    if args.protocol == "text":
+        clients = [TextClient(host, port)]
+    else:
+        count = args.connections or (args.concurrency if args.mode == "closed" else 8)
+        clients = [await FramedClient().connect(host, port) for _ in range(count)]
+    start = time.perf_counter()
+    recorder = Recorder(start + args.warmup)
+    stop = start + args.warmup + args.duration
+    if args.mode == "closed":
+        await closed_loop(clients, workload, recorder, args, stop)
+    else:
+        await open_loop(clients, workload, recorder, args, stop)
+    elapsed = min(time.perf_counter(), stop) - recorder.measure_from
+    for client in clients:
+        await client.close()
+    return build_report(recorder, elapsed, args, f"{host}:{port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless load test for server.py with JSON reports")
+    parser.add_argument("--host", default=socket.gethostbyname(socket.gethostname()))
+    parser.add_argument("--port", type=int, default=9876)
+    parser.add_argument("--start-server", action="store_true", help="run server.py from a temporary directory")
+    parser.add_argument("--server-mode", default="threaded", help="server_mode for --start-server")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=JSON",
+                        help="extra config.json setting for --start-server, e.g. --set shards=4")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--concurrency", type=int, default=16, help="closed loop: workers")
+    parser.add_argument("--think-ms", type=float, default=0, help="closed loop: pause between a reply and the next request")
+    parser.add_argument("--rate", type=float, default=1000, help="open loop: requests per second")
+    parser.add_argument("--arrivals", choices=("poisson", "fixed"), default="poisson")
+    parser.add_argument("--max-inflight", type=int, default=10000, help="open loop: outstanding requests before arrivals are dropped")
+    parser.add_argument("--connections", type=int, default=0,
+                        help="framed connections (default: one per worker closed loop, 8 open loop)")
+    parser.add_argument("--protocol", choices=("framed", "text"), default="framed")
+    parser.add_argument("--mix", default="default", help=f"preset ({', '.join(MIXES)}) or command=weight,...")
+    parser.add_argument("--zipf", type=float, default=0.99, help="account skew exponent (0: uniform)")
+    parser.add_argument("--duration", type=float, default=10, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds run before measuring")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before a request counts as an error")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed fractional regression (default 0.1)")
+    args = parser.parse_args()
+
+    host, port = args.host, args.port
+    proc = workdir = None
+    if args.start_server:
+        settings = {key: json.loads(value) for key, _, value in (item.partition("=") for item in args.set)}
+        workdir = tempfile.TemporaryDirectory()
+        settings = dict({"auto_interest_interval": 3600}, **settings)
+        proc = start_server(args.server_mode, port, workdir.name, **settings)
+    try:
+        wait_for_port(host, port)
+        report = asyncio.run(run(args, host, port))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+            workdir.cleanup()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differ = [key for key in ("mode", "concurrency", "rate", "arrivals", "protocol", "mix", "zipf", "think_ms")
+                  if baseline["settings"].get(key) != report["settings"][key]]
+        if differ:
+            print(f"note: baseline was run with different {', '.join(differ)}")
+        problems = compare(report, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
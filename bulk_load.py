@@ -0,0 +1,244 @@
+"""
+Bulk account import: seeds a Bank from a CSV or Parquet file instead of
+one create_account at a time.
+
+Accounts file columns (CSV needs a header row):
+
+    acct_num, acct_type, init_acct_holder, acct_holder, balance
+
+acct_holder lists every holder separated by ";" (a list column in Parquet).
+If it is empty the initial holder is the only holder.
+
+History file columns, optional:
+
+    acct_num, ts, actor, operation, amount, counterparty
+
+ts is epoch seconds and counterparty may be empty. Each account's rows must
+be in time order and no older than the history it already has, because
+history queries rely on it.
+
+Files are streamed. Every row is validated in one pass against hash sets:
+account numbers must be unused, and one holder opens at most one account
+of each type. Rejected rows are counted and skipped. Valid accounts are
+indexed CHUNK_ROWS at a time with one commit per chunk (Bank._index_accounts),
+and history rows are appended under one store lock per chunk.
+
+Set "seed_file" (and "seed_history_file") in config.json to seed the
+server from a file instead of the built-in SEED_ACCOUNTS. To import into a
+persistent bank, run this module against its data_dir. It recovers the
+current state, adds the file and writes a snapshot:
+
+    python3 bulk_load.py accounts.csv --history history.csv [--replace]
+"""
+import argparse
+import contextlib
+import csv
+import gc
+import logging
+import time
+from operator import itemgetter
+
+from history_store import I64_MAX, I64_MIN, check_entry
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet support is optional; CSV always works
+    pq = None
+
+ACCOUNT_COLUMNS = ("acct_num", "acct_type", "init_acct_holder", "acct_holder", "balance")
+HISTORY_COLUMNS = ("acct_num", "ts", "actor", "operation", "amount", "counterparty")
+ACCT_TYPES = ("checking", "loan")
+HOLDER_SEPARATOR = ";"
+CHUNK_ROWS = 65536
+MAX_ERRORS = 20   # rejected rows described in the report; the rest are only counted
+
+
+class LoadError(Exception):
+    """Raised when a file cannot be read as an accounts or history file."""
+
+
+@contextlib.contextmanager
+def paused_gc():
+    """
+    Suspend the cyclic garbage collector while millions of long-lived
+    objects are created; otherwise it rescans the growing heap over and
+    over (about a third of a million-account load).
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def read_rows(path, columns):
+    """Yield each row of a CSV or Parquet file as a tuple in columns order."""
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise LoadError(f"{path}: reading Parquet files needs pyarrow")
+        source = pq.ParquetFile(path)
+        present = [column for column in columns if column in source.schema_arrow.names]
+        missing = [column for column in columns if column not in present and column != "counterparty"]
+        if missing:
+            raise LoadError(f"{path}: missing column(s) {', '.join(missing)}")
+        for batch in source.iter_batches(batch_size=CHUNK_ROWS, columns=present):
+            data = batch.to_pydict()
+            yield from zip(*(data.get(column, [None] * batch.num_rows) for column in columns))
+        return
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader, [])]
+        missing = [column for column in columns if column not in header and column != "counterparty"]
+        if missing:
+            raise LoadError(f"{path}: missing column(s) {', '.join(missing)}")
+        positions = [header.index(column) if column in header else None for column in columns]
+        pick = itemgetter(*positions) if None not in positions else None
+        for row in reader:
+            if len(row) == len(header) and pick is not None:
+                yield pick(row)
+            elif row:
+                yield tuple(row[i] if i is not None and i < len(row) else None for i in positions)
+
+
+def load_accounts(bank, path, owns=None):
+    """
+    Add every valid account in path to bank (only those owns(acct_num)
+    accepts, if given). Returns a report dict.
+    """
+    start = time.perf_counter()
+    taken = set(bank.accounts_by_num)
+    opened = {(account.init_acct_holder, account.acct_type) for account in bank.accounts}
+    loaded = rejected = 0
+    errors = []
+    chunk = []
+    for line, row in enumerate(read_rows(path, ACCOUNT_COLUMNS), start=2):
+        try:
+            acct_num, acct_type, init_holder, holders, balance = row
+            acct_num = int(acct_num)
+            balance = int(balance)
+            if owns is not None and not owns(acct_num):
+                continue
+            if not (I64_MIN <= acct_num <= I64_MAX and I64_MIN <= balance <= I64_MAX):
+                raise ValueError("acct_num or balance does not fit in 64 bits")
+            if acct_type not in ACCT_TYPES:
+                raise ValueError(f"unknown acct_type {acct_type!r}")
+            if not init_holder:
+                raise ValueError("no init_acct_holder")
+            if isinstance(holders, str):
+                holders = [holder.strip() for holder in holders.split(HOLDER_SEPARATOR) if holder.strip()]
+            holders = list(holders or [init_holder])
+            if init_holder not in holders:
+                raise ValueError(f"init_acct_holder {init_holder} is not among the holders")
+            if acct_num in taken:
+                raise ValueError(f"account number {acct_num} is already used")
+            if (init_holder, acct_type) in opened:
+                raise ValueError(f"{init_holder} already opened a {acct_type} account")
+        except (TypeError, ValueError) as e:
+            rejected += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(f"{path}:{line}: {e}")
+            continue
+        taken.add(acct_num)
+        opened.add((init_holder, acct_type))
+        chunk.append(bank.new_account(acct_num, acct_type, init_holder, holders, balance))
+        if len(chunk) == CHUNK_ROWS:
+            loaded += add_chunk(bank, chunk)
+            chunk = []
+    loaded += add_chunk(bank, chunk)
+    return report("accounts", path, loaded, rejected, errors, start)
+
+
+def add_chunk(bank, accounts):
+    with bank.index_lock:
+        bank.accounts.extend(accounts)
+        bank._index_accounts(accounts)
+    return len(accounts)
+
+
+def load_history(bank, path, owns=None):
+    """Append every valid history row in path to bank's history store. Returns a report dict."""
+    start = time.perf_counter()
+    last_ts = {}
+    loaded = rejected = 0
+    errors = []
+    chunk = []
+    for line, row in enumerate(read_rows(path, HISTORY_COLUMNS), start=2):
+        try:
+            acct_num, ts, actor, operation, amount, counterparty = row
+            acct_num = int(acct_num)
+            if owns is not None and not owns(acct_num):
+                continue
+            if acct_num not in bank.accounts_by_num:
+                raise ValueError(f"unknown account {acct_num}")
+            ts = float(ts)
+            if acct_num not in last_ts:
+                last_ts[acct_num] = bank.history.last_ts(acct_num)
+            if last_ts[acct_num] is not None and ts < last_ts[acct_num]:
+                raise ValueError(f"entry for {acct_num} is older than the one before it")
+            entry = (actor, operation, int(amount))
+            if counterparty not in (None, ""):
+                entry += (int(counterparty),)
+            # Checked here, so append_rows never refuses a row halfway through a chunk.
+            check_entry(acct_num, entry)
+        except (TypeError, ValueError) as e:
+            rejected += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(f"{path}:{line}: {e}")
+            continue
+        last_ts[acct_num] = ts
+        chunk.append((acct_num, ts, entry))
+        if len(chunk) == CHUNK_ROWS:
+            bank.history.append_rows(chunk)
+            loaded += len(chunk)
+            chunk = []
+    bank.history.append_rows(chunk)
+    loaded += len(chunk)
+    return report("history rows", path, loaded, rejected, errors, start)
+
+
+def report(kind, path, loaded, rejected, errors, start):
+    seconds = time.perf_counter() - start
+    rate = (loaded + rejected) / seconds if seconds else 0.0
+    logging.info("Loaded %s %s from %s (%s rejected) in %.2f s, %.0f rows/s", loaded, kind, path, rejected, seconds, rate)
+    for error in errors:
+        logging.warning("Rejected %s", error)
+    return {"loaded": loaded, "rejected": rejected, "errors": errors, "seconds": seconds, "rows_per_second": rate}
+
+
+def load_file(bank, accounts_path, history_path=None, owns=None):
+    """Load an accounts file and, if given, its history file. Returns (accounts report, history report or None)."""
+    with paused_gc():
+        accounts = load_accounts(bank, accounts_path, owns)
+        history = load_history(bank, history_path, owns) if history_path else None
+    return accounts, history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import accounts (and history) into the persistent bank in data_dir")
+    parser.add_argument("accounts", help="accounts CSV or Parquet file")
+    parser.add_argument("--history", help="history CSV or Parquet file")
+    parser.add_argument("--data-dir", help="bank data directory (default: data_dir from config.json)")
+    parser.add_argument("--replace", action="store_true", help="drop the bank's current accounts first")
+    args = parser.parse_args()
+
+    import persistence
+    import server
+    config = dict(server.config, persistence=True, snapshot_interval=0)
+    if args.data_dir:
+        config["data_dir"] = args.data_dir
+    bank = server.Bank()
+    persistence.attach(bank, config)
+    if args.replace:
+        bank.reset_accounts()
+    try:
+        load_file(bank, args.accounts, args.history)
+    except LoadError as e:
+        raise SystemExit(str(e))
+    persistence.snapshot(bank)
+    bank.wal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,16 @@ import sys
 import socket
 import time
 import argparse
+import itertools
+import json
+import queue
+import random
+import threading
+from contextlib import contextmanager
 from colorama import init, Fore, Style
 
+import protocol
+
 # Initialize colorama for colored terminal output.
 init(autoreset=True)
 
@@ -13,53 +21,363 @@ HOST = socket.gethostbyname(socket.gethostname())
 PORT = 9876
 ADDR = (HOST, PORT)
 
-def send_request(user_input, retries=3, delay=2):
+class ConnectionPool:
+    """
+    A small pool of persistent framed connections to the server.
+
+    Connections are opened on demand (with exponential-backoff retries),
+    kept alive with SO_KEEPALIVE, and reused across requests. A connection
+    that fails mid-request is discarded rather than returned to the pool.
+    The request is re-sent on a new connection only if it carries an
+    idempotency key (protocol.REQUEST_KEY): the server answers the repeat
+    with the original response, so a command that already ran does not run
+    twice. Requests without a key are not re-sent. A request the server
+    refused as busy or rate limited is re-sent after the delay it asked for.
+    """
+
+    def __init__(self, addr=ADDR, size=4, retries=5, base_delay=0.1, max_delay=5.0, verbose=True):
+        self.addr = addr
+        self.size = size
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.verbose = verbose
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.open_count = 0
+
+    def _connect(self):
+        delay = self.base_delay
+        for attempt in range(1, self.retries + 1):
+            try:
+                client_socket = socket.create_connection(self.addr)
+                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return protocol.FramedConnection(client_socket)
+            except OSError:
+                if attempt == self.retries:
+                    raise
+                # Full jitter keeps many reconnecting clients from retrying in lockstep.
+                sleep_for = random.uniform(0, delay)
+                if self.verbose:
+                    print(Fore.YELLOW + f"Connection failed, retrying in {sleep_for:.2f} seconds... (Attempt {attempt}/{self.retries})")
+                time.sleep(sleep_for)
+                delay = min(delay * 2, self.max_delay)
+
+    def acquire(self):
+        """Return an idle connection, opening a new one if none is available."""
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            self.open_count += 1
+        try:
+            return self._connect()
+        except OSError:
+            with self.lock:
+                self.open_count -= 1
+            raise
+
+    def release(self, connection, broken=False):
+        """Return a connection to the pool (or close it if broken or the pool is full)."""
+        if broken or self.idle.qsize() >= self.size:
+            connection.close()
+            with self.lock:
+                self.open_count -= 1
+        else:
+            self.idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            # The connection may hold a half-read response; never reuse it.
+            self.release(connection, broken=True)
+            raise
+        self.release(connection)
+
+    def send(self, user_input):
+        """Send one request on a pooled connection and return its response."""
+        for attempt in range(1, self.retries + 1):
+            connection = self.acquire()
+            try:
+                response = connection.request(user_input)
+            except OSError:
+                self.release(connection, broken=True)
+                if protocol.REQUEST_KEY not in user_input or attempt == self.retries:
+                    raise
+                if self.verbose:
+                    print(Fore.YELLOW + f"Connection lost before the reply, re-sending... (Attempt {attempt}/{self.retries})")
+                continue
+            except BaseException:
+                self.release(connection, broken=True)
+                raise
+            self.release(connection)
+            wait = protocol.retry_after(response)
+            if wait is None or attempt == self.retries:
+                return response
+            # Shed or rate limited before it ran: safe to send again, with or without a key.
+            if self.verbose:
+                print(Fore.YELLOW + f"{response}... (Attempt {attempt}/{self.retries})")
+            time.sleep(wait * random.uniform(1, 1.5))
+
+    def send_batch(self, requests, depth=256):
+        """
+        Pipeline requests over one pooled connection, at most `depth` in
+        flight at a time, and return the responses in request order. As in
+        send(), requests shed or rate limited before they ran are sent
+        again after the server's retry-after time, before the next window.
+        """
+        responses = []
+        with self.connection() as connection:
+            for i in range(0, len(requests), depth):
+                responses.extend(self._send_window(connection, requests[i:i + depth]))
+        return responses
+
+    def _send_window(self, connection, requests):
+        responses = connection.request_many(requests)
+        for attempt in range(1, self.retries):
+            waits = [(index, protocol.retry_after(response)) for index, response in enumerate(responses)]
+            waits = [(index, wait) for index, wait in waits if wait is not None]
+            if not waits:
+                break
+            if self.verbose:
+                print(Fore.YELLOW + f"{len(waits)} requests not admitted, re-sending... (Attempt {attempt}/{self.retries})")
+            time.sleep(max(wait for _, wait in waits) * random.uniform(1, 1.5))
+            retried = connection.request_many([requests[index] for index, _ in waits])
+            for (index, _), response in zip(waits, retried):
+                responses[index] = response
+        return responses
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class RoutingPool:
     """
-    Connects to the server, sends the request formatted as a string,
-    receives the response (handling multi-chunk messages ending with "END"),
-    and returns the full response.
-    
-    Implements retry logic if the connection fails.
+    Sends read commands (protocol.READ_COMMANDS) to the primary's read
+    replicas in turn and everything else to the primary. The replicas are
+    listed by the primary's show_replicas, asked again every `refresh`
+    seconds. A read goes to the primary instead when no replica is up, and
+    when the replica it was sent to cannot be reached or refuses it for
+    being too far behind.
     """
-    attempt = 0
-    while attempt < retries:
+
+    def __init__(self, addr=ADDR, size=4, refresh=5.0, retries=5, base_delay=0.1, verbose=True):
+        self.primary = ConnectionPool(addr, size, retries, base_delay, verbose=verbose)
+        self.size = size
+        self.refresh = refresh
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.replicas = {}        # "host:port" -> ConnectionPool
+        self.order = []           # the replicas' pools, round-robin order
+        self.turn = itertools.count()
+        self.refreshed = 0.0
+
+    def send(self, user_input):
+        if user_input.get('command') in protocol.READ_COMMANDS:
+            replica = self._next_replica()
+            if replica is not None:
+                try:
+                    response = replica.send(user_input)
+                    if not response.startswith(protocol.REPLICA_REFUSED):
+                        return response
+                except OSError:
+                    pass
+        return self.primary.send(user_input)
+
+    def _next_replica(self):
+        if time.monotonic() - self.refreshed > self.refresh:
+            self._refresh()
+        order = self.order
+        return order[next(self.turn) % len(order)] if order else None
+
+    def _refresh(self):
+        self.refreshed = time.monotonic()
         try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect(ADDR)
-            break
-        except socket.error as e:
-            print(Fore.YELLOW + f"Connection failed, retrying in {delay} seconds... (Attempt {attempt+1}/{retries})")
-            attempt += 1
-            time.sleep(delay)
+            response = self.primary.send({'user': 'client', 'command': 'show_replicas', 'acct_num': 0})
+        except OSError:
+            return
+        addresses = response[len("Replicas: "):].split(", ") if response.startswith("Replicas: ") else []
+        with self.lock:
+            replicas = {}
+            for address in addresses:
+                pool = self.replicas.pop(address, None)
+                if pool is None:
+                    host, port = address.rsplit(":", 1)
+                    # One quick attempt: an unreachable replica is skipped, not waited for.
+                    pool = ConnectionPool((host, int(port)), self.size, retries=1, verbose=self.verbose)
+                replicas[address] = pool
+            for pool in self.replicas.values():
+                pool.close()
+            self.replicas = replicas
+            self.order = list(replicas.values())
+
+    def close(self):
+        self.primary.close()
+        for pool in self.replicas.values():
+            pool.close()
+
+def send_request(user_input, retries=3, delay=2):
+    """
+    Connects to the server, sends the request as a length-prefixed frame
+    (see protocol.py), and returns the full response.
+
+    Implements retry logic (exponential backoff starting at `delay` seconds)
+    if the connection fails. The request gets an idempotency key, so it is
+    also re-sent if the connection drops before the reply arrives. Read
+    commands go to a read replica of the server if it has any (see
+    RoutingPool).
+    """
+    if user_input.get('command') in protocol.READ_COMMANDS:
+        pool = RoutingPool(size=1, retries=retries, base_delay=delay)
     else:
+        pool = ConnectionPool(size=1, retries=retries, base_delay=delay)
+    try:
+        return pool.send(protocol.with_request_key(user_input))
+    except OSError:
         print(Fore.RED + "Failed to connect to the server after multiple attempts.")
         sys.exit(1)
+    finally:
+        pool.close()
 
-    # Format and send the user input as a request string
-    request_str = " ".join(f"{key}={value}" for key, value in user_input.items())
-    client_socket.send(request_str.encode())
+def subscribe(user_input):
+    """
+    Print a subscribe stream's events as they arrive (one JSON object per
+    line, see events.py). If the connection drops, or the server cuts the
+    stream off because this client fell behind, subscribe again from the
+    last commit printed, so no event is missed or repeated.
+    """
+    pool = ConnectionPool(size=1)
+    request = dict(user_input)
+    while True:
+        try:
+            connection = pool.acquire()
+        except OSError:
+            print(Fore.RED + "Failed to connect to the server after multiple attempts.")
+            sys.exit(1)
+        try:
+            if not follow(connection, request):
+                return
+        except OSError:
+            print(Fore.YELLOW + "Connection lost, subscribing again...")
+        finally:
+            pool.release(connection, broken=True)
 
-    # Receive data in chunks until we see the "END" marker
-    response = ""
+def follow(connection, request):
+    """
+    Print one subscribe stream until it ends. request['from'] is kept at the
+    last commit seen; returns True if the stream should be resumed from it.
+    """
+    connection.send(request)
     while True:
-        chunk = client_socket.recv(1024).decode()
-        if "END" in chunk:
-            response += chunk.replace("END", "")
-            break
-        response += chunk
+        _, text = connection.recv()
+        if not text.startswith("{"):
+            print_response(text)  # refused, e.g. not an account holder
+            return False
+        for line in text.splitlines():
+            event = json.loads(line)
+            if event.get('lagged'):
+                request['from'] = event['resume_from']
+                print(Fore.YELLOW + f"Fell behind the server, resuming from commit {request['from']}")
+                return True
+            if 'seq' in event:
+                request['from'] = event['seq']
+                if 'acct_num' in event:
+                    print(line)
+
+def parse_command(tokens):
+    """
+    Build a request from CLI-style tokens: user command [acct_num] [amount],
+    plus optional key=value tokens (e.g. operation=deposit).
+    """
+    positional = [token for token in tokens if '=' not in token]
+    if len(positional) < 2:
+        raise ValueError(f"expected 'user command [acct_num] [amount]', got {' '.join(tokens)!r}")
+    user_input = {
+        'user': positional[0],
+        'command': positional[1],
+        'acct_num': int(positional[2]) if len(positional) > 2 else 0,
+        'amount': int(positional[3]) if len(positional) > 3 else 0
+    }
+    for token in tokens:
+        if '=' in token:
+            key, value = token.split('=', 1)
+            user_input[key] = value
+    return user_input
+
+def read_commands(path):
+    """Yield requests from a command file (or stdin for "-"); blank lines and # comments are skipped."""
+    stream = sys.stdin if path == "-" else open(path)
+    try:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield parse_command(line.split())
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def is_error(response):
+    return any(err in response.lower() for err in ["error", "insufficient", "denied", "failed", "busy", "rate limit"])
+
+def print_response(response):
+    # Determine the color of the output:
+    # If the response indicates an error (e.g., "error", "insufficient", "denied"), print in red.
+    if is_error(response):
+        print(Fore.RED + "******************************************************************")
+        print(response)
+        print("******************************************************************")
+    else:
+        print(Fore.GREEN + "******************************************************************")
+        print(response)
+        print("******************************************************************")
 
-    client_socket.close()
-    return response
+def replay(path, batch_size, quiet):
+    """Stream every command in `path` over one pipelined connection."""
+    requests = list(read_commands(path))
+    pool = ConnectionPool(size=1)
+    start = time.perf_counter()
+    try:
+        responses = pool.send_batch(requests, depth=batch_size)
+    finally:
+        pool.close()
+    elapsed = time.perf_counter() - start
+    if not quiet:
+        for response in responses:
+            print_response(response)
+    errors = sum(1 for response in responses if is_error(response))
+    print(f"Replayed {len(responses)} commands in {elapsed:.3f} seconds "
+          f"({len(responses) / elapsed if elapsed else 0:.0f} commands/sec, {errors} error responses)")
 
 def main():
     # Use argparse for enhanced CLI and help messages.
     parser = argparse.ArgumentParser(description="Distributed System Project Client")
-    parser.add_argument("user", help="Username for the transaction")
-    parser.add_argument("command", help="Command to execute (e.g., deposit, withdraw, create_account, etc.)")
+    parser.add_argument("user", nargs="?", help="Username for the transaction")
+    parser.add_argument("command", nargs="?", help="Command to execute (e.g., deposit, withdraw, create_account, etc.)")
     parser.add_argument("acct_num", nargs="?", default=0, type=int, help="Account number (default: 0)")
     parser.add_argument("amount", nargs="?", default=0, type=int, help="Transaction amount (default: 0)")
+    parser.add_argument("-o", "--option", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra request field, e.g. -o cursor=100 -o limit=50 for show_history paging, "
+                             "or -o ops=deposit,withdraw for subscribe")
+    parser.add_argument("-f", "--file", help="Replay commands from a file ('-' for stdin), one "
+                                             "'user command [acct_num] [amount]' per line, over one connection")
+    parser.add_argument("--batch-size", type=int, default=256, help="Requests in flight at once when replaying")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print the replay summary")
     args = parser.parse_args()
 
+    if args.file:
+        replay(args.file, args.batch_size, args.quiet)
+        return
+    if args.user is None or args.command is None:
+        parser.error("user and command are required unless --file is given")
+
     # Prepare the request data as a dictionary.
     user_input = {
         'user': args.user,
@@ -67,20 +385,17 @@ def main():
         'acct_num': args.acct_num,
         'amount': args.amount
     }
+    for option in args.option:
+        key, value = option.split('=', 1)
+        user_input[key] = value
+
+    if args.command == "subscribe":
+        subscribe(user_input)
+        return
 
     # Send the request to the server and retrieve the response.
     response = send_request(user_input)
-
-    # Determine the color of the output:
-    # If the response indicates an error (e.g., "error", "insufficient", "denied"), print in red.
-    if any(err in response.lower() for err in ["error", "insufficient", "denied", "failed"]):
-        print(Fore.RED + "******************************************************************")
-        print(response)
-        print("******************************************************************")
-    else:
-        print(Fore.GREEN + "******************************************************************")
-        print(response)
-        print("******************************************************************")
+    print_response(response)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,186 @@
+"""
+Change-data-capture stream: pushes committed account changes to
+subscribers over a long-lived connection (the subscribe command).
+
+Bank.publish hands every commit to ChangeFeed.publish while it holds the
+commit lock, so each subscriber sees events in commit order. An event is
+one JSON line:
+
+    {"seq": 42, "ts": 1760800000.123456, "acct_num": 1001, "delta": -50,
+     "actor": "Alice", "op": "withdraw", "amount": 50}
+
+with "counterparty" added for transfers. seq is the commit number, shared
+by the events of one commit, and every chunk (or frame) ends on a commit
+boundary. The stream opens with {"subscribed": true, "seq": <commit>}, the
+commit it starts after. A client that reconnects with from=<seq of the last chunk it
+processed> gets everything after it, provided those commits are still in
+the Bank's recent-commit ring (change_log_size). Bulk imports are not
+streamed.
+
+Writers never wait for subscribers. A subscription buffers at most
+max_events events (or one commit, if it has more). When a consumer falls
+that far behind, the writers stop
+feeding it. It is then sent what it has buffered and a final line
+{"lagged": true, "resume_from": <seq>}, and its stream ends.
+"""
+import asyncio
+import collections
+import json
+import threading
+
+from metrics import METRICS
+
+HEARTBEAT_SECONDS = 15   # an idle stream sends {"heartbeat": true} this often, so dead clients are noticed
+BATCH_EVENTS = 512       # events per chunk, rounded up to the end of a commit
+
+HEARTBEAT = json.dumps({"heartbeat": True}) + "\n"
+
+
+class ChangeFeed:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Replaced on every change, never mutated, so publish iterates it without a lock.
+        self.subscriptions = ()
+
+    def publish(self, seq, ts, changes):
+        """Offer a commit's (account, delta, entry) changes to every subscription (caller holds commit_lock)."""
+        for subscription in self.subscriptions:
+            subscription.offer(seq, ts, changes)
+
+    def add(self, subscription):
+        with self.lock:
+            self.subscriptions += (subscription,)
+
+    def remove(self, subscription):
+        with self.lock:
+            self.subscriptions = tuple(s for s in self.subscriptions if s is not subscription)
+
+
+def event_line(seq, ts, change):
+    account, delta, entry = change
+    event = {"seq": seq, "ts": round(ts, 6), "acct_num": account.acct_num, "delta": delta}
+    if entry is not None:
+        event["actor"], event["op"], event["amount"] = entry[:3]
+        if len(entry) > 3:
+            event["counterparty"] = entry[3]
+    return json.dumps(event)
+
+
+class Subscription:
+    """
+    One subscriber's stream: the commits it resumed after (backlog, taken
+    from the Bank's ring), then live events, both filtered by account
+    number and operation. Iterate it for text chunks (threaded handlers) or
+    use stream() on an event loop.
+    """
+
+    def __init__(self, feed, acct_nums, ops, max_events, position, backlog):
+        self.feed = feed
+        self.acct_nums = acct_nums   # set of acct_nums, or None for every account
+        self.ops = ops               # set of operations, or None for every one
+        self.max_events = max_events
+        self.position = position     # seq of the last chunk handed out: the resume offset
+        self.backlog = collections.deque(backlog)   # (seq, ts, changes) ring entries, oldest first
+        self.lock = threading.Lock()
+        self.events = collections.deque()           # (seq, ts, change), filled by offer()
+        self.ready = threading.Event()
+        self.wake = None    # set by stream(): wakes the event loop
+        self.lagged = False
+
+    def wants(self, change):
+        if self.acct_nums is not None and change[0].acct_num not in self.acct_nums:
+            return False
+        return self.ops is None or (change[2] is not None and change[2][1] in self.ops)
+
+    def offer(self, seq, ts, changes):
+        """Buffer the changes this subscription wants (a writer, holding commit_lock)."""
+        wanted = [change for change in changes if self.wants(change)]
+        if not wanted:
+            return
+        with self.lock:
+            if self.lagged:
+                return
+            if self.events and len(self.events) + len(wanted) > self.max_events:
+                self.lagged = True
+                self.feed.remove(self)
+                METRICS.inc("bank_subscriptions_lagged_total")
+            else:
+                was_empty = not self.events
+                self.events.extend((seq, ts, change) for change in wanted)
+                if not was_empty:
+                    return  # the consumer has not drained the last wake-up yet
+        self.ready.set()
+        wake = self.wake
+        if wake is not None:
+            wake()
+
+    def take(self):
+        """The next batch of events (whole commits), and whether the stream ends after it."""
+        batch = []
+        while self.backlog and len(batch) < BATCH_EVENTS:
+            seq, ts, changes = self.backlog.popleft()
+            if changes is not None:
+                batch.extend((seq, ts, change) for change in changes if self.wants(change))
+        if batch or self.backlog:
+            return batch, False
+        with self.lock:
+            events = self.events
+            while events and (len(batch) < BATCH_EVENTS or events[0][0] == batch[-1][0]):
+                batch.append(events.popleft())
+            if not events:
+                self.ready.clear()
+            return batch, self.lagged and not events
+
+    def chunk(self, batch):
+        self.position = batch[-1][0]
+        METRICS.inc("bank_events_sent_total", len(batch))
+        return "".join(event_line(*event) + "\n" for event in batch)
+
+    def start(self):
+        return json.dumps({"subscribed": True, "seq": self.position}) + "\n"
+
+    def end(self):
+        return json.dumps({"lagged": True, "resume_from": self.position}) + "\n"
+
+    def close(self):
+        self.wake = None
+        self.feed.remove(self)
+
+    def __iter__(self):
+        """Text chunks for a thread: blocks until events arrive; ends only when the subscription lags."""
+        try:
+            yield self.start()
+            while True:
+                batch, done = self.take()
+                if batch:
+                    yield self.chunk(batch)
+                if done:
+                    yield self.end()
+                    return
+                if not batch and not self.ready.wait(HEARTBEAT_SECONDS):
+                    yield HEARTBEAT
+        finally:
+            self.close()
+
+    async def stream(self):
+        """Async generator of text chunks, woken by offer() through the event loop."""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        self.wake = lambda: loop.call_soon_threadsafe(ready.set)
+        try:
+            yield self.start()
+            while True:
+                ready.clear()
+                batch, done = self.take()
+                if batch:
+                    yield self.chunk(batch)
+                if done:
+                    yield self.end()
+                    return
+                if not batch:
+                    try:
+                        await asyncio.wait_for(ready.wait(), HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield HEARTBEAT
+        finally:
+            self.close()
@@ -1,24 +1,90 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
+import ast
+import queue
+import re
 import socket
 import threading
 
+import client
+import protocol
+
 # Server address
 HOST = socket.gethostbyname(socket.gethostname())
 PORT = 9876
 ADDR = (HOST, PORT)
 
+POLL_MS = 50          # how often the Tk loop picks up replies from the worker
+PAGE_ROWS = 200       # accounts or history entries fetched per page
+REFRESH_MS = 2000     # auto-refresh period for the show_bank view
+
+BANK_COLUMNS = ("acct_num", "acct_type", "init_holder", "balance", "acct_holder")
+HISTORY_COLUMNS = ("time", "actor", "operation", "amount", "counterparty")
+
+PAGE_HEADER = re.compile(r"(\d+) accounts as of commit ([\d.]+):")
+CHANGES_HEADER = re.compile(r"\d+ accounts changed since commit [\d.]+ \(now at commit ([\d.]+)\):")
+MORE = re.compile(r"repeat with cursor=(\S+)")
+
+
+class RequestWorker(threading.Thread):
+    """
+    Sends requests one at a time over a single pooled connection (which
+    reconnects when needed) and queues each reply with its callback. The
+    Tk loop drains the queue (BankClientGUI.poll_replies), so widgets are
+    only touched from the Tk thread. Callbacks get (response, error), one
+    of them None.
+    """
+
+    def __init__(self, addr):
+        super().__init__(daemon=True)
+        self.pool = client.ConnectionPool(addr, size=1, verbose=False)
+        self.requests = queue.Queue()
+        self.replies = queue.Queue()
+
+    def submit(self, request, on_reply):
+        self.requests.put((request, on_reply))
+
+    def run(self):
+        while True:
+            request, on_reply = self.requests.get()
+            try:
+                reply = self.pool.send(request), None
+            except (OSError, protocol.ProtocolError) as e:
+                reply = None, f"Error: {e}"
+            except Exception as e:
+                # Anything else is reported too: the worker must keep serving later requests.
+                reply = None, f"Error: {type(e).__name__}: {e}"
+            self.replies.put((on_reply, reply))
+
+
 class BankClientGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("ABC Bank Client UI")
-        self.root.geometry("600x500")
+        self.root.geometry("800x650")
+        # (request, idempotency key) of the last request that has not been
+        # answered yet. Clicking "Send Request" again with the same form
+        # contents re-sends it under the same key, so it runs at most once.
+        self.pending = None
+        # The table view: the request it pages through, the cursor of its
+        # next page (None when complete), and for show_bank the commit that
+        # auto-refresh asks for changes since.
+        self.view_request = None
+        self.next_cursor = None
+        self.loading = False
+        self.since = None
+        self.refresh_job = None
 
         self.setup_widgets()
+        self.worker = RequestWorker(ADDR)
+        self.worker.start()
+        self.poll_replies()
 
     def setup_widgets(self):
         frame = ttk.Frame(self.root, padding="10")
         frame.pack(fill=tk.BOTH, expand=True)
+        frame.columnconfigure(1, weight=1)
+        frame.rowconfigure(8, weight=1)
 
         # Username
         ttk.Label(frame, text="Username:").grid(row=0, column=0, sticky=tk.W)
@@ -32,7 +98,7 @@ class BankClientGUI:
             "create_account", "deposit", "withdraw", "transfer_to",
             "pay_loan_check", "pay_loan_transfer_to", "show_bank",
             "show_accountholders", "show_history", "show_history_filtered",
-            "apply_interest"
+            "apply_interest", "my_accounts"
         ]
         self.combo_command = ttk.Combobox(frame, textvariable=self.command_var, values=commands, state="readonly")
         self.combo_command.grid(row=1, column=1, sticky=tk.W)
@@ -48,14 +114,28 @@ class BankClientGUI:
         self.entry_amount = ttk.Entry(frame, width=30)
         self.entry_amount.grid(row=3, column=1, sticky=tk.W)
 
-        # Submit Button
+        # Submit Button and auto-refresh for the show_bank table
         self.btn_send = ttk.Button(frame, text="Send Request", command=self.send_command)
         self.btn_send.grid(row=4, column=0, columnspan=2, pady=10)
+        self.auto_refresh = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Auto-refresh show_bank", variable=self.auto_refresh,
+                        command=self.toggle_refresh).grid(row=4, column=1, sticky=tk.E)
 
         # Response Box
         ttk.Label(frame, text="Response:").grid(row=5, column=0, sticky=tk.W)
-        self.text_response = scrolledtext.ScrolledText(frame, width=70, height=15, state=tk.DISABLED)
-        self.text_response.grid(row=6, column=0, columnspan=2, pady=5)
+        self.text_response = scrolledtext.ScrolledText(frame, width=90, height=6, state=tk.DISABLED)
+        self.text_response.grid(row=6, column=0, columnspan=2, pady=5, sticky=tk.EW)
+
+        # Table for show_bank and show_history, filled a page at a time as it is scrolled
+        self.status = tk.StringVar()
+        ttk.Label(frame, textvariable=self.status).grid(row=7, column=0, columnspan=2, sticky=tk.W)
+        table = ttk.Frame(frame)
+        table.grid(row=8, column=0, columnspan=2, sticky=tk.NSEW)
+        self.tree = ttk.Treeview(table, show="headings")
+        self.scrollbar = ttk.Scrollbar(table, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_scroll)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
     def send_command(self):
         user = self.entry_user.get().strip()
@@ -65,28 +145,33 @@ class BankClientGUI:
 
         # Special handling for show_history_filtered
         if command == "show_history_filtered":
-            request_str = f"user={user} command={command} acct_num={acct_num} operation={amount}"
+            request = {'user': user, 'command': command, 'acct_num': acct_num, 'operation': amount}
         else:
-            request_str = f"user={user} command={command} acct_num={acct_num} amount={amount}"
+            request = {'user': user, 'command': command, 'acct_num': acct_num, 'amount': amount}
 
-        def thread_func():
-            try:
-                client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                client_socket.connect(ADDR)
-                client_socket.send(request_str.encode())
-                response = ""
-                while True:
-                    chunk = client_socket.recv(1024).decode()
-                    if "END" in chunk:
-                        response += chunk.replace("END", "")
-                        break
-                    response += chunk
-                client_socket.close()
-                self.display_response(response)
-            except Exception as e:
-                self.display_response(f"Error: {e}")
+        if command in ("show_bank", "show_history", "show_history_filtered"):
+            self.open_view(request)
+            return
+        if self.pending is None or self.pending[0] != request:
+            self.pending = (request, protocol.new_request_key())
+        pending = self.pending
+
+        def on_reply(response, error):
+            if error is None and self.pending is pending:
+                self.pending = None
+            self.display_response(error or response)
 
-        threading.Thread(target=thread_func, daemon=True).start()
+        self.worker.submit(dict(request, **{protocol.REQUEST_KEY: pending[1]}), on_reply)
+
+    def poll_replies(self):
+        """Run the callbacks of replies the worker has received (on the Tk thread)."""
+        while True:
+            try:
+                on_reply, reply = self.worker.replies.get_nowait()
+            except queue.Empty:
+                break
+            on_reply(*reply)
+        self.root.after(POLL_MS, self.poll_replies)
 
     def display_response(self, response):
         self.text_response.config(state=tk.NORMAL)
@@ -94,6 +179,119 @@ class BankClientGUI:
         self.text_response.insert(tk.END, response)
         self.text_response.config(state=tk.DISABLED)
 
+    # --------------------- Paged table view ---------------------
+
+    def open_view(self, request):
+        """Replace the table with the first page of a show_bank or show_history request."""
+        columns = BANK_COLUMNS if request['command'] == "show_bank" else HISTORY_COLUMNS
+        self.tree.delete(*self.tree.get_children())
+        self.tree["columns"] = columns
+        for column in columns:
+            self.tree.heading(column, text=column)
+            self.tree.column(column, width=120 if column != "acct_holder" else 240,
+                             anchor=tk.E if column in ("balance", "amount") else tk.W)
+        self.view_request = request
+        self.next_cursor = None
+        self.since = None
+        self.fetch_page(None)
+
+    def fetch_page(self, cursor):
+        request = dict(self.view_request, limit=PAGE_ROWS)
+        if cursor is not None:
+            request['cursor'] = cursor
+        self.loading = True
+        view = self.view_request
+        self.worker.submit(request, lambda response, error: self.show_page(view, response, error))
+
+    def on_scroll(self, first, last):
+        """Fetch the next page once the table is scrolled near its end."""
+        self.scrollbar.set(first, last)
+        if float(last) > 0.9 and self.next_cursor is not None and not self.loading:
+            self.fetch_page(self.next_cursor)
+
+    def show_page(self, view, response, error):
+        if view is not self.view_request:
+            return  # a newer view replaced this one while the page was in flight
+        self.loading = False
+        if error is not None:
+            self.display_response(error)
+            return
+        lines = response.splitlines()
+        more = MORE.search(lines[-1]) if lines else None
+        self.next_cursor = more.group(1) if more else None
+        if view['command'] == "show_bank":
+            header = PAGE_HEADER.match(lines[0]) if lines else None
+            if header is None:
+                self.display_response(response)
+                return
+            if self.since is None:
+                # The first page's commit: every change after it is picked up by auto-refresh.
+                self.since = header.group(2)
+            self.put_accounts(lines[2:-1] if more else lines[2:], insert=True)
+            self.status.set(f"{len(self.tree.get_children())} of {header.group(1)} accounts loaded")
+            self.toggle_refresh()
+        else:
+            if not response.startswith(("The operation history", "The filtered operation history")):
+                self.display_response(response)
+                return
+            for line in lines[1:-1] if more else lines[1:]:
+                # "YYYY-mm-dd HH:MM:SS (actor, operation, amount[, counterparty])"
+                entry = ast.literal_eval(line[20:])
+                self.tree.insert("", tk.END, values=(line[:19],) + entry + ("",) * (4 - len(entry)))
+            self.status.set(f"{len(self.tree.get_children())} history entries loaded")
+        # A page that does not fill the table triggers on_scroll, which fetches the next one.
+        self.display_response(lines[0])
+
+    def put_accounts(self, lines, insert):
+        """
+        Update report rows already in the table, keyed by account number.
+        Rows not in it yet are added if insert is true; otherwise they are
+        left for the page that will bring them.
+        """
+        for line in lines:
+            values = line.split(None, 4)
+            if len(values) < 4:
+                continue
+            if self.tree.exists(values[0]):
+                self.tree.item(values[0], values=values)
+            elif insert:
+                self.tree.insert("", tk.END, iid=values[0], values=values)
+
+    # --------------------- Auto-refresh ---------------------
+
+    def toggle_refresh(self):
+        if self.refresh_job is not None:
+            self.root.after_cancel(self.refresh_job)
+            self.refresh_job = None
+        if self.auto_refresh.get() and self.view_request and self.view_request['command'] == "show_bank":
+            self.refresh_job = self.root.after(REFRESH_MS, self.refresh)
+
+    def refresh(self):
+        """Ask for the accounts changed since the last refresh; the next one is scheduled when it arrives."""
+        self.refresh_job = None
+        if self.since is None:
+            return
+        view = self.view_request
+        request = {'user': view['user'], 'command': 'show_changes', 'acct_num': 0, 'since': self.since,
+                   'limit': PAGE_ROWS}
+        self.worker.submit(request, lambda response, error: self.show_changes(view, response, error))
+
+    def show_changes(self, view, response, error):
+        if view is not self.view_request:
+            return
+        lines = (response or "").splitlines()
+        header = CHANGES_HEADER.match(lines[0]) if lines else None
+        if header is not None:
+            self.since = header.group(1)
+            # New accounts join the table only once every page is in, so they land at the end.
+            self.put_accounts(lines[2:], insert=self.next_cursor is None)
+            self.toggle_refresh()
+        elif response is not None and response.startswith("Too many changes"):
+            self.open_view(view)  # too far behind: load the table again
+        else:
+            self.display_response(error or response)  # retried on the next tick
+            self.toggle_refresh()
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = BankClientGUI(root)
@@ -0,0 +1,256 @@
+"""
+Memory-mapped, fixed-width columnar transaction history.
+
+Every history entry the Bank records becomes one row spread over
+fixed-width column files, each memory-mapped:
+
+    acct          i64   account the entry belongs to
+    ts            f64   time the entry was recorded (epoch seconds)
+    op            u16   operation code (interned, see HistoryStore.ops)
+    amount        i64
+    counterparty  i64   other account of a transfer, NO_COUNTERPARTY if none
+    actor         u32   user who performed it (interned name)
+
+RAM holds only the row-id indexes (array('q'), 8 bytes per row per index):
+one per account and one per (account, op), so filtered queries touch only
+matching rows. Queries are paged with a cursor (a position in the index)
+and can be limited to a time range.
+
+The store is a working set, not a durable record: it starts empty and is
+rebuilt from the write-ahead log / snapshot on recovery (see persistence.py).
+"""
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+
+NO_COUNTERPARTY = -1
+INITIAL_ROWS = 4096
+# Range of the i64 columns (acct, amount, counterparty).
+I64_MIN, I64_MAX = -2 ** 63, 2 ** 63 - 1
+
+COLUMNS = (
+    ('acct', 'q'),
+    ('ts', 'd'),
+    ('op', 'H'),
+    ('amount', 'q'),
+    ('counterparty', 'q'),
+    ('actor', 'I'),
+)
+
+
+class Column:
+    """One fixed-width column in a memory-mapped file that grows by doubling."""
+
+    def __init__(self, path, typecode, capacity):
+        self.item = struct.Struct("<" + typecode)
+        self.file = open(path, "w+b")
+        self.file.truncate(capacity * self.item.size)
+        self.mm = mmap.mmap(self.file.fileno(), capacity * self.item.size)
+
+    def resize(self, capacity):
+        self.mm.resize(capacity * self.item.size)
+
+    def set(self, row, value):
+        self.item.pack_into(self.mm, row * self.item.size, value)
+
+    def get(self, row):
+        return self.item.unpack_from(self.mm, row * self.item.size)[0]
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+
+class Symbols:
+    """Interns strings (op names, actor names) to small integer codes."""
+
+    def __init__(self):
+        self.names = []
+        self.codes = {}
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+
+class _TimestampView:
+    """Sequence view of the timestamps of an index, for bisect."""
+
+    def __init__(self, store, rows):
+        self.store = store
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return self.store.columns['ts'].get(self.rows[i])
+
+
+def check_entry(acct_num, entry):
+    """
+    Raise ValueError unless acct_num and entry (actor, op, amount[,
+    counterparty]) fit their columns. Callers check before changing a
+    balance, so a row that cannot be written never leaves half a commit.
+    """
+    for value in (acct_num, entry[2]) + tuple(entry[3:4]):
+        if not I64_MIN <= int(value) <= I64_MAX:
+            raise ValueError(f"history value {value} does not fit in 64 bits")
+
+
+class HistoryStore:
+    def __init__(self, directory=None, initial_rows=INITIAL_ROWS):
+        self._tmp = None
+        if directory is None:
+            self._tmp = tempfile.TemporaryDirectory(prefix="bank-history-")
+            directory = self._tmp.name
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.capacity = initial_rows
+        self.rows = 0
+        self.columns = {name: Column(os.path.join(directory, f"{name}.col"), typecode, initial_rows)
+                        for name, typecode in COLUMNS}
+        if self._tmp is not None and os.name == 'posix':
+            # The open, mapped columns outlive their unlinked files, so a
+            # temporary store's space goes back when the process ends however
+            # it ends (SIGTERM, SIGKILL), not only on a clean exit.
+            self._tmp.cleanup()
+        self.ops = Symbols()
+        self.actors = Symbols()
+        self.by_account = {}      # acct_num -> array of row ids
+        self.by_account_op = {}   # (acct_num, op code) -> array of row ids
+
+    def append(self, acct_num, entry, ts=None):
+        """
+        Record a history entry, an (actor, op, amount[, counterparty]) tuple
+        as the Bank builds them, for acct_num.
+        """
+        with self.lock:
+            self._append(acct_num, entry, time.time() if ts is None else ts)
+
+    def _append(self, acct_num, entry, ts):
+        """
+        Write one row (caller holds self.lock). ts is raised to the account's
+        newest timestamp if it is older (a clock step back, or a batch whose
+        rows were stamped before a later append), so each account's rows stay
+        in time order for query.
+        """
+        check_entry(acct_num, entry)
+        actor, op, amount = entry[0], entry[1], entry[2]
+        counterparty = int(entry[3]) if len(entry) > 3 else NO_COUNTERPARTY
+        if self.rows == self.capacity:
+            self.capacity *= 2
+            for column in self.columns.values():
+                column.resize(self.capacity)
+        row = self.rows
+        op_code = self.ops.code(op)
+        columns = self.columns
+        rows = self.by_account.get(acct_num)
+        if rows:
+            ts = max(ts, columns['ts'].get(rows[-1]))
+        columns['acct'].set(row, acct_num)
+        columns['ts'].set(row, ts)
+        columns['op'].set(row, op_code)
+        columns['amount'].set(row, amount)
+        columns['counterparty'].set(row, counterparty)
+        columns['actor'].set(row, self.actors.code(actor))
+        self.rows += 1
+        rows = self.by_account.get(acct_num)
+        if rows is None:
+            rows = self.by_account[acct_num] = array('q')
+        rows.append(row)
+        rows = self.by_account_op.get((acct_num, op_code))
+        if rows is None:
+            rows = self.by_account_op[(acct_num, op_code)] = array('q')
+        rows.append(row)
+
+    def append_batch(self, entries, ts=None):
+        """Record many (acct_num, entry) pairs with one timestamp under one lock acquisition."""
+        with self.lock:
+            # Stamped under the lock, like append, so no row written meanwhile has a later ts.
+            ts = time.time() if ts is None else ts
+            for acct_num, entry in entries:
+                check_entry(acct_num, entry)
+            for acct_num, entry in entries:
+                self._append(acct_num, entry, ts)
+
+    def append_rows(self, rows):
+        """Record many (acct_num, ts, entry) rows, each with its own timestamp, under one lock acquisition."""
+        with self.lock:
+            for acct_num, ts, entry in rows:
+                self._append(acct_num, entry, ts)
+
+    def last_ts(self, acct_num):
+        """Timestamp of acct_num's newest entry, or None if it has none."""
+        with self.lock:
+            rows = self.by_account.get(acct_num)
+            return self.columns['ts'].get(rows[-1]) if rows else None
+
+    def _entry(self, row, with_ts=False):
+        """Rebuild the Bank's history tuple for row (caller holds self.lock)."""
+        columns = self.columns
+        entry = (self.actors.names[columns['actor'].get(row)], self.ops.names[columns['op'].get(row)],
+                 columns['amount'].get(row))
+        counterparty = columns['counterparty'].get(row)
+        if counterparty != NO_COUNTERPARTY:
+            entry += (counterparty,)
+        if with_ts:
+            return (columns['ts'].get(row),) + entry
+        return entry
+
+    def count(self, acct_num, op=None):
+        return len(self._index(acct_num, op))
+
+    def _index(self, acct_num, op=None):
+        if op is None:
+            return self.by_account.get(acct_num, ())
+        op_code = self.ops.codes.get(op)
+        if op_code is None:
+            return ()
+        return self.by_account_op.get((acct_num, op_code), ())
+
+    def tail(self, acct_num, n):
+        """The last n entries for acct_num, oldest first."""
+        with self.lock:
+            rows = self.by_account.get(acct_num, ())
+            return [self._entry(row) for row in rows[max(0, len(rows) - n):]] if n > 0 else []
+
+    def entries(self, acct_num, with_ts=False):
+        """Every entry for acct_num, oldest first."""
+        with self.lock:
+            return [self._entry(row, with_ts) for row in self.by_account.get(acct_num, ())]
+
+    def query(self, acct_num, op=None, since=None, until=None, cursor=0, limit=100):
+        """
+        Return (entries, next_cursor) for acct_num, oldest first, optionally
+        only operation `op` and entries with since <= ts < until. Pass
+        next_cursor back to get the following page; it is None on the last page.
+        Entries are (ts, actor, op, amount[, counterparty]). Raises
+        ValueError for a negative cursor or limit.
+        """
+        if cursor < 0 or limit < 0:
+            raise ValueError("cursor and limit must not be negative")
+        with self.lock:
+            rows = self._index(acct_num, op)
+            ts = _TimestampView(self, rows)
+            # Each account's rows are in time order (see _append), so the
+            # range bounds are found by binary search instead of a scan.
+            start = max(cursor, bisect.bisect_left(ts, since) if since is not None else 0)
+            end = bisect.bisect_left(ts, until) if until is not None else len(rows)
+            stop = min(end, start + limit)
+            page = [self._entry(rows[i], with_ts=True) for i in range(start, stop)]
+            return page, (stop if stop < end else None)
+
+    def close(self):
+        with self.lock:
+            for column in self.columns.values():
+                column.close()
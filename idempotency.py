@@ -0,0 +1,171 @@
+"""
+Response cache that makes client retries safe.
+
+A client tags a request with idempotency_key=<unique string> (see
+protocol.with_request_key) and sends the same key when it retries. The
+first request with a given (user, key) runs as usual and its response is
+kept. A repeat gets that response back without running the command again,
+so no account locks are taken. A repeat that arrives while the first is
+still running waits for it. Reusing a key for a different request is
+refused.
+
+Only commands that change state (CACHED_COMMANDS) are cached; other
+commands ignore the key. The cache evicts the least recently used entries
+first when it exceeds max_entries entries or max_bytes of responses, and
+entries expire after ttl seconds.
+
+With persistence, each response is written to the write-ahead log before
+it is returned, and snapshots carry the unexpired entries, so a retry
+after a restart still gets the original response. If the server crashes
+after a command commits but before its response is logged, a retry runs
+the command again.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import METRICS
+from protocol import REQUEST_KEY
+
+CACHED_COMMANDS = {'create_account', 'add_holder', 'deposit', 'withdraw', 'transfer_to', 'pay_loan_check',
+                   'pay_loan_transfer_to', 'multi_transfer', 'apply_interest'}
+
+# Rough per-entry bookkeeping cost counted against max_bytes on top of the response text.
+ENTRY_OVERHEAD = 200
+
+KEY_REUSED = "The idempotency_key was already used for a different request"
+
+
+def fingerprint(data_dict):
+    """The request's fields other than its key, to tell a retry from a different request."""
+    return tuple(sorted((key, str(value)) for key, value in data_dict.items() if key != REQUEST_KEY))
+
+
+class _Running:
+    __slots__ = ('fingerprint', 'done', 'response')
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None
+
+
+class ResponseCache:
+    def __init__(self, ttl=600, max_entries=100000, max_bytes=64 * 1024 * 1024, journal=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # journal(user, key, fingerprint, response, expires) makes an entry
+        # durable (Bank.log_response); None keeps the cache in memory only.
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # (user, key) -> (expires, fingerprint, response), least recently used first
+        self.running = {}              # (user, key) -> _Running for requests still executing
+        self.bytes = 0
+
+    def peek(self, data_dict):
+        """The cached response for a repeat of data_dict, or None; never waits or runs anything."""
+        key = self._key(data_dict)
+        if key is None:
+            return None
+        with self.lock:
+            entry = self._get(key)
+        if entry is None:
+            return None
+        METRICS.inc("bank_idempotency_hits_total")
+        return entry[2] if entry[1] == fingerprint(data_dict) else KEY_REUSED
+
+    def run(self, data_dict, execute):
+        """
+        Return execute()'s response for data_dict, or, for a repeat of its
+        idempotency key, the response the first request got.
+        """
+        key = self._key(data_dict)
+        if key is None:
+            return execute()
+        request = fingerprint(data_dict)
+        while True:
+            with self.lock:
+                entry = self._get(key)
+                running = self.running.get(key) if entry is None else None
+                if entry is None and running is None:
+                    running = self.running[key] = _Running(request)
+                    break
+            if entry is not None:
+                METRICS.inc("bank_idempotency_hits_total")
+                return entry[2] if entry[1] == request else KEY_REUSED
+            # The first request with this key is still running: wait for its response.
+            running.done.wait()
+            if running.response is not None:
+                METRICS.inc("bank_idempotency_hits_total")
+                return running.response if running.fingerprint == request else KEY_REUSED
+            # It failed without a response; try again (or run it ourselves).
+
+        METRICS.inc("bank_idempotency_misses_total")
+        try:
+            response = execute()
+            if not isinstance(response, str):
+                response = "".join(response)
+            running.response = response
+            expires = time.time() + self.ttl
+            self.restore(key[0], key[1], request, response, expires)
+            if self.journal is not None:
+                self.journal(key[0], key[1], request, response, expires)
+            return response
+        finally:
+            with self.lock:
+                del self.running[key]
+            running.done.set()
+
+    def restore(self, user, key, request, response, expires):
+        """Add an entry (after running its request, or when recovering it)."""
+        if expires <= time.time():
+            return
+        key = (user, key)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[2]) + ENTRY_OVERHEAD
+            self.entries[key] = (expires, tuple(tuple(field) for field in request), response)
+            self.bytes += len(response) + ENTRY_OVERHEAD
+            self._evict()
+
+    def export(self):
+        """Unexpired entries as [user, key, fingerprint, response, expires] rows (for snapshots)."""
+        now = time.time()
+        with self.lock:
+            return [[user, key, entry[1], entry[2], entry[0]]
+                    for (user, key), entry in self.entries.items() if entry[0] > now]
+
+    def _key(self, data_dict):
+        if REQUEST_KEY not in data_dict or data_dict.get('command') not in CACHED_COMMANDS:
+            return None
+        return (data_dict.get('user'), data_dict[REQUEST_KEY])
+
+    def _get(self, key):
+        """Unexpired entry for key, now the most recently used, or None (caller holds self.lock)."""
+        entries = self.entries
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            # Hits reorder entries, so an expired one need not be at the front for _evict.
+            del entries[key]
+            self.bytes -= len(entry[2]) + ENTRY_OVERHEAD
+            METRICS.inc("bank_idempotency_evictions_total")
+            self._evict()
+            return None
+        entries.move_to_end(key)
+        return entry
+
+    def _evict(self):
+        """Drop expired entries from the front and, over the caps, the least recently used (caller holds self.lock)."""
+        now = time.time()
+        entries = self.entries
+        while entries:
+            key, (expires, _, response) = next(iter(entries.items()))
+            if expires > now and len(entries) <= self.max_entries and self.bytes <= self.max_bytes:
+                break
+            del entries[key]
+            self.bytes -= len(response) + ENTRY_OVERHEAD
+            METRICS.inc("bank_idempotency_evictions_total")
@@ -0,0 +1,172 @@
+"""
+Batched interest engine for loan accounts.
+
+A pass works in three steps:
+
+1. Read every loan balance into one array without taking any locks.
+2. Compute all accruals in one vectorized step (NumPy when it is installed,
+   a plain Python loop otherwise). Rates come from the configured tiers
+   and per-account overrides, and the growth factor from the schedule.
+3. Apply the results one lock stripe at a time. Each stripe's accounts get
+   their history entries (one batch), their new balances and a single
+   write-ahead log record while that stripe is held, so history order
+   matches commit order for every account. An account whose balance changed after step 1
+   is recomputed from its current balance, so no concurrent write is lost.
+
+Writers are therefore only blocked for the short per-stripe apply, never for
+the whole pass.
+
+Config keys:
+    interest_rate         base rate (default 0.05)
+    interest_tiers        [[min_debt, rate], ...]: loans owing at least min_debt use rate
+    interest_compounding  "per_pass" (rate applied once per pass, the original
+                          behaviour) or "daily" (rate is annual, compounded
+                          daily for the time elapsed since the last pass)
+"""
+import logging
+import time
+
+from metrics import METRICS
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; fall back to pure Python arithmetic
+    np = None
+
+SECONDS_PER_DAY = 86400.0
+
+
+class InterestEngine:
+    def __init__(self, bank, config):
+        self.bank = bank
+        self.config = config
+        self.account_rates = {}     # acct_num -> rate override
+        self.last_run = time.time()
+        # Cached list of loan accounts and their stripe grouping; rebuilt
+        # when accounts are added or the account list is replaced.
+        self._source = None
+        self._scanned = 0
+        self._loans = []
+        self._groups = None
+
+    def set_rate(self, acct_num, rate):
+        """Give one account its own rate (None removes the override)."""
+        if rate is None:
+            self.account_rates.pop(acct_num, None)
+        else:
+            self.account_rates[acct_num] = rate
+
+    def _loan_accounts(self):
+        accounts = self.bank.accounts
+        if accounts is not self._source:
+            self._source, self._scanned, self._loans, self._groups = accounts, 0, [], None
+        if self._scanned < len(accounts):
+            new = [account for account in accounts[self._scanned:] if account.acct_type == 'loan']
+            self._scanned = len(accounts)
+            if new:
+                self._loans.extend(new)
+                self._groups = None
+        return self._loans
+
+    def _stripe_groups(self, loans):
+        """Indexes into loans grouped by lock stripe: [(stripe, [i, ...]), ...]."""
+        if self._groups is None:
+            stripes = len(self.bank.lock_stripes)
+            groups = {}
+            for i, account in enumerate(loans):
+                groups.setdefault(account.acct_num % stripes, []).append(i)
+            self._groups = sorted(groups.items())
+        return self._groups
+
+    def _rates(self, loans, balances):
+        base = self.config.get("interest_rate", 0.05)
+        tiers = sorted(self.config.get("interest_tiers", []))
+        if np is not None:
+            rates = np.full(len(loans), base, dtype=np.float64)
+            if tiers:
+                thresholds = np.array([t[0] for t in tiers], dtype=np.float64)
+                tier_rates = np.array([base] + [t[1] for t in tiers], dtype=np.float64)
+                rates = tier_rates[np.searchsorted(thresholds, -balances, side='right')]
+        else:
+            rates = []
+            for balance in balances:
+                rate = base
+                for threshold, tier_rate in tiers:
+                    if -balance >= threshold:
+                        rate = tier_rate
+                rates.append(rate)
+        for i, account in enumerate(loans):
+            override = self.account_rates.get(account.acct_num)
+            if override is not None:
+                rates[i] = override
+        return rates
+
+    def _factor(self, rate, days):
+        if self.config.get("interest_compounding", "per_pass") == "daily":
+            return (1 + rate / 365.0) ** days
+        return 1 + rate
+
+    def compute(self, balances, rates, days):
+        """New balances for balances/rates; truncates toward zero like int()."""
+        if np is not None:
+            if self.config.get("interest_compounding", "per_pass") == "daily":
+                factors = (1 + rates / 365.0) ** days
+            else:
+                factors = 1 + rates
+            return np.trunc(balances * factors).astype(np.int64)
+        return [int(balance * self._factor(rate, days)) for balance, rate in zip(balances, rates)]
+
+    def run(self):
+        """Accrue interest on every loan account; returns the number of accounts updated."""
+        bank = self.bank
+        now = time.time()
+        days = (now - self.last_run) / SECONDS_PER_DAY
+        self.last_run = now
+        loans = self._loan_accounts()
+        if not loans:
+            return 0
+
+        # 1. Lock-free read of every loan balance.
+        if np is not None:
+            balances = np.fromiter((account.balance for account in loans), dtype=np.int64, count=len(loans))
+        else:
+            balances = [account.balance for account in loans]
+        # 2. One vectorized pass.
+        rates = self._rates(loans, balances)
+        new_balances = self.compute(balances, rates, days)
+        if np is not None:
+            balances = balances.tolist()
+            new_balances = new_balances.tolist()
+            rates = rates.tolist()
+
+        # 3. Apply stripe by stripe.
+        lsn = None
+        for stripe, indexes in self._stripe_groups(loans):
+            lock = bank.lock_stripes[stripe]
+            changes = []
+            start = time.perf_counter()
+            with lock:
+                acquired = time.perf_counter()
+                for i in indexes:
+                    account = loans[i]
+                    old_balance = account.balance
+                    if old_balance == balances[i]:
+                        new_balance = new_balances[i]
+                    else:
+                        # Written to since the snapshot: recompute from the current balance.
+                        new_balance = int(old_balance * self._factor(rates[i], days))
+                    delta = new_balance - old_balance
+                    changes.append((account, delta, ("System", "interest", delta)))
+                # History first: append_batch checks every row before writing
+                # any, so a row it refuses leaves no balance changed.
+                bank.history.append_batch([(account.acct_num, entry) for account, _, entry in changes])
+                for account, delta, _ in changes:
+                    account.balance += delta
+                stripe_lsn = bank.commit_changes(*changes)
+            # Stripe holds only feed the lock histograms, not per-account totals.
+            METRICS.lock_timing((), acquired - start, time.perf_counter() - acquired)
+            if stripe_lsn is not None:
+                lsn = stripe_lsn
+        bank.wait_durable(lsn)
+        logging.info("Applied interest to %s loan accounts in %.3f seconds", len(loans), time.time() - now)
+        return len(loans)
@@ -0,0 +1,260 @@
+"""
+In-process metrics for the server: counters, gauges and latency histograms,
+rendered as a readable summary (the stats command) or in the Prometheus
+text exposition format (stats format=prometheus, or over HTTP on
+metrics_port).
+
+Everything is recorded into the module-level METRICS registry:
+
+    bank_command_seconds{command}      request latency per command (histogram)
+    bank_lock_wait_seconds             time spent waiting for account locks (histogram)
+    bank_lock_hold_seconds             time account locks were held (histogram)
+    bank_account_lock_*_seconds_total  wait/hold totals for the most contended accounts
+    bank_connections_active            open client connections (gauge)
+    bank_connections_total
+    bank_bytes_received_total, bank_bytes_sent_total
+    queue depths                       gauges read on demand (see Metrics.gauge)
+
+Per-lock log lines are sampled: lock_log_rate is the fraction of lock
+acquisitions that are logged (0 disables them), and can be changed while
+the server runs.
+"""
+import bisect
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Accounts with per-account lock totals; further accounts only feed the histograms.
+MAX_TRACKED_ACCOUNTS = 10000
+
+
+class Histogram:
+    """Fixed-bucket histogram (counts per bucket, not cumulative, plus count and sum)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, lock=None):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.lock = lock or threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self._add(i, value)
+
+    def _add(self, i, value):
+        """Count value in bucket i; the caller holds self.lock."""
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile (None if empty)."""
+        with self.lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    def __init__(self, lock_log_rate=0.0):
+        self.lock = threading.Lock()
+        self.values = {}       # (name, labels) -> number, for counters and gauges
+        self.types = {}        # name -> "counter" | "gauge" | "histogram"
+        self.histograms = {}   # (name, labels) -> Histogram
+        self.gauges = {}       # (name, labels) -> callable returning the current value
+        self.account_locks = {}   # acct_num -> [acquisitions, wait seconds, hold seconds]
+        self.lock_log_rate = lock_log_rate
+        # The lock histograms share self.lock, so lock_timing (called on
+        # every account lock release) takes a single lock.
+        self.types["bank_lock_wait_seconds"] = self.types["bank_lock_hold_seconds"] = "histogram"
+        self.lock_wait = self.histograms["bank_lock_wait_seconds", ()] = Histogram(lock=self.lock)
+        self.lock_hold = self.histograms["bank_lock_hold_seconds", ()] = Histogram(lock=self.lock)
+
+    def inc(self, name, value=1, labels=()):
+        """Add value to a counter."""
+        key = (name, labels)
+        with self.lock:
+            self.types.setdefault(name, "counter")
+            self.values[key] = self.values.get(key, 0) + value
+
+    def add(self, name, value, labels=()):
+        """Move a gauge up or down by value."""
+        key = (name, labels)
+        with self.lock:
+            self.types.setdefault(name, "gauge")
+            self.values[key] = self.values.get(key, 0) + value
+
+    def gauge(self, name, read, labels=()):
+        """Register a gauge whose value is read(), called whenever metrics are rendered."""
+        with self.lock:
+            self.types[name] = "gauge"
+            self.gauges[(name, labels)] = read
+
+    def observe(self, name, value, labels=()):
+        """Record value in a histogram."""
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                self.types.setdefault(name, "histogram")
+                histogram = self.histograms.setdefault(key, Histogram())
+        histogram.observe(value)
+
+    def lock_timing(self, accounts, wait, hold):
+        """Record one lock acquisition covering accounts: seconds waited and held."""
+        wait_bucket = bisect.bisect_left(LATENCY_BUCKETS, wait)
+        hold_bucket = bisect.bisect_left(LATENCY_BUCKETS, hold)
+        with self.lock:
+            self.lock_wait._add(wait_bucket, wait)
+            self.lock_hold._add(hold_bucket, hold)
+            for account in accounts:
+                totals = self.account_locks.get(account.acct_num)
+                if totals is None:
+                    if len(self.account_locks) >= MAX_TRACKED_ACCOUNTS:
+                        continue
+                    totals = self.account_locks[account.acct_num] = [0, 0.0, 0.0]
+                totals[0] += 1
+                totals[1] += wait
+                totals[2] += hold
+
+    def log_lock(self):
+        """True if this lock acquisition should be logged (sampled at lock_log_rate)."""
+        return self.lock_log_rate > 0 and random.random() < self.lock_log_rate
+
+    def hottest_accounts(self, n=10):
+        """[(acct_num, acquisitions, wait seconds, hold seconds)] with the most lock wait."""
+        with self.lock:
+            rows = [(acct_num,) + tuple(totals) for acct_num, totals in self.account_locks.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows[:n]
+
+    def _current(self):
+        """Snapshot of counter/gauge values including the on-demand gauges."""
+        with self.lock:
+            values = dict(self.values)
+            gauges = list(self.gauges.items())
+            histograms = sorted(self.histograms.items())
+            types = dict(self.types)
+        for key, read in gauges:
+            try:
+                values[key] = read()
+            except Exception:
+                continue
+        return values, histograms, types
+
+    def families(self, extra_labels=()):
+        """
+        Every metric as {name: (type, [sample lines])}; extra_labels are added
+        to every sample. Plain data, so shard processes can send theirs to
+        the coordinator to be merged by render().
+        """
+        values, histograms, types = self._current()
+        families = {}
+
+        def samples(name):
+            if name not in families:
+                families[name] = (types.get(name, "untyped"), [])
+            return families[name][1]
+
+        for (name, labels), value in sorted(values.items()):
+            samples(name).append(f"{name}{format_labels(extra_labels + labels)} {value}")
+        for (name, labels), histogram in histograms:
+            lines = samples(name)
+            with histogram.lock:
+                counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+            cumulative = 0
+            for bound, n in zip(histogram.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{format_labels(extra_labels + labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(extra_labels + labels)} {total}")
+            lines.append(f"{name}_count{format_labels(extra_labels + labels)} {count}")
+        hottest = self.hottest_accounts()
+        for name, column in (("bank_account_lock_wait_seconds_total", 2), ("bank_account_lock_hold_seconds_total", 3)):
+            for row in hottest:
+                families.setdefault(name, ("counter", []))[1].append(
+                    f"{name}{format_labels(extra_labels + (('acct_num', row[0]),))} {row[column]}")
+        return families
+
+    def prometheus(self, extra_labels=()):
+        """Everything in Prometheus text format."""
+        return render(self.families(extra_labels))
+
+    def summary(self):
+        """Readable summary for the stats command."""
+        values, histograms, _ = self._current()
+        lines = ["Counters and gauges:"]
+        for (name, labels), value in sorted(values.items()):
+            lines.append(f"  {name}{format_labels(labels)} = {value}")
+        lines.append("Latency (count, p50 <=, p99 <=, mean) in ms:")
+        for (name, labels), histogram in histograms:
+            if not histogram.count:
+                continue
+            lines.append(f"  {name}{format_labels(labels)}: {histogram.count}, {histogram.quantile(0.5) * 1000:g}, "
+                         f"{histogram.quantile(0.99) * 1000:g}, {histogram.sum / histogram.count * 1000:.3f}")
+        hottest = self.hottest_accounts()
+        if hottest:
+            lines.append("Most contended accounts (acquisitions, wait ms, hold ms):")
+            for acct_num, acquisitions, wait, hold in hottest:
+                lines.append(f"  {acct_num}: {acquisitions}, {wait * 1000:.3f}, {hold * 1000:.3f}")
+        lines.append(f"Lock log sample rate: {self.lock_log_rate}")
+        return "\n".join(lines)
+
+
+def render(*families):
+    """Prometheus text for one or more families() results, each metric's samples kept together."""
+    merged = {}
+    for family in families:
+        for name, (kind, lines) in family.items():
+            merged.setdefault(name, (kind, []))[1].extend(lines)
+    out = []
+    for name, (kind, lines) in merged.items():
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
+
+
+METRICS = Metrics()
+
+
+def serve_http(port, render=None):
+    """Serve METRICS (or render()) as Prometheus text on http://0.0.0.0:port/metrics from a daemon thread."""
+    render = render or METRICS.prometheus
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
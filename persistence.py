@@ -0,0 +1,279 @@
+"""
+Write-ahead log and snapshot persistence for the Bank.
+
+Every mutation is described as a record and appended to the log while the
+affected account locks are held (so log order matches apply order). Callers
+then release their locks and wait for the record to become durable. A single
+flusher thread writes everything that has accumulated and fsyncs once per
+batch (group commit), so concurrent writers share fsyncs instead of queueing
+behind each other.
+
+Records (one JSON object per line, each with a monotonically increasing lsn):
+
+    {"lsn": n, "op": "create", "account": [acct_num, acct_type, init_acct_holder, acct_holder, balance]}
+    {"lsn": n, "op": "apply", "ts": time, "changes": [[acct_num, balance_delta, history_entry], ...]}
+    {"lsn": n, "op": "holder", "acct_num": acct_num, "holder": name}
+    {"lsn": n, "op": "response", "key": [user, idempotency_key], "fingerprint": [[field, value], ...],
+     "response": text, "expires": time}
+
+"response" records keep the idempotency cache (see idempotency.py) across
+restarts; one is logged after the command it answers has committed.
+
+Snapshots capture every account (balance and history) as of one lsn, plus
+the unexpired idempotency cache entries. Taking
+one rotates the log to a new segment and deletes the segments it covers, so
+recovery only replays the snapshot plus the tail of the log.
+"""
+import glob
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+import bulk_load
+
+SNAPSHOT_FILE = "snapshot.json"
+SEGMENT_PATTERN = "wal-*.log"
+
+
+def segment_path(directory, start_lsn):
+    return os.path.join(directory, f"wal-{start_lsn:020d}.log")
+
+
+def fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    """Append-only log with a background group-commit flusher."""
+
+    def __init__(self, directory, last_lsn=0, group_commit_ms=2, fsync=True):
+        self.directory = directory
+        self.group_commit = group_commit_ms / 1000.0
+        self.fsync = fsync
+        self.cond = threading.Condition()
+        self.file_lock = threading.Lock()
+        self.buffer = []
+        self.last_lsn = last_lsn      # last lsn handed out
+        self.durable_lsn = last_lsn   # last lsn known to be on disk
+        self.batches = 0
+        self.closed = False
+        # follower(lsn, line) callables handed every record as it is appended,
+        # in lsn order (replication.Follower.offer); replaced, never mutated.
+        self.followers = ()
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(segment_path(directory, last_lsn + 1), "ab")
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    def append(self, record):
+        """Assign the next lsn to record, queue it for writing and return the lsn."""
+        with self.cond:
+            self.last_lsn += 1
+            record['lsn'] = self.last_lsn
+            line = json.dumps(record, separators=(',', ':')).encode() + b"\n"
+            self.buffer.append(line)
+            for follower in self.followers:
+                follower(self.last_lsn, line)
+            self.cond.notify_all()
+            return self.last_lsn
+
+    def follow(self, follower):
+        """Hand follower(lsn, line) every record appended from now on; returns the last lsn it will not see."""
+        with self.cond:
+            self.followers += (follower,)
+            return self.last_lsn
+
+    def unfollow(self, follower):
+        with self.cond:
+            self.followers = tuple(f for f in self.followers if f is not follower)
+
+    def wait(self, lsn):
+        """Block until every record up to lsn is durable. Never call this while holding a lock."""
+        with self.cond:
+            while self.durable_lsn < lsn:
+                self.cond.wait()
+
+    def _flush_loop(self):
+        while True:
+            with self.cond:
+                while not self.buffer and not self.closed:
+                    self.cond.wait()
+                if self.closed and not self.buffer:
+                    return
+            # Linger briefly so writers that arrive together share one fsync.
+            if self.group_commit:
+                time.sleep(self.group_commit)
+            with self.cond:
+                batch, self.buffer = self.buffer, []
+                batch_lsn = self.last_lsn
+            with self.file_lock:
+                self.file.write(b"".join(batch))
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            with self.cond:
+                self.durable_lsn = batch_lsn
+                self.batches += 1
+                self.cond.notify_all()
+
+    def rotate(self):
+        """
+        Flush everything and start a new segment after the current last lsn.
+        The caller must stop new appends first (Bank.snapshot_state does).
+        """
+        self.wait(self.last_lsn)
+        with self.file_lock:
+            self.file.close()
+            self.file = open(segment_path(self.directory, self.last_lsn + 1), "ab")
+        return self.last_lsn
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.flusher.join()
+        with self.file_lock:
+            self.file.close()
+
+
+def apply_record(bank, record):
+    """Re-apply one log record to bank (used by recovery and replicas; takes no locks)."""
+    if record['op'] == 'create':
+        account = bank.new_account(*record['account'])
+        bank.accounts.append(account)
+        bank._index_account(account)
+    elif record['op'] == 'apply':
+        changes = []
+        for acct_num, delta, entry in record['changes']:
+            account = bank.accounts_by_num[acct_num]
+            account.balance += delta
+            bank.record(account, tuple(entry), record.get('ts'))
+            changes.append((account, delta, tuple(entry)))
+        bank.publish(changes)
+    elif record['op'] == 'holder':
+        bank._add_holder(bank.accounts_by_num[record['acct_num']], record['holder'])
+    elif record['op'] == 'response':
+        if bank.responses is not None:
+            bank.responses.restore(*record['key'], record['fingerprint'], record['response'], record['expires'])
+
+
+def write_snapshot(directory, lsn, rows, responses=()):
+    """
+    Atomically write rows (acct_num, acct_type, init, holders, balance, history) as of lsn,
+    followed by the idempotency cache's responses (ResponseCache.export rows).
+    History entries are (ts, actor, op, amount[, counterparty]).
+    """
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        dump_snapshot(f, lsn, rows, responses)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(directory)
+
+
+def dump_snapshot(f, lsn, rows, responses=()):
+    """Write a snapshot (header line, account rows, responses) to text file f (a file, or a replica's socket)."""
+    f.write(json.dumps({'lsn': lsn, 'accounts': len(rows), 'responses': len(responses)}) + "\n")
+    for row in itertools.chain(rows, responses):
+        f.write(json.dumps(row, separators=(',', ':')) + "\n")
+
+
+def load_snapshot(bank, directory):
+    """Replace bank's accounts with the snapshot in directory; return its lsn (0 if none)."""
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return read_snapshot(bank, f)
+
+
+def read_snapshot(bank, f):
+    """Replace bank's accounts with the snapshot read from text file f; return its lsn."""
+    with bulk_load.paused_gc():
+        header = json.loads(f.readline())
+        bank.reset_accounts()
+        for line in itertools.islice(f, header['accounts']):
+            acct_num, acct_type, init_holder, holders, balance, history = json.loads(line)
+            bank.accounts.append(bank.new_account(acct_num, acct_type, init_holder, holders, balance))
+            bank.history.append_rows([(acct_num, entry[0], tuple(entry[1:])) for entry in history])
+        bank._index_accounts(bank.accounts)
+        # Snapshots written before the idempotency cache existed have no
+        # 'responses' count and end here.
+        for line in itertools.islice(f, header.get('responses')):
+            if bank.responses is not None:
+                bank.responses.restore(*json.loads(line))
+    return header['lsn']
+
+
+def read_log(directory, after_lsn=0):
+    """Yield log records with lsn > after_lsn, in order, stopping at a torn final write."""
+    for path in sorted(glob.glob(os.path.join(directory, SEGMENT_PATTERN))):
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning("Ignoring torn record at end of %s", path)
+                    break
+                if record['lsn'] > after_lsn:
+                    yield record
+
+
+def recover(bank, directory):
+    """Load the latest snapshot and replay the log after it; return the last lsn applied."""
+    lsn = load_snapshot(bank, directory)
+    replayed = 0
+    for record in read_log(directory, lsn):
+        apply_record(bank, record)
+        lsn = record['lsn']
+        replayed += 1
+    logging.info("Recovered bank state up to lsn %s (%s log records replayed)", lsn, replayed)
+    return lsn
+
+
+def snapshot(bank):
+    """Write a snapshot of bank and drop the log segments it makes redundant."""
+    wal = bank.wal
+    lsn, rows = bank.snapshot_state()
+    # Exported after the log rotation: a response cached before it is in
+    # this list, one cached after it is also in the new log segment.
+    responses = bank.responses.export() if bank.responses is not None else []
+    write_snapshot(wal.directory, lsn, rows, responses)
+    for path in glob.glob(os.path.join(wal.directory, SEGMENT_PATTERN)):
+        start_lsn = int(os.path.basename(path)[4:-4])
+        if start_lsn <= lsn and path != wal.file.name:
+            os.remove(path)
+    logging.info("Wrote snapshot at lsn %s (%s accounts)", lsn, len(rows))
+    return lsn
+
+
+def snapshot_thread(bank, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            snapshot(bank)
+        except OSError as e:
+            logging.error("Snapshot failed: %s", e)
+
+
+def attach(bank, config):
+    """Recover bank from config's data_dir, then start logging and periodic snapshots."""
+    directory = config.get("data_dir", "data")
+    os.makedirs(directory, exist_ok=True)
+    last_lsn = recover(bank, directory)
+    bank.wal = WriteAheadLog(directory, last_lsn,
+                             group_commit_ms=config.get("wal_group_commit_ms", 2),
+                             fsync=config.get("wal_fsync", True))
+    interval = config.get("snapshot_interval", 300)
+    if interval:
+        threading.Thread(target=snapshot_thread, args=(bank, interval), daemon=True).start()
+    return bank.wal
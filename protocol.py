@@ -0,0 +1,237 @@
+"""
+Length-prefixed binary wire protocol shared by server.py, client.py and gui.py.
+
+A framed client opens the connection by sending MAGIC. Anything else is
+treated as the original text protocol ("key=value ... " answered with a
+response followed by "END"), so old clients keep working.
+
+After MAGIC, both directions carry frames:
+
+    +----------------+----------------+-----------------+
+    | body length u32| request id u32 | body            |
+    +----------------+----------------+-----------------+
+
+Request bodies are a sequence of packed fields, each one
+(key length u8, value length u32, key bytes, value bytes), UTF-8 encoded.
+Response bodies are the UTF-8 response text. A response carries the id of
+the request it answers, so a client may have many requests in flight on one
+connection and match replies by id (the server may answer out of order).
+
+Either protocol may add an idempotency_key field (REQUEST_KEY) to a
+request. The server answers a repeat of the key with the response the first
+request got instead of running it again, so a client can safely re-send a
+request whose reply was lost (see idempotency.py).
+"""
+import asyncio
+import re
+import struct
+import uuid
+
+MAGIC = b"BNK1"
+HEADER = struct.Struct("!II")   # body length, request id
+FIELD = struct.Struct("!BI")    # key length, value length
+MAX_FRAME = 16 * 1024 * 1024
+REQUEST_KEY = "idempotency_key"
+
+# Commands a read replica answers (see replication.py); clients may send these to one.
+READ_COMMANDS = frozenset({'show_bank', 'show_accountholders', 'show_history', 'show_history_filtered',
+                           'show_totals', 'show_balances', 'my_accounts'})
+# Start of a replica's reply to a request it will not answer; the client sends it to the primary instead.
+REPLICA_REFUSED = "Not answered by this replica:"
+# Starts of the replies to a request that was not admitted (see admission.py). Each ends
+# "retry after N ms"; the request has not run and may be sent again after that.
+SERVER_BUSY = "Server busy"
+RATE_LIMITED = "Rate limit exceeded"
+RETRY_AFTER = re.compile(r"retry after (\d+) ms$")
+
+
+class ProtocolError(Exception):
+    """Raised on a malformed or oversized frame."""
+
+
+def encode_fields(fields):
+    """Pack a dict of request fields into a frame body."""
+    parts = []
+    for key, value in fields.items():
+        key_bytes = str(key).encode()
+        value_bytes = str(value).encode()
+        parts.append(FIELD.pack(len(key_bytes), len(value_bytes)))
+        parts.append(key_bytes)
+        parts.append(value_bytes)
+    return b"".join(parts)
+
+
+def decode_fields(body):
+    """
+    Unpack a frame body into a dict of str -> str (the same shape
+    parse_request returns). Raises ProtocolError if it is malformed.
+    """
+    fields = {}
+    view = memoryview(body)
+    offset = 0
+    while offset < len(view):
+        if offset + FIELD.size > len(view):
+            raise ProtocolError("truncated field header")
+        key_len, value_len = FIELD.unpack_from(view, offset)
+        offset += FIELD.size
+        end = offset + key_len + value_len
+        if end > len(view):
+            raise ProtocolError("truncated field")
+        try:
+            key = str(view[offset:offset + key_len], "utf-8")
+            fields[key] = str(view[offset + key_len:end], "utf-8")
+        except UnicodeDecodeError:
+            raise ProtocolError("field is not valid UTF-8") from None
+        offset = end
+    return fields
+
+
+def new_request_key():
+    return uuid.uuid4().hex
+
+
+def with_request_key(fields):
+    """A copy of fields with a fresh idempotency key, unless it already has one."""
+    if REQUEST_KEY in fields:
+        return fields
+    return dict(fields, **{REQUEST_KEY: new_request_key()})
+
+
+def retry_after(response):
+    """Seconds to wait before re-sending, if response says the request was not admitted; otherwise None."""
+    if not response.startswith((SERVER_BUSY, RATE_LIMITED)):
+        return None
+    match = RETRY_AFTER.search(response)
+    return int(match.group(1)) / 1000.0 if match else None
+
+
+def pack_frame(request_id, body):
+    return HEADER.pack(len(body), request_id) + body
+
+
+def pack_request(request_id, fields):
+    return pack_frame(request_id, encode_fields(fields))
+
+
+def pack_response(request_id, text):
+    return pack_frame(request_id, text.encode())
+
+
+class FrameReader:
+    """
+    Reads frames from a blocking socket. `initial` holds bytes already
+    received (e.g. whatever followed MAGIC in the first recv).
+    """
+
+    def __init__(self, sock, initial=b""):
+        self.sock = sock
+        self.buffer = bytearray(initial)
+
+    def has_frame(self):
+        """True if a complete frame is already buffered (reading it will not block)."""
+        if len(self.buffer) < HEADER.size:
+            return False
+        length, _ = HEADER.unpack_from(self.buffer)
+        return len(self.buffer) >= HEADER.size + length
+
+    def _fill(self, size):
+        while len(self.buffer) < size:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                return False
+            self.buffer += chunk
+        return True
+
+    def read_frame(self):
+        """Return (request_id, body bytes), or None when the peer closed the connection."""
+        if not self._fill(HEADER.size):
+            return None
+        length, request_id = HEADER.unpack_from(self.buffer)
+        if length > MAX_FRAME:
+            raise ProtocolError(f"frame of {length} bytes exceeds limit")
+        if not self._fill(HEADER.size + length):
+            return None
+        body = bytes(self.buffer[HEADER.size:HEADER.size + length])
+        del self.buffer[:HEADER.size + length]
+        return request_id, body
+
+    def __iter__(self):
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return
+            yield frame
+
+
+class AsyncFrameReader:
+    """asyncio counterpart of FrameReader over a StreamReader."""
+
+    def __init__(self, reader, initial=b""):
+        self.reader = reader
+        self.buffer = bytes(initial)
+
+    async def _read_exactly(self, size):
+        if len(self.buffer) >= size:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+            return data
+        data, self.buffer = self.buffer, b""
+        return data + await self.reader.readexactly(size - len(data))
+
+    async def read_frame(self):
+        """Return (request_id, body bytes), or None when the peer closed the connection."""
+        try:
+            length, request_id = HEADER.unpack(await self._read_exactly(HEADER.size))
+            if length > MAX_FRAME:
+                raise ProtocolError(f"frame of {length} bytes exceeds limit")
+            return request_id, await self._read_exactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+
+
+class FramedConnection:
+    """
+    Client side of the framed protocol over one socket. Requests may be
+    pipelined: send() returns an id immediately and recv() hands back
+    (request_id, response) pairs as they arrive.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = FrameReader(sock)
+        self.next_id = 1
+        self.sock.sendall(MAGIC)
+
+    def send(self, fields):
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        self.sock.sendall(pack_request(request_id, fields))
+        return request_id
+
+    def recv(self):
+        frame = self.reader.read_frame()
+        if frame is None:
+            raise ConnectionError("server closed the connection")
+        request_id, body = frame
+        return request_id, body.decode()
+
+    def request(self, fields):
+        """Send one request and wait for its response."""
+        return self.request_many([fields])[0]
+
+    def request_many(self, requests):
+        """Pipeline every request on this connection; return responses in request order."""
+        ids = []
+        payload = []
+        for fields in requests:
+            ids.append(self.next_id)
+            payload.append(pack_request(self.next_id, fields))
+            self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        self.sock.sendall(b"".join(payload))
+        responses = {}
+        while len(responses) < len(ids):
+            request_id, text = self.recv()
+            responses[request_id] = text
+        return [responses[request_id] for request_id in ids]
+
+    def close(self):
+        self.sock.close()
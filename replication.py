@@ -0,0 +1,224 @@
+"""
+Primary/replica replication: read replicas kept up to date from the
+primary's write-ahead log.
+
+A primary (replication_port set; needs persistence) accepts replica
+servers on that port. A replica (replica_of = "host:port" of the primary's
+replication_port) answers the read commands in protocol.READ_COMMANDS,
+and stats about itself, and refuses everything else. client.RoutingPool
+sends reads to the replicas and writes to the primary.
+
+The stream is JSON lines. The replica opens with {"replica": [host, port]},
+the address it serves clients on, which the primary lists in
+show_replicas. The primary stops its writers briefly, as for a snapshot,
+and sends every account in the persistence.dump_snapshot format. Then it
+sends the log records that follow the copy, in lsn order, each once it is
+durable. A heartbeat follows every batch, or is sent every
+replication_heartbeat_ms when the log is idle:
+
+    {"op": "heartbeat", "lsn": <last lsn sent>, "ts": <primary time>}
+
+A replica reads it only after applying everything before it, so at that
+point it holds every record the primary had logged at ts. A replica
+answers reads only while now - ts is at most replica_max_staleness_ms.
+This compares the two hosts' clocks, which agree on one host and
+otherwise should be kept in sync with NTP. When the limit is exceeded it
+replies protocol.REPLICA_REFUSED and the client asks the primary instead.
+
+The log never waits for a replica. Each replica has a queue of at most
+replication_buffer_records records. A replica that falls further behind
+is disconnected, reconnects and starts again from a fresh copy.
+"""
+import json
+import logging
+import socket
+import threading
+import time
+
+import persistence
+import protocol
+from metrics import METRICS
+
+# Commands about the server itself rather than the bank, which a replica always answers.
+LOCAL_COMMANDS = {'stats', 'set_lock_logging', 'trace_dump', 'profile'}
+
+# Seconds either end waits on a stalled stream (a replica not reading, or
+# no heartbeat from the primary) before dropping the connection. Long
+# enough for the primary to copy a large bank before its first line.
+STREAM_TIMEOUT = 60
+
+
+class Follower:
+    """The primary's end of one replica's stream: a bounded queue of log lines, sent by its own thread."""
+
+    def __init__(self, sock, address, max_records):
+        self.sock = sock
+        self.address = address
+        self.max_records = max_records
+        self.cond = threading.Condition()
+        self.lines = []       # (lsn, line) appended since the last batch was sent
+        self.overflowed = False
+
+    def offer(self, lsn, line):
+        """Queue one log record (called by WriteAheadLog.append, in lsn order)."""
+        with self.cond:
+            if self.overflowed:
+                return
+            if len(self.lines) >= self.max_records:
+                self.overflowed = True
+                self.lines = []
+            else:
+                self.lines.append((lsn, line))
+            self.cond.notify()
+
+    def stream(self, wal, lsn, heartbeat):
+        """Send queued records once durable, each batch followed by a heartbeat, until the replica goes away."""
+        while True:
+            with self.cond:
+                if not self.lines and not self.overflowed:
+                    self.cond.wait(heartbeat)
+                if self.overflowed:
+                    METRICS.inc("bank_replicas_dropped_total")
+                    raise ConnectionError(f"replica {self.address} fell more than {self.max_records} records behind")
+                batch, self.lines = self.lines, []
+                # Every record logged before this moment is in batch or was sent earlier.
+                taken = time.time()
+            if batch:
+                lsn = batch[-1][0]
+                wal.wait(lsn)
+            data = b"".join(line for _, line in batch)
+            data += json.dumps({'op': 'heartbeat', 'lsn': lsn, 'ts': taken}).encode() + b"\n"
+            self.sock.sendall(data)
+            METRICS.inc("bank_replication_bytes_sent_total", len(data))
+
+
+class Primary:
+    """Accepts replicas on a port and streams the bank's log to each of them."""
+
+    def __init__(self, bank, port, heartbeat_ms=100, max_records=100000):
+        self.bank = bank
+        self.port = port
+        self.heartbeat = heartbeat_ms / 1000.0
+        self.max_records = max_records
+        self.lock = threading.Lock()
+        self.followers = []
+
+    def start(self, host):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, self.port))
+        listener.listen()
+        threading.Thread(target=self.accept_loop, args=(listener,), daemon=True).start()
+        logging.info("Replication served on port %s", self.port)
+
+    def accept_loop(self, listener):
+        while True:
+            sock, addr = listener.accept()
+            threading.Thread(target=self.serve, args=(sock, addr), daemon=True).start()
+
+    def addresses(self):
+        """host:port of every connected replica, where it serves clients."""
+        with self.lock:
+            return [f"{host}:{port}" for host, port in (follower.address for follower in self.followers)]
+
+    def serve(self, sock, addr):
+        wal = self.bank.wal
+        follower = None
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(STREAM_TIMEOUT)
+            hello = json.loads(sock.makefile("r", encoding="utf-8").readline())
+            follower = Follower(sock, tuple(hello['replica']), self.max_records)
+
+            def mark():
+                # Writers are stopped: the copy holds every record up to the lsn returned.
+                wal.wait(wal.last_lsn)
+                return wal.follow(follower.offer)
+
+            lsn, rows = self.bank.snapshot_state(mark)
+            f = sock.makefile("w", encoding="utf-8", newline="\n")
+            persistence.dump_snapshot(f, lsn, rows)
+            f.flush()
+            logging.info("Replica %s at %s joined at lsn %s (%s accounts copied)",
+                         follower.address, addr, lsn, len(rows))
+            with self.lock:
+                self.followers.append(follower)
+            follower.stream(wal, lsn, self.heartbeat)
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("Replica at %s disconnected: %s", addr, e)
+        finally:
+            if follower is not None:
+                wal.unfollow(follower.offer)
+                with self.lock:
+                    if follower in self.followers:
+                        self.followers.remove(follower)
+            # The files made from sock keep it open past close(); shut it
+            # down so a dropped replica sees the end of its stream now
+            # rather than after STREAM_TIMEOUT.
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+
+class Replica:
+    """Keeps a Bank in step with a primary and decides which requests it may answer."""
+
+    def __init__(self, bank, primary, serve_address, max_staleness_ms=1000):
+        self.bank = bank
+        self.primary = primary               # (host, replication port)
+        self.serve_address = serve_address   # (host, port) this server answers clients on
+        self.max_staleness = max_staleness_ms / 1000.0
+        self.lsn = 0                # last record applied
+        self.caught_up = 0.0        # primary time the replica was last known to be complete at
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def staleness(self):
+        return max(0.0, time.time() - self.caught_up)
+
+    def refuse(self, command):
+        """A refusal for a request this replica must not answer, or None."""
+        if command in LOCAL_COMMANDS:
+            return None
+        if command not in protocol.READ_COMMANDS:
+            return f"{protocol.REPLICA_REFUSED} {command} must be sent to the primary"
+        if time.time() - self.caught_up > self.max_staleness:
+            METRICS.inc("bank_replica_stale_refusals_total")
+            return f"{protocol.REPLICA_REFUSED} more than {self.max_staleness * 1000:.0f} ms behind the primary"
+        return None
+
+    def run(self):
+        delay = 0.1
+        while True:
+            try:
+                self.follow()
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning("Replication from %s:%s interrupted: %s", *self.primary, e)
+            if self.caught_up:
+                delay = 0.1  # it was streaming: reconnect promptly
+            self.caught_up = 0.0
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    def follow(self):
+        """Copy the primary's accounts, then apply its log as it arrives."""
+        sock = socket.create_connection(self.primary)
+        sock.settimeout(STREAM_TIMEOUT)
+        try:
+            sock.sendall(json.dumps({'replica': list(self.serve_address)}).encode() + b"\n")
+            f = sock.makefile("r", encoding="utf-8")
+            self.lsn = persistence.read_snapshot(self.bank, f)
+            logging.info("Replica loaded %s accounts from the primary at lsn %s", len(self.bank.accounts), self.lsn)
+            for line in f:
+                record = json.loads(line)
+                if record['op'] == 'heartbeat':
+                    self.caught_up = record['ts']
+                    continue
+                persistence.apply_record(self.bank, record)
+                self.lsn = record['lsn']
+            raise ConnectionError("the primary closed the stream")
+        finally:
+            sock.close()
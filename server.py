@@ -1,3 +1,8 @@
+import asyncio
+import collections
+import itertools
+import math
+import multiprocessing
 import socket
 import threading
 import time
@@ -5,6 +10,23 @@ from tabulate import tabulate
 import logging
 import json
 import os
+import sys
+from concurrent.futures import Future
+
+from history_store import HistoryStore, I64_MIN, I64_MAX, check_entry
+from batching import WriteBatcher
+import admission
+import bulk_load
+from events import ChangeFeed, Subscription
+from idempotency import ResponseCache
+from interest import InterestEngine
+from metrics import METRICS
+import metrics
+import persistence
+import protocol
+import replication
+import sharding
+import tracing
 
 # --------------------- Configuration and Logging Setup ---------------------
 
@@ -20,359 +42,907 @@ else:
     config = {
         "port": 9876,
         "interest_rate": 0.05,         # 5% interest rate for loan accounts
-        "auto_interest_interval": 60   # auto-apply interest every 60 seconds
+        "auto_interest_interval": 60,  # auto-apply interest every 60 seconds
+        "lock_stripes": 1024,          # number of shared account locks (see Bank.lock_for)
+        "server_mode": "threaded",     # "threaded" (thread per connection) or "asyncio"
+        "worker_threads": 32,          # threads ledger requests run on (see admission.py)
+        "work_queue_size": 1024,       # requests queued for a worker before new ones are shed
+        "queue_latency_slo_ms": 200,   # shed new requests while the oldest queued one has waited longer (0: off)
+        "max_connections": 1024,       # threaded mode: connections served at once; more wait in the listen backlog
+        "rate_limit_per_user": 0,      # requests per second per user (0: no limit)
+        "rate_limit_burst": 0,         # requests a user may send at once (0: rate_limit_per_user)
+        "simulation_latency": 0,       # seconds of artificial delay per ledger operation
+        "persistence": False,          # write-ahead log + snapshots in data_dir
+        "data_dir": "data",
+        "wal_group_commit_ms": 2,      # how long the log flusher waits to batch writers per fsync
+        "wal_fsync": True,
+        "snapshot_interval": 300,      # seconds between snapshots (0 disables)
+        "history_dir": None,           # where history column files live (None: a temp directory, removed once opened)
+        "history_page_size": 100,      # history entries per show_history reply
+        "report_page_size": 500,       # accounts per show_bank page (with cursor/limit) or show_changes reply
+        "change_log_size": 65536,      # recent commits show_changes can list changes since (and subscribe resume from)
+        "subscriber_buffer_events": 10000, # events a subscribe stream may fall behind before it is cut off
+        "interest_tiers": [],          # [[min_debt, rate], ...] overrides interest_rate for larger loans
+        "interest_compounding": "per_pass", # or "daily": interest_rate is annual, compounded daily
+        "shards": 0,                   # worker processes to partition accounts over (0: one in-process Bank)
+        "shard_threads": 8,            # threads per shard process
+        "write_batch_max": 1,          # queued deposit/withdraw/pay_loan_check ops applied per lock hold (1: no batching)
+        "lock_log_sample": 0.0,        # fraction of account lock acquisitions logged (0: none; see set_lock_logging)
+        "trace_slowest": 0,            # keep the N slowest requests with per-phase times for trace_dump (0: tracing off)
+        "profile_dir": "profiles",     # where the profile command writes its folded stack files
+        "seed_file": None,             # accounts CSV/Parquet to start from instead of SEED_ACCOUNTS (see bulk_load.py)
+        "seed_history_file": None,     # optional history CSV/Parquet for the seed_file accounts
+        "metrics_port": None,          # serve Prometheus metrics over HTTP on this port (None: only the stats command)
+        "idempotency_ttl": 600,        # seconds a response is kept for retries with the same idempotency_key
+        "idempotency_max_entries": 100000,
+        "idempotency_max_bytes": 67108864, # response text the idempotency cache may hold (64 MiB)
+        "replication_port": None,      # primary: stream the write-ahead log to read replicas on this port
+        "replica_of": None,            # "host:port" of a primary's replication_port: run as its read replica
+        "replica_max_staleness_ms": 1000, # a replica further behind the primary than this refuses reads
+        "replication_heartbeat_ms": 100,
+        "replication_buffer_records": 100000 # log records a replica may fall behind before it is disconnected
     }
 
+def new_response_cache(journal=None):
+    return ResponseCache(config.get("idempotency_ttl", 600), config.get("idempotency_max_entries", 100000),
+                         config.get("idempotency_max_bytes", 64 * 1024 * 1024), journal)
+
+def simulate_latency():
+    """
+    Sleep for the configured simulation_latency (0 by default). Used to mimic
+    a slow backend in demos; always called before any lock is taken so the
+    delay never extends a critical section.
+    """
+    delay = config.get("simulation_latency", 0)
+    if delay:
+        time.sleep(delay)
+
 # --------------------- Bank Class Definition ---------------------
 
+# Seed accounts: (acct_num, acct_type, init_acct_holder, acct_holder, balance)
+SEED_ACCOUNTS = [
+    (1001, 'checking', 'Alice', ('Alice', 'Jason', 'David'), 2100),
+    (1002, 'loan', 'Alice', ('Alice', 'Jason', 'David'), -300),
+    (1003, 'checking', 'Bob', ('Bob', 'Ivan', 'Kevin'), 3500),
+    (1004, 'loan', 'Bob', ('Bob', 'Ivan', 'Paul'), -900),
+    (1005, 'checking', 'Charlie', ('Charlie', 'Dave'), 9100),
+    (1006, 'loan', 'Charlie', ('Charlie', 'Dave', 'Gary'), -3200),
+    (1007, 'checking', 'Dave', ('Dave', 'Thomas', 'Henry'), 200),
+    (1008, 'loan', 'Dave', ('Dave', 'James', 'Gary'), -300),
+    (1009, 'checking', 'Frank', ('Frank', 'Grace', 'Charlie'), 4000),
+    (1010, 'loan', 'Frank', ('Frank', 'Adam', 'Steven'), -900),
+    (1011, 'checking', 'Grace', ('Grace', 'Adam', 'Heidi'), 3000),
+    (1012, 'loan', 'Grace', ('Grace', 'Robert', 'Larry'), -100),
+    (1013, 'checking', 'Heidi', ('Heidi', 'Mark', 'Kate'), 500),
+    (1014, 'loan', 'Heidi', ('Heidi', 'Ivan', 'Dave'), -200),
+    (1015, 'checking', 'Ivan', ('Ivan', 'Charlie', 'Bob'), 5000),
+    (1016, 'loan', 'Ivan', ('Ivan', 'Michael', 'Mark'), -2100),
+    (1017, 'checking', 'John', ('John', 'Raymond', 'Dave'), 6200),
+    (1018, 'loan', 'John', ('John', 'Frank', 'Justin'), -2000),
+    (1019, 'checking', 'Kate', ('Kate', 'Kevin', 'Justin'), 5200),
+    (1020, 'loan', 'Kate', ('Kate', 'Thomas', 'James'), -1800),
+    (1021, 'checking', 'James', ('James', 'John', 'Grace'), 8700),
+    (1022, 'loan', 'James', ('James', 'Larry', 'Alice'), -700),
+    (1023, 'checking', 'Michael', ('Michael', 'Jason', 'Eve'), 7400),
+    (1024, 'loan', 'Michael', ('Michael', 'Ivan', 'Gary'), -4900),
+    (1025, 'checking', 'Robert', ('Robert', 'Frank', 'Grace'), 8400),
+    (1026, 'loan', 'Robert', ('Robert', 'Ivan', 'Justin'), -400),
+    (1027, 'checking', 'William', ('William', 'Alice', 'Heidi'), 6600),
+    (1028, 'loan', 'William', ('William', 'Justin', 'Henry'), -5000),
+    (1029, 'checking', 'David', ('David', 'Raymond', 'Bob'), 2400),
+    (1030, 'loan', 'David', ('David', 'Kate', 'Mark'), -200),
+    (1031, 'checking', 'Thomas', ('Thomas', 'Charlie', 'Dave'), 8700),
+    (1032, 'loan', 'Thomas', ('Thomas', 'Grace', 'Robert'), -2900),
+    (1033, 'checking', 'Mark', ('Mark', 'Steven', 'Justin'), 7800),
+    (1034, 'loan', 'Mark', ('Mark', 'Paul', 'Bob'), -5900),
+    (1035, 'checking', 'Steven', ('Steven', 'Grace', 'William'), 2400),
+    (1036, 'loan', 'Steven', ('Steven', 'David', 'Justin'), -1900),
+    (1037, 'checking', 'Paul', ('Paul', 'Charlie', 'Steven'), 7800),
+    (1038, 'loan', 'Paul', ('Paul', 'Eve', 'Dave'), -2500),
+    (1039, 'checking', 'Kevin', ('Kevin', 'Kate', 'Larry'), 4400),
+    (1040, 'loan', 'Kevin', ('Kevin', 'Ivan', 'James'), -800),
+    (1041, 'checking', 'Jason', ('Jason', 'Adam', 'Henry'), 1400),
+    (1042, 'loan', 'Jason', ('Jason', 'Raymond', 'William'), -200),
+    (1043, 'checking', 'Gary', ('Gary', 'Larry', 'Ivan'), 3400),
+    (1044, 'loan', 'Gary', ('Gary', 'Frank', 'James'), -900),
+    (1045, 'checking', 'Larry', ('Larry', 'Frank', 'Heidi'), 5400),
+    (1046, 'loan', 'Larry', ('Larry', 'William', 'David'), -300),
+    (1047, 'checking', 'Justin', ('Justin', 'John', 'Dave'), 3400),
+    (1048, 'loan', 'Justin', ('Justin', 'Charlie', 'Alice'), -1500),
+    (1049, 'checking', 'Raymond', ('Raymond', 'Henry', 'James'), 9400),
+    (1050, 'loan', 'Raymond', ('Raymond', 'Steven', 'Mark'), -6900),
+    (1051, 'checking', 'Adam', ('Adam', 'Charlie', 'Michael'), 5400),
+    (1052, 'loan', 'Adam', ('Adam', 'Larry', 'Jason'), -4600),
+    (1053, 'checking', 'Henry', ('Henry', 'Henry', 'James'), 8300),
+    (1054, 'loan', 'Henry', ('Henry', 'Steven', 'Mark'), -1800),
+    (1055, 'checking', 'Eve', ('Eve', 'Michael', 'Justin'), 2200),
+    (1056, 'loan', 'Eve', ('Eve', 'William', 'Alice'), -400),
+]
+
+# Lock-free attempts Bank.read_balances makes before reading under locks.
+READ_RETRIES = 8
+
+# Accounts with more holders than this check membership with a frozenset
+# (see holder_set); up to this many, scanning the tuple is as fast and
+# costs no extra memory.
+SMALL_HOLDER_COUNT = 4
+
+def holder_set(acct_holder):
+    """The container authorization checks test `user in`: acct_holder itself, or a frozenset if it is long."""
+    return acct_holder if len(acct_holder) <= SMALL_HOLDER_COUNT else frozenset(acct_holder)
+
+class Account:
+    """
+    One bank account. __slots__ keeps each record to a fixed set of fields
+    instead of a per-instance dict; holder names are interned so the same
+    name is stored once across all accounts. History lives in the Bank's
+    HistoryStore, not on the record. The lock is a shared stripe from the
+    Bank, not a lock of its own. acct_holder keeps the holders in the order
+    they were added; holders is the same names for membership checks.
+    """
+    __slots__ = ('acct_num', 'acct_type', 'init_acct_holder', 'acct_holder', 'holders', 'balance', 'lock', 'version')
+
+    def __init__(self, acct_num, acct_type, init_acct_holder, acct_holder, balance, lock):
+        self.acct_num = acct_num
+        self.acct_type = sys.intern(acct_type)
+        self.init_acct_holder = sys.intern(init_acct_holder)
+        self.acct_holder = tuple(sys.intern(holder) for holder in acct_holder)
+        self.holders = holder_set(self.acct_holder)
+        self.balance = balance
+        self.lock = lock
+        # Committed balance for lock-free readers (see committed_balance):
+        # the plain creation balance until the first commit, then the last
+        # two versions as one (seq, balance, prev_seq, prev_balance) tuple,
+        # replaced whole so readers never see a torn pair.
+        self.version = balance
+
+def committed_balance(version, seq):
+    """The balance recorded in an Account.version as of commit seq, or None if both kept versions are newer."""
+    if type(version) is int:
+        return version
+    if version[0] <= seq:
+        return version[1]
+    if version[2] <= seq:
+        return version[3]
+    return None
+
+class AccountLocks:
+    """
+    Holds the locks of some accounts for a with block: taken in stripe
+    order, the wait and the hold timed into METRICS, and a sample of
+    acquisitions logged (see metrics.Metrics.lock_log_rate).
+    """
+    __slots__ = ('bank', 'accounts', 'purpose', 'locks', 'acquired', 'wait')
+
+    def __init__(self, bank, accounts, purpose):
+        self.bank = bank
+        self.accounts = accounts
+        self.purpose = purpose
+
+    def __enter__(self):
+        accounts = self.accounts
+        self.locks = [accounts[0].lock] if len(accounts) == 1 else self.bank.ordered_locks(*accounts)
+        tracing.mark('lookup')
+        start = time.perf_counter()
+        for lock in self.locks:
+            lock.acquire()
+        self.acquired = time.perf_counter()
+        tracing.mark('lock_wait')
+        self.wait = self.acquired - start
+        if METRICS.log_lock():
+            logging.info("Locking account(s) %s for %s (waited %.6fs)",
+                         ", ".join(str(account.acct_num) for account in accounts), self.purpose, self.wait)
+        return self
+
+    def __exit__(self, *exc):
+        hold = time.perf_counter() - self.acquired
+        for lock in reversed(self.locks):
+            lock.release()
+        tracing.mark('critical_section')
+        METRICS.lock_timing(self.accounts, self.wait, hold)
+        return False
+
 class Bank:
-    def __init__(self):
-        # List of accounts. Each account is a dictionary containing:
-        # acct_num, acct_type, init_acct_holder, acct_holder, balance, history, lock
-        self.accounts = [
-            {'acct_num': 1001, 'acct_type': 'checking', 'init_acct_holder': 'Alice',
-             'acct_holder': ['Alice', 'Jason', 'David'], 'balance': 2100, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1002, 'acct_type': 'loan', 'init_acct_holder': 'Alice',
-             'acct_holder': ['Alice', 'Jason', 'David'], 'balance': -300, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1003, 'acct_type': 'checking', 'init_acct_holder': 'Bob',
-             'acct_holder': ['Bob', 'Ivan', 'Kevin'], 'balance': 3500, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1004, 'acct_type': 'loan', 'init_acct_holder': 'Bob',
-             'acct_holder': ['Bob', 'Ivan', 'Paul'], 'balance': -900, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1005, 'acct_type': 'checking', 'init_acct_holder': 'Charlie',
-             'acct_holder': ['Charlie', 'Dave'], 'balance': 9100, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1006, 'acct_type': 'loan', 'init_acct_holder': 'Charlie',
-             'acct_holder': ['Charlie', 'Dave', 'Gary'], 'balance': -3200, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1007, 'acct_type': 'checking', 'init_acct_holder': 'Dave',
-             'acct_holder': ['Dave', 'Thomas', 'Henry'], 'balance': 200, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1008, 'acct_type': 'loan', 'init_acct_holder': 'Dave',
-             'acct_holder': ['Dave', 'James', 'Gary'], 'balance': -300, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1009, 'acct_type': 'checking', 'init_acct_holder': 'Frank',
-             'acct_holder': ['Frank', 'Grace', 'Charlie'], 'balance': 4000, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1010, 'acct_type': 'loan', 'init_acct_holder': 'Frank',
-             'acct_holder': ['Frank', 'Adam', 'Steven'], 'balance': -900, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1011, 'acct_type': 'checking', 'init_acct_holder': 'Grace',
-             'acct_holder': ['Grace', 'Adam', 'Heidi'], 'balance': 3000, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1012, 'acct_type': 'loan', 'init_acct_holder': 'Grace',
-             'acct_holder': ['Grace', 'Robert', 'Larry'], 'balance': -100, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1013, 'acct_type': 'checking', 'init_acct_holder': 'Heidi',
-             'acct_holder': ['Heidi', 'Mark', 'Kate'], 'balance': 500, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1014, 'acct_type': 'loan', 'init_acct_holder': 'Heidi',
-             'acct_holder': ['Heidi', 'Ivan', 'Dave'], 'balance': -200, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1015, 'acct_type': 'checking', 'init_acct_holder': 'Ivan',
-             'acct_holder': ['Ivan', 'Charlie', 'Bob'], 'balance': 5000, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1016, 'acct_type': 'loan', 'init_acct_holder': 'Ivan',
-             'acct_holder': ['Ivan', 'Michael', 'Mark'], 'balance': -2100, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1017, 'acct_type': 'checking', 'init_acct_holder': 'John',
-             'acct_holder': ['John', 'Raymond', 'Dave'], 'balance': 6200, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1018, 'acct_type': 'loan', 'init_acct_holder': 'John',
-             'acct_holder': ['John', 'Frank', 'Justin'], 'balance': -2000, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1019, 'acct_type': 'checking', 'init_acct_holder': 'Kate',
-             'acct_holder': ['Kate', 'Kevin', 'Justin'], 'balance': 5200, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1020, 'acct_type': 'loan', 'init_acct_holder': 'Kate',
-             'acct_holder': ['Kate', 'Thomas', 'James'], 'balance': -1800, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1021, 'acct_type': 'checking', 'init_acct_holder': 'James',
-             'acct_holder': ['James', 'John', 'Grace'], 'balance': 8700, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1022, 'acct_type': 'loan', 'init_acct_holder': 'James',
-             'acct_holder': ['James', 'Larry', 'Alice'], 'balance': -700, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1023, 'acct_type': 'checking', 'init_acct_holder': 'Michael',
-             'acct_holder': ['Michael', 'Jason', 'Eve'], 'balance': 7400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1024, 'acct_type': 'loan', 'init_acct_holder': 'Michael',
-             'acct_holder': ['Michael', 'Ivan', 'Gary'], 'balance': -4900, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1025, 'acct_type': 'checking', 'init_acct_holder': 'Robert',
-             'acct_holder': ['Robert', 'Frank', 'Grace'], 'balance': 8400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1026, 'acct_type': 'loan', 'init_acct_holder': 'Robert',
-             'acct_holder': ['Robert', 'Ivan', 'Justin'], 'balance': -400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1027, 'acct_type': 'checking', 'init_acct_holder': 'William',
-             'acct_holder': ['William', 'Alice', 'Heidi'], 'balance': 6600, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1028, 'acct_type': 'loan', 'init_acct_holder': 'William',
-             'acct_holder': ['William', 'Justin', 'Henry'], 'balance': -5000, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1029, 'acct_type': 'checking', 'init_acct_holder': 'David',
-             'acct_holder': ['David', 'Raymond', 'Bob'], 'balance': 2400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1030, 'acct_type': 'loan', 'init_acct_holder': 'David',
-             'acct_holder': ['David', 'Kate', 'Mark'], 'balance': -200, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1031, 'acct_type': 'checking', 'init_acct_holder': 'Thomas',
-             'acct_holder': ['Thomas', 'Charlie', 'Dave'], 'balance': 8700, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1032, 'acct_type': 'loan', 'init_acct_holder': 'Thomas',
-             'acct_holder': ['Thomas', 'Grace', 'Robert'], 'balance': -2900, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1033, 'acct_type': 'checking', 'init_acct_holder': 'Mark',
-             'acct_holder': ['Mark', 'Steven', 'Justin'], 'balance': 7800, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1034, 'acct_type': 'loan', 'init_acct_holder': 'Mark',
-             'acct_holder': ['Mark', 'Paul', 'Bob'], 'balance': -5900, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1035, 'acct_type': 'checking', 'init_acct_holder': 'Steven',
-             'acct_holder': ['Steven', 'Grace', 'William'], 'balance': 2400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1036, 'acct_type': 'loan', 'init_acct_holder': 'Steven',
-             'acct_holder': ['Steven', 'David', 'Justin'], 'balance': -1900, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1037, 'acct_type': 'checking', 'init_acct_holder': 'Paul',
-             'acct_holder': ['Paul', 'Charlie', 'Steven'], 'balance': 7800, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1038, 'acct_type': 'loan', 'init_acct_holder': 'Paul',
-             'acct_holder': ['Paul', 'Eve', 'Dave'], 'balance': -2500, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1039, 'acct_type': 'checking', 'init_acct_holder': 'Kevin',
-             'acct_holder': ['Kevin', 'Kate', 'Larry'], 'balance': 4400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1040, 'acct_type': 'loan', 'init_acct_holder': 'Kevin',
-             'acct_holder': ['Kevin', 'Ivan', 'James'], 'balance': -800, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1041, 'acct_type': 'checking', 'init_acct_holder': 'Jason',
-             'acct_holder': ['Jason', 'Adam', 'Henry'], 'balance': 1400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1042, 'acct_type': 'loan', 'init_acct_holder': 'Jason',
-             'acct_holder': ['Jason', 'Raymond', 'William'], 'balance': -200, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1043, 'acct_type': 'checking', 'init_acct_holder': 'Gary',
-             'acct_holder': ['Gary', 'Larry', 'Ivan'], 'balance': 3400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1044, 'acct_type': 'loan', 'init_acct_holder': 'Gary',
-             'acct_holder': ['Gary', 'Frank', 'James'], 'balance': -900, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1045, 'acct_type': 'checking', 'init_acct_holder': 'Larry',
-             'acct_holder': ['Larry', 'Frank', 'Heidi'], 'balance': 5400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1046, 'acct_type': 'loan', 'init_acct_holder': 'Larry',
-             'acct_holder': ['Larry', 'William', 'David'], 'balance': -300, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1047, 'acct_type': 'checking', 'init_acct_holder': 'Justin',
-             'acct_holder': ['Justin', 'John', 'Dave'], 'balance': 3400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1048, 'acct_type': 'loan', 'init_acct_holder': 'Justin',
-             'acct_holder': ['Justin', 'Charlie', 'Alice'], 'balance': -1500, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1049, 'acct_type': 'checking', 'init_acct_holder': 'Raymond',
-             'acct_holder': ['Raymond', 'Henry', 'James'], 'balance': 9400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1050, 'acct_type': 'loan', 'init_acct_holder': 'Raymond',
-             'acct_holder': ['Raymond', 'Steven', 'Mark'], 'balance': -6900, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1051, 'acct_type': 'checking', 'init_acct_holder': 'Adam',
-             'acct_holder': ['Adam', 'Charlie', 'Michael'], 'balance': 5400, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1052, 'acct_type': 'loan', 'init_acct_holder': 'Adam',
-             'acct_holder': ['Adam', 'Larry', 'Jason'], 'balance': -4600, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1053, 'acct_type': 'checking', 'init_acct_holder': 'Henry',
-             'acct_holder': ['Henry', 'Henry', 'James'], 'balance': 8300, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1054, 'acct_type': 'loan', 'init_acct_holder': 'Henry',
-             'acct_holder': ['Henry', 'Steven', 'Mark'], 'balance': -1800, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1055, 'acct_type': 'checking', 'init_acct_holder': 'Eve',
-             'acct_holder': ['Eve', 'Michael', 'Justin'], 'balance': 2200, 'history': [], 'lock': threading.Lock()},
-            {'acct_num': 1056, 'acct_type': 'loan', 'init_acct_holder': 'Eve',
-             'acct_holder': ['Eve', 'William', 'Alice'], 'balance': -400, 'history': [], 'lock': threading.Lock()}
-        ]
+    def __init__(self, owns=None):
+        # Lock striping: accounts share a fixed pool of locks chosen by
+        # acct_num instead of allocating one lock per account.
+        self.lock_stripes = [threading.Lock() for _ in range(config.get("lock_stripes", 1024))]
+        # List of Account records: SEED_ACCOUNTS, or the seed_file loaded
+        # below. owns(acct_num), if given, picks the accounts this Bank
+        # holds (a shard's share).
+        seeds = [] if config.get("seed_file") else SEED_ACCOUNTS
+        self.accounts = [self.new_account(*row) for row in seeds if owns is None or owns(row[0])]
+        # Hash indexes over self.accounts so lookups are O(1) instead of a scan:
+        #   accounts_by_num:         acct_num -> account
+        #   accounts_by_init_holder: init_acct_holder -> accounts they opened
+        #   accounts_by_holder:      holder name -> accounts they can access
+        #                            (the reverse of each Account's holders)
+        # index_lock keeps the list and the indexes consistent on insert and
+        # when a holder is added.
+        self.index_lock = threading.Lock()
+        self.accounts_by_num = {}
+        self.accounts_by_init_holder = {}
+        self.accounts_by_holder = {}
+        # Every committed change goes through publish() under commit_lock,
+        # which numbers it (commit_seq), installs the new account versions
+        # and keeps the running per-acct_type aggregates
+        # (acct_type -> [accounts, total balance]) so show_totals is O(1).
+        self.commit_lock = threading.Lock()
+        self.commit_seq = 0
+        self.totals = {}
+        # The most recent commits as (commit_seq, time, changes), oldest
+        # first, where changes are its (account, delta, history_entry)
+        # tuples, or None for a bulk insert too large to list. Lets
+        # show_changes send only what changed since a client's last refresh
+        # and subscribe resume a stream.
+        self.changes = collections.deque(maxlen=config.get("change_log_size", 65536))
+        # acct_num -> amount debited from account.balance but held in escrow
+        # by an uncommitted cross-shard transfer (sharding.Participant).
+        # Versions and snapshots add it back, so readers, the change feed
+        # and recovery only ever see committed balances.
+        self.held = {}
+        # Live subscribe streams, fed every commit by publish()
+        self.feed = ChangeFeed()
+        self._index_accounts(self.accounts)
+        # Transaction history for every account (memory-mapped columns on disk)
+        self.history = HistoryStore(config.get("history_dir"))
+        self.interest = InterestEngine(self, config)
+        # Queues deposit/withdraw/pay_loan_check per account and applies them in batches
+        self.batcher = WriteBatcher(self, config.get("write_batch_max", 1))
+        # Write-ahead log (persistence.WriteAheadLog), attached by
+        # persistence.attach() when "persistence" is enabled in config.json.
+        self.wal = None
+        # Responses kept for requests retried with the same idempotency_key
+        self.responses = new_response_cache(self.log_response)
+        # replication.Primary streaming the log to read replicas, or, on a
+        # replica, the replication.Replica keeping this Bank up to date.
+        self.primary = None
+        self.replica = None
+        if config.get("seed_file"):
+            bulk_load.load_file(self, config["seed_file"], config.get("seed_history_file"), owns)
+
+    def reset_accounts(self):
+        """Drop every account and index entry (used before loading a snapshot)."""
+        self.accounts = []
+        self.accounts_by_num = {}
+        self.accounts_by_init_holder = {}
+        self.accounts_by_holder = {}
+        with self.commit_lock:
+            self.totals = {}
+            self.changes.clear()
+        self.history.close()
+        self.history = HistoryStore(config.get("history_dir"))
+
+    def record(self, account, entry, ts=None):
+        """Append entry to account's history."""
+        self.history.append(account.acct_num, entry, ts)
+
+    def commit_changes(self, *changes):
+        """
+        Commit (account, balance_delta, history_entry) changes already made
+        to the balances: publish them to readers and the running totals, and
+        append a write-ahead log record. Returns its lsn (None when
+        persistence is off). The caller holds the locks of every account
+        involved.
+        """
+        self.publish(changes)
+        if self.wal is None:
+            return None
+        return self.wal.append({'op': 'apply', 'ts': time.time(),
+                                'changes': [[account.acct_num, delta, entry] for account, delta, entry in changes]})
+
+    def post(self, legs, purpose):
+        """
+        Apply (account, delta, history_entry) legs as one commit. The locks
+        of every account are taken together in stripe order, so concurrent
+        posts cannot deadlock, and funds are checked under them: if a debit
+        would take its account below zero nothing is applied. Returns
+        (None, balances) once the commit is durable, or (account, balances)
+        for the first short account; balances has one entry per leg.
+        """
+        # Every history row is checked first, so a row that cannot be
+        # written is refused before any balance changes.
+        for account, _, entry in legs:
+            check_entry(account.acct_num, entry)
+        with self.locked(*[account for account, _, _ in legs], purpose=purpose):
+            for account, delta, _ in legs:
+                if delta < 0 and account.balance + delta < 0:
+                    return account, [account.balance for account, _, _ in legs]
+            for account, delta, entry in legs:
+                account.balance += delta
+                self.record(account, entry)
+            lsn = self.commit_changes(*legs)
+            balances = [account.balance for account, _, _ in legs]
+        self.wait_durable(lsn)
+        return None, balances
+
+    def wait_durable(self, lsn):
+        """Wait for lsn to reach disk. Called after the account locks are released."""
+        if lsn is not None:
+            self.wal.wait(lsn)
+            tracing.mark('durable')
+
+    def log_response(self, user, key, fingerprint, response, expires):
+        """Make an idempotency cache entry durable before its response is sent."""
+        if self.wal is None:
+            return
+        self.wait_durable(self.wal.append({'op': 'response', 'key': [user, key], 'fingerprint': fingerprint,
+                                           'response': response, 'expires': expires}))
+
+    def snapshot_state(self, mark=None):
+        """
+        Briefly stop all writers, rotate the log and copy every account.
+        Returns (lsn, rows) where rows match persistence.write_snapshot.
+        mark(), if given, is called instead of rotating the log and returns
+        the lsn instead (replication.Primary uses it to start a replica's
+        stream exactly where the copy ends).
+        """
+        with self.index_lock:
+            for lock in self.lock_stripes:
+                lock.acquire()
+            try:
+                lsn = self.wal.rotate() if mark is None else mark()
+                rows = [[account.acct_num, account.acct_type, account.init_acct_holder, list(account.acct_holder),
+                         account.balance + self.held.get(account.acct_num, 0),
+                         self.history.entries(account.acct_num, with_ts=True)]
+                        for account in self.accounts]
+            finally:
+                for lock in reversed(self.lock_stripes):
+                    lock.release()
+        return lsn, rows
+
+    def publish(self, changes, accounts=0):
+        """
+        Make (account, delta, history_entry) changes visible as one commit:
+        install each account's committed balance (its balance plus anything
+        held in escrow) as its new version, add the deltas to the per-type
+        totals and pass the commit to subscribers. commit_seq moves last, so
+        a reader that sees it also sees every version it covers.
+        """
+        with self.commit_lock:
+            seq = self.commit_seq + 1
+            held = self.held
+            for change in changes:
+                account = change[0]
+                balance = account.balance + held.get(account.acct_num, 0) if held else account.balance
+                previous = account.version
+                if type(previous) is int:
+                    account.version = (seq, balance, 0, previous)
+                else:
+                    account.version = (seq, balance, previous[0], previous[1])
+                totals = self.totals.setdefault(account.acct_type, [0, 0])
+                totals[0] += accounts
+                totals[1] += change[1]
+            ts = time.time()
+            self.changes.append((seq, ts, changes))
+            if self.feed.subscriptions:
+                self.feed.publish(seq, ts, changes)
+            self.commit_seq = seq
+
+    def changed_since(self, since):
+        """
+        (commit_seq, the accounts changed by the commits after since, in
+        account number order), or (commit_seq, None) if those commits are no
+        longer all in self.changes.
+        """
+        with self.commit_lock:
+            now, recent = self.commits_since(since)
+        if recent is None:
+            return now, None
+        changed = {}
+        for _, _, changes in recent:
+            if changes is None:
+                return now, None
+            for change in changes:
+                changed[change[0].acct_num] = change[0]
+        return now, [changed[acct_num] for acct_num in sorted(changed)]
+
+    def commits_since(self, since):
+        """
+        (commit_seq, the self.changes entries after since, oldest first), or
+        (commit_seq, None) if they are not all there any more. Caller holds
+        commit_lock.
+        """
+        now = self.commit_seq
+        if not 0 <= now - since <= len(self.changes):
+            return now, None
+        recent = list(itertools.islice(reversed(self.changes), now - since))
+        recent.reverse()
+        return now, recent
+
+    def change_rows(self, since, limit):
+        """(commit_seq, report rows of the accounts changed after since), or (commit_seq, None) if there are over limit or they are not all known."""
+        now, accounts = self.changed_since(since)
+        if accounts is None or len(accounts) > limit:
+            return now, None
+        return now, self.account_rows(accounts)
+
+    def read_balances(self, accounts):
+        """
+        Committed balances of accounts as of one commit, without taking any
+        account lock. Each account keeps its last two versions; if one was
+        committed to more than once while the others were read, the read is
+        retried at a newer commit, and after READ_RETRIES falls back to
+        reading under the account locks.
+        """
+        for _ in range(READ_RETRIES):
+            seq = self.commit_seq
+            balances = []
+            for account in accounts:
+                balance = committed_balance(account.version, seq)
+                if balance is None:
+                    break
+                balances.append(balance)
+            else:
+                return balances
+        locks = self.ordered_locks(*accounts)
+        for lock in locks:
+            lock.acquire()
+        try:
+            return [committed_balance(account.version, self.commit_seq) for account in accounts]
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def read_balance(self, account):
+        """The last committed balance of one account (lock-free)."""
+        return committed_balance(account.version, self.commit_seq)
+
+    def totals_snapshot(self):
+        """{acct_type: (accounts, total balance)} as of the latest commit."""
+        with self.commit_lock:
+            return {acct_type: tuple(totals) for acct_type, totals in self.totals.items()}
+
+    def lock_for(self, acct_num):
+        """Return the striped lock guarding acct_num."""
+        return self.lock_stripes[acct_num % len(self.lock_stripes)]
+
+    def new_account(self, acct_num, acct_type, init_acct_holder, acct_holder, balance):
+        """Build an Account wired to its lock stripe (does not index it)."""
+        return Account(acct_num, acct_type, init_acct_holder, acct_holder, balance, self.lock_for(acct_num))
+
+    def locked(self, *accounts, purpose=""):
+        """Context manager holding the locks of accounts (see AccountLocks)."""
+        return AccountLocks(self, accounts, purpose)
+
+    def ordered_locks(self, *accounts):
+        """
+        Return the distinct locks for accounts in a global (stripe index) order.
+        Two accounts can share a stripe, so each lock appears only once.
+        """
+        stripes = sorted({acct.acct_num % len(self.lock_stripes) for acct in accounts})
+        return [self.lock_stripes[i] for i in stripes]
+
+    def _index_account(self, account):
+        """Add an account to every lookup index (caller holds index_lock or is __init__)."""
+        self._index_accounts((account,))
+
+    def _index_accounts(self, accounts):
+        """
+        Add new accounts to every lookup index and the totals in one pass and
+        one commit (caller holds index_lock or is __init__). A new account's
+        version is its opening balance, so no versions need installing.
+        """
+        by_num = self.accounts_by_num
+        by_init_holder = self.accounts_by_init_holder
+        by_holder = self.accounts_by_holder
+        added = {}
+        for account in accounts:
+            by_num[account.acct_num] = account
+            by_init_holder.setdefault(account.init_acct_holder, []).append(account)
+            for holder in dict.fromkeys(account.acct_holder):
+                by_holder.setdefault(holder, []).append(account)
+            totals = added.setdefault(account.acct_type, [0, 0])
+            totals[0] += 1
+            totals[1] += account.balance
+        changes = None
+        if len(accounts) <= REPORT_CHUNK_ROWS:
+            changes = tuple((account, account.balance, (account.init_acct_holder, 'create_account', account.balance))
+                            for account in accounts)
+        with self.commit_lock:
+            for acct_type, (count, balance) in added.items():
+                totals = self.totals.setdefault(acct_type, [0, 0])
+                totals[0] += count
+                totals[1] += balance
+            seq = self.commit_seq + 1
+            ts = time.time()
+            self.changes.append((seq, ts, changes))
+            if changes is not None and self.feed.subscriptions:
+                self.feed.publish(seq, ts, changes)
+            self.commit_seq = seq
+
+    def find_account(self, acct_num):
+        """Return the account with the given number, or None."""
+        account = self.accounts_by_num.get(int(acct_num))
+        tracing.mark('lookup')
+        return account
+
+    def find_init_account(self, user, acct_type=None):
+        """Return the first account opened by user (optionally of acct_type), or None."""
+        for account in self.accounts_by_init_holder.get(user, ()):
+            if acct_type is None or account.acct_type == acct_type:
+                return account
+        return None
+
+    def accounts_for_holder(self, user):
+        """Return every account that lists user as a holder."""
+        return list(self.accounts_by_holder.get(user, ()))
+
+    def _add_holder(self, account, holder):
+        """Make holder a holder of account, in the account and in accounts_by_holder (caller holds index_lock)."""
+        holder = sys.intern(holder)
+        acct_holder = account.acct_holder + (holder,)
+        account.holders = holder_set(acct_holder)
+        account.acct_holder = acct_holder
+        self.accounts_by_holder.setdefault(holder, []).append(account)
 
     def create_account(self, data_dict):
-        # Check if the user already has an account
-        for account in self.accounts:
-            if account['init_acct_holder'] == data_dict['user']:
+        # The duplicate checks and the insert happen under index_lock so two
+        # concurrent creates cannot both claim the same holder or number.
+        with self.index_lock:
+            # Check if the user already has an account
+            if data_dict['user'] in self.accounts_by_init_holder:
                 return "One person can only create one account"
-        # Check if the account number specified by the user is already in use
-        for account in self.accounts:
-            if int(account['acct_num']) == int(data_dict['acct_num']):
-                return f"The account number has been used by {account['init_acct_holder']}"
-        # Create new account
-        new_account = {
-            'acct_num': int(data_dict['acct_num']),
-            'acct_type': 'checking',
-            'init_acct_holder': data_dict['user'],
-            'acct_holder': [data_dict['user']],
-            'balance': int(data_dict.get('amount', 0)),
-            'history': [],
-            'lock': threading.Lock()
-        }
-        # Add new account to the list
-        self.accounts.append(new_account)
+            # Check if the account number specified by the user is already in use
+            existing = self.find_account(data_dict['acct_num'])
+            if existing is not None:
+                return f"The account number has been used by {existing.init_acct_holder}"
+            # Create new account
+            new_account = self.new_account(int(data_dict['acct_num']), 'checking', data_dict['user'],
+                                           [data_dict['user']], int(data_dict.get('amount', 0)))
+            # Add new account to the list and the indexes
+            self.accounts.append(new_account)
+            self._index_account(new_account)
+            lsn = None
+            if self.wal is not None:
+                lsn = self.wal.append({'op': 'create', 'account': [
+                    new_account.acct_num, new_account.acct_type, new_account.init_acct_holder,
+                    list(new_account.acct_holder), new_account.balance]})
+        self.wait_durable(lsn)
         return f"Successfully created checking account for {data_dict['user']} with account number {int(data_dict['acct_num'])}。"
 
+    def add_holder(self, data_dict):
+        """The account's initiate holder adds holder=<name> as another holder of acct_num."""
+        holder = str(data_dict.get('holder', ''))
+        with self.index_lock:
+            account = self.find_account(data_dict['acct_num'])
+            if account is None:
+                return "The account number was not found"
+            error = add_holder_error(data_dict['user'], holder, account.init_acct_holder, holder in account.holders)
+            if error is not None:
+                return error
+            self._add_holder(account, holder)
+            lsn = None
+            if self.wal is not None:
+                lsn = self.wal.append({'op': 'holder', 'acct_num': account.acct_num, 'holder': holder})
+        self.wait_durable(lsn)
+        return f"{holder} is now a holder of account {account.acct_num}"
+
     def show_bank(self, data_dict):
         # Check if the user is 'Audit'
         if data_dict['user'] != 'Audit':
             return "Access denied: only Audit can view all bank accounts"
-        # Prepare data for table format
-        table_data = []
-        for account in self.accounts:
-            row = [
-                account['acct_num'],
-                account['acct_type'],
-                account['init_acct_holder'],
-                ', '.join(account['acct_holder']),
-                account['balance'],
-                account['history']
-            ]
-            table_data.append(row)
-        headers = ["acct_num", "acct_type", "init_holder", "acct_holder", "balance", "history"]
-        formatted_table = tabulate(table_data, headers=headers, tablefmt="plain")
-        return f"All account information is as follows:\n{formatted_table}"
+        if 'cursor' in data_dict or 'limit' in data_dict:
+            cursor = str(data_dict.get('cursor', 0))
+            if not cursor.isdigit():
+                return "Invalid request format: cursor must be a whole number"
+            limit = data_dict.get('limit', config.get("report_page_size", 500))
+            if limit < 1:
+                return "Invalid request format: limit must be 1 or more"
+            return self.bank_page(int(cursor), limit)
+        return self.bank_report(int(data_dict.get('history', 0)))
+
+    def bank_page(self, cursor, limit):
+        """
+        One page of the audit report. The commit it is labelled with is read
+        first, so show_changes since that commit covers anything the page
+        missed.
+        """
+        seq = self.commit_seq
+        rows = self.report_rows(cursor, limit)
+        end = cursor + len(rows)
+        return format_report_page(rows, len(self.accounts), seq, end if end < len(self.accounts) else None)
+
+    def show_changes(self, data_dict):
+        """Audit: report rows of the accounts changed since=<commit> (from a show_bank page or an earlier show_changes)."""
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view all bank accounts"
+        since = str(data_dict.get('since', ''))
+        if not since.isdigit():
+            return "The since field must be a commit number from show_bank or show_changes"
+        now, rows = self.change_rows(int(since), int(data_dict.get('limit', config.get("report_page_size", 500))))
+        return format_changes(rows, since, now)
+
+    def subscribe(self, data_dict):
+        """
+        Stream the events of acct_nums=1001,1002,... (every account the user
+        holds if left out; Audit may follow every account), optionally only
+        ops=deposit,withdraw,..., resuming after from=<commit>. Returns an
+        events.Subscription, which the connection handler sends until the
+        client goes away.
+        """
+        user = data_dict['user']
+        acct_nums = [acct_num for acct_num in parse_acct_nums(data_dict) if acct_num]
+        if not acct_nums and user != 'Audit':
+            acct_nums = [account.acct_num for account in self.accounts_for_holder(user)]
+            if not acct_nums:
+                return "The user must be an account holder to subscribe"
+        for acct_num in acct_nums:
+            account = self.find_account(acct_num)
+            if account is None:
+                return f"Account {acct_num} does not exist"
+            if user != 'Audit' and user not in account.holders:
+                return "Only the account holder can subscribe to an account"
+        ops = {op for op in str(data_dict.get('ops', '')).split(',') if op} or None
+        start = str(data_dict.get('from', ''))
+        if start and not start.isdigit():
+            return "The from field must be a commit number from an earlier subscribe stream"
+        with self.commit_lock:
+            now, backlog = self.commits_since(int(start)) if start else (self.commit_seq, [])
+            if backlog is None:
+                return f"Offset {start} is not available (now at commit {now}); subscribe again without from"
+            subscription = Subscription(self.feed, set(acct_nums) if acct_nums else None, ops,
+                                        config.get("subscriber_buffer_events", 10000), int(start or now), backlog)
+            self.feed.add(subscription)
+        return subscription
+
+    def show_replicas(self, data_dict):
+        """Where this primary's read replicas answer clients (client.RoutingPool sends reads there)."""
+        addresses = self.primary.addresses() if self.primary is not None else []
+        return f"Replicas: {', '.join(addresses)}" if addresses else "No replicas"
+
+    def bank_report(self, history=0):
+        """
+        Stream the audit report as text chunks of REPORT_CHUNK_ROWS accounts,
+        so the full table is never built in memory. With history=N each row
+        also gets the account's entry count and its last N entries.
+        """
+        yield format_report_header(history)
+        start = 0
+        while start < len(self.accounts):
+            yield format_report_rows(self.report_rows(start, REPORT_CHUNK_ROWS, history))
+            start += REPORT_CHUNK_ROWS
+        yield format_totals(self.totals_snapshot())
+
+    def report_rows(self, start, count, history=0):
+        """Report rows for accounts[start:start + count]; see format_report_rows."""
+        return self.account_rows(self.accounts[start:start + count], history)
+
+    def account_rows(self, accounts, history=0):
+        """Report rows for accounts, their balances all as of one commit; see format_report_rows."""
+        rows = []
+        for account, balance in zip(accounts, self.read_balances(accounts)):
+            row = [account.acct_num, account.acct_type, account.init_acct_holder, balance,
+                   account.acct_holder]
+            if history:
+                row += [self.history.count(account.acct_num), self.history.tail(account.acct_num, history)]
+            rows.append(row)
+        return rows
+
+    def show_totals(self, data_dict):
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view bank totals"
+        return format_totals(self.totals_snapshot())
+
+    def show_balances(self, data_dict):
+        """Audit: balances of the comma-separated acct_nums, all as of one commit, taking no locks."""
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view balances"
+        accounts = []
+        for acct_num in parse_acct_nums(data_dict):
+            account = self.find_account(acct_num)
+            if account is None:
+                return f"Account {acct_num} was not found"
+            accounts.append(account)
+        balances = self.read_balances(accounts)
+        return format_balances([(account.acct_num, balance) for account, balance in zip(accounts, balances)])
+
+    def my_accounts(self, data_dict):
+        """The accounts the user holds, with balances as of one commit, from accounts_by_holder (no scan)."""
+        accounts = self.accounts_for_holder(data_dict['user'])
+        balances = self.read_balances(accounts)
+        return format_my_accounts(data_dict['user'], [(account.acct_num, account.acct_type, account.init_acct_holder, balance)
+                                                      for account, balance in zip(accounts, balances)])
+
+    def stats(self, data_dict):
+        """Audit: server metrics, as a summary or (format=prometheus) in Prometheus text format."""
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view server statistics"
+        if data_dict.get('format') == 'prometheus':
+            return METRICS.prometheus()
+        return METRICS.summary()
+
+    def set_lock_logging(self, data_dict):
+        """Audit: change the fraction of lock acquisitions that are logged (rate=0 turns it off)."""
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can change lock logging"
+        rate = parse_rate(data_dict)
+        if rate is None:
+            return "The rate must be a number between 0 and 1"
+        METRICS.lock_log_rate = rate
+        return f"Lock logging sample rate set to {rate}"
+
+    def trace_dump(self, data_dict):
+        """Audit: the slowest traced requests, phase by phase (see tracing.py)."""
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view request traces"
+        return trace_dump_reply(data_dict)
+
+    def profile(self, data_dict):
+        """Audit: sample every thread's stack in the background into a folded stack file."""
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can profile the server"
+        return profile_reply(data_dict)
 
     def show_accountholders(self, data_dict):
         # Check if the user is the account initiate holder
-        for account in self.accounts:
-            if account['acct_num'] == int(data_dict['acct_num']):
-                if account['init_acct_holder'] == data_dict['user']:
-                    holders = ", ".join(account['acct_holder'])
-                    return f"All the account holders for account {data_dict['acct_num']} are: {holders}"
-                else:
-                    return "Only the account initiate holder has access to view all account holders"
-        return "The account number was not found"
+        account = self.find_account(data_dict['acct_num'])
+        if account is None:
+            return "The account number was not found"
+        if account.init_acct_holder != data_dict['user']:
+            return "Only the account initiate holder has access to view all account holders"
+        holders = ", ".join(account.acct_holder)
+        return f"All the account holders for account {data_dict['acct_num']} are: {holders}"
 
     def deposit(self, data_dict):
-        for account in self.accounts:
-            if account['acct_num'] == int(data_dict['acct_num']):
-                amount = int(data_dict.get('amount', 0))
-                if amount < 0:
-                    return "Deposit amount must be positive"
-                elif amount == 0:
-                    return f"The current balance for account {data_dict['acct_num']} is {account['balance']} dollars"
-                account['lock'].acquire()
-                logging.info("Locking account %s for deposit", account['acct_num'])
-                try:
-                    time.sleep(3)
-                    account['balance'] += amount
-                    account['history'].append((data_dict['user'], 'deposit', amount))
-                    return f"Successfully deposited {amount} dollars into account {data_dict['acct_num']}, current balance is {account['balance']} dollars"
-                finally:
-                    account['lock'].release()
-                    logging.info("Unlocked account %s after deposit", account['acct_num'])
-        return "The account number was not found"
+        account = self.find_account(data_dict['acct_num'])
+        if account is None:
+            return "The account number was not found"
+        amount = int(data_dict.get('amount', 0))
+        if amount < 0:
+            return "Deposit amount must be positive"
+        elif amount == 0:
+            return f"The current balance for account {data_dict['acct_num']} is {self.read_balance(account)} dollars"
+        simulate_latency()
+        return self.batcher.submit(account, self._apply_deposit, data_dict, "deposit")
+
+    def _apply_deposit(self, account, data_dict):
+        """One validated deposit's response and change (called by the batcher with the account lock held)."""
+        amount = int(data_dict['amount'])
+        entry = (data_dict['user'], 'deposit', amount)
+        return (f"Successfully deposited {amount} dollars into account {data_dict['acct_num']}, current balance is {account.balance + amount} dollars",
+                (account, amount, entry))
 
     def withdraw(self, data_dict):
-        for account in self.accounts:
-            if account['acct_num'] == int(data_dict['acct_num']):
-                amount = int(data_dict.get('amount', 0))
-                if amount < 0:
-                    return "The withdrawal amount must be a positive number"
-                elif amount == 0:
-                    return f"The current balance for account {data_dict['acct_num']} is {account['balance']} dollars"
-                if data_dict['user'] not in account['acct_holder']:
-                    return "Only the account holder can withdraw"
-                if account['balance'] < amount:
-                    return f"The account balance is insufficient and the current balance is {account['balance']}"
-                account['lock'].acquire()
-                logging.info("Locking account %s for withdrawal", account['acct_num'])
-                try:
-                    time.sleep(3)
-                    account['balance'] -= amount
-                    account['history'].append((data_dict['user'], 'withdraw', amount))
-                    return f"{data_dict['user']} successfully withdrew {amount} dollars from account {data_dict['acct_num']}. Current balance is {account['balance']}"
-                finally:
-                    account['lock'].release()
-                    logging.info("Unlocked account %s after withdrawal", account['acct_num'])
-        return "The account number was not found"
+        account = self.find_account(data_dict['acct_num'])
+        if account is None:
+            return "The account number was not found"
+        amount = int(data_dict.get('amount', 0))
+        if amount < 0:
+            return "The withdrawal amount must be a positive number"
+        elif amount == 0:
+            return f"The current balance for account {data_dict['acct_num']} is {self.read_balance(account)} dollars"
+        if data_dict['user'] not in account.holders:
+            return "Only the account holder can withdraw"
+        simulate_latency()
+        return self.batcher.submit(account, self._apply_withdraw, data_dict, "withdraw")
+
+    def _apply_withdraw(self, account, data_dict):
+        """
+        One withdrawal's response and change (account lock held). The funds
+        check happens here, against the balance left by every earlier queued
+        operation.
+        """
+        amount = int(data_dict['amount'])
+        if account.balance < amount:
+            return f"The account balance is insufficient and the current balance is {account.balance}", None
+        entry = (data_dict['user'], 'withdraw', amount)
+        return (f"{data_dict['user']} successfully withdrew {amount} dollars from account {data_dict['acct_num']}. Current balance is {account.balance - amount}",
+                (account, -amount, entry))
 
     def transfer_to(self, data_dict):
         amount = int(data_dict.get('amount', 0))
         if amount <= 0:
             return "The transfer amount must be a positive number"
-        user_account = None
-        for account in self.accounts:
-            if account['init_acct_holder'] == data_dict['user']:
-                user_account = account
-                break
+        user_account = self.find_init_account(data_dict['user'])
         if user_account is None:
             return "The user must be an initiate cardholder of an account in the bank in order to perform a transfer operation"
-        target_account = None
-        for account in self.accounts:
-            if account['acct_num'] == int(data_dict['acct_num']):
-                target_account = account
-                break
+        target_account = self.find_account(data_dict['acct_num'])
         if target_account is None:
             return "Target account does not exist"
-        if user_account['balance'] < amount:
-            return f"The account balance is insufficient and the current balance is {user_account['balance']}"
-        first_lock, second_lock = (user_account, target_account) if user_account['acct_num'] < target_account['acct_num'] else (target_account, user_account)
-        first_lock['lock'].acquire()
-        logging.info("Locking account %s for transfer", first_lock['acct_num'])
-        second_lock['lock'].acquire()
-        logging.info("Locking account %s for transfer", second_lock['acct_num'])
-        try:
-            time.sleep(3)
-            user_account['balance'] -= amount
-            target_account['balance'] += amount
-            user_account['history'].append((data_dict['user'], 'transfer_out', amount, data_dict['acct_num']))
-            target_account['history'].append((data_dict['user'], 'transfer_in', amount, user_account['acct_num']))
-            return (f"{data_dict['user']} successfully transferred {amount} dollars from account {user_account['acct_num']} "
-                    f"to account {data_dict['acct_num']}. Current balance for source account is {user_account['balance']} and target account is {target_account['balance']}.")
-        finally:
-            first_lock['lock'].release()
-            logging.info("Unlocked account %s after transfer", first_lock['acct_num'])
-            second_lock['lock'].release()
-            logging.info("Unlocked account %s after transfer", second_lock['acct_num'])
+        simulate_latency()
+        out_entry = (data_dict['user'], 'transfer_out', amount, data_dict['acct_num'])
+        in_entry = (data_dict['user'], 'transfer_in', amount, user_account.acct_num)
+        short, (source_balance, target_balance) = self.post(
+            [(user_account, -amount, out_entry), (target_account, amount, in_entry)], "transfer")
+        if short is not None:
+            return f"The account balance is insufficient and the current balance is {source_balance}"
+        return (f"{data_dict['user']} successfully transferred {amount} dollars from account {user_account.acct_num} "
+                f"to account {data_dict['acct_num']}. Current balance for source account is {source_balance} and target account is {target_balance}.")
 
     def pay_loan_check(self, data_dict):
         acct_num = int(data_dict['acct_num'])
         amount = int(data_dict.get('amount', 0))
         if amount <= 0:
             return "Repayment amount must be positive"
-        for account in self.accounts:
-            if account['acct_num'] == acct_num:
-                if account['acct_type'] != 'loan':
-                    return "The target account is not a loan account and cannot do repayment operation."
-                if data_dict['user'] not in account['acct_holder']:
-                    return "Only account holders can make repayments on this loan account"
-                account['lock'].acquire()
-                logging.info("Locking loan account %s for repayment (check)", account['acct_num'])
-                try:
-                    account['balance'] += amount
-                    account['history'].append((data_dict['user'], 'pay_loan', amount))
-                    return f"{data_dict['user']} successfully paid {amount} dollars to account {acct_num}. Current loan is {account['balance']}"
-                finally:
-                    account['lock'].release()
-                    logging.info("Unlocked loan account %s after repayment (check)", account['acct_num'])
-        return "The loan account was not found"
+        account = self.find_account(acct_num)
+        if account is None:
+            return "The loan account was not found"
+        if account.acct_type != 'loan':
+            return "The target account is not a loan account and cannot do repayment operation."
+        if data_dict['user'] not in account.holders:
+            return "Only account holders can make repayments on this loan account"
+        return self.batcher.submit(account, self._apply_pay_loan_check, data_dict, "loan payment")
+
+    def _apply_pay_loan_check(self, account, data_dict):
+        """One validated loan repayment's response and change (account lock held)."""
+        amount = int(data_dict['amount'])
+        entry = (data_dict['user'], 'pay_loan', amount)
+        return (f"{data_dict['user']} successfully paid {amount} dollars to account {account.acct_num}. Current loan is {account.balance + amount}",
+                (account, amount, entry))
 
     def pay_loan_transfer_to(self, data_dict):
         acct_num = int(data_dict['acct_num'])
         amount = int(data_dict.get('amount', 0))
         if amount <= 0:
             return "Repayment amount must be positive"
-        user_account = None
-        for account in self.accounts:
-            if account['init_acct_holder'] == data_dict['user'] and account['acct_type'] == 'checking':
-                user_account = account
-                break
+        user_account = self.find_init_account(data_dict['user'], 'checking')
         if user_account is None:
             return "The user's initial checking account has not been found and the repayment operation cannot be performed."
-        if user_account['balance'] < amount:
-            return f"Insufficient balance, current balance is {user_account['balance']}"
-        loan_account = None
-        for account in self.accounts:
-            if account['acct_num'] == acct_num:
-                if account['acct_type'] == 'loan':
-                    loan_account = account
-                    break
-        if loan_account is None:
+        loan_account = self.find_account(acct_num)
+        if loan_account is None or loan_account.acct_type != 'loan':
             return "Loan account not found"
-        if data_dict['user'] not in loan_account['acct_holder']:
+        if data_dict['user'] not in loan_account.holders:
             return "Only loan account holders can make repayment"
-        first_lock, second_lock = (user_account, loan_account) if user_account['acct_num'] < loan_account['acct_num'] else (loan_account, user_account)
-        first_lock['lock'].acquire()
-        logging.info("Locking account %s for loan transfer", first_lock['acct_num'])
-        second_lock['lock'].acquire()
-        logging.info("Locking account %s for loan transfer", second_lock['acct_num'])
+        out_entry = (data_dict['user'], 'transfer_to_loan', amount, acct_num)
+        in_entry = (data_dict['user'], 'loan_payment_received', amount, user_account.acct_num)
+        short, (source_balance, loan_balance) = self.post(
+            [(user_account, -amount, out_entry), (loan_account, amount, in_entry)], "loan transfer")
+        if short is not None:
+            return f"Insufficient balance, current balance is {source_balance}"
+        return (f"{data_dict['user']} successfully transferred {amount} dollars from account {user_account.acct_num} for repayment. "
+                f"Current loan for account {acct_num} is {loan_balance}")
+
+    def multi_transfer(self, data_dict):
+        """
+        Post legs=acct_num:amount,... in one atomic commit (negative amounts
+        are debits; they must sum to zero): every leg applies or none does.
+        The user must hold every debited account and every credited loan.
+        """
         try:
-            user_account['balance'] -= amount
-            loan_account['balance'] += amount
-            user_account['history'].append((data_dict['user'], 'transfer_to_loan', amount, acct_num))
-            loan_account['history'].append((data_dict['user'], 'loan_payment_received', amount, user_account['acct_num']))
-            return (f"{data_dict['user']} successfully transferred {amount} dollars from account {user_account['acct_num']} for repayment. "
-                    f"Current loan for account {acct_num} is {loan_account['balance']}")
-        finally:
-            first_lock['lock'].release()
-            logging.info("Unlocked account %s after loan transfer", first_lock['acct_num'])
-            second_lock['lock'].release()
-            logging.info("Unlocked account %s after loan transfer", second_lock['acct_num'])
+            legs = parse_legs(data_dict)
+        except ValueError as e:
+            return str(e)
+        user = data_dict['user']
+        accounts = []
+        for acct_num, amount in legs:
+            account = self.find_account(acct_num)
+            if account is None:
+                return f"Account {acct_num} was not found"
+            error = leg_error(acct_num, amount, account.acct_type, user in account.holders)
+            if error:
+                return error
+            accounts.append(account)
+        entries = leg_entries(user, legs, [account.acct_type for account in accounts])
+        simulate_latency()
+        short, balances = self.post([(account, amount, entry) for account, (_, amount), entry in zip(accounts, legs, entries)],
+                                    "multi_transfer")
+        if short is not None:
+            return f"The balance of account {short.acct_num} is insufficient, its current balance is {balances[accounts.index(short)]}"
+        return format_legs(user, legs, balances)
 
     def show_history(self, data_dict):
         acct_num = int(data_dict['acct_num'])
-        for account in self.accounts:
-            if account['acct_num'] == acct_num:
-                if data_dict['user'] not in account['acct_holder']:
-                    return "Only account holders can view the operation history of the account"
-                if not account['history']:
-                    return f"Account {acct_num} doesn't have any history now"
-                history_records = "\n".join([str(record) for record in account['history']])
-                return f"The operation history of account {acct_num} is \n{history_records}"
-        return "The account number was not found"
+        account = self.find_account(acct_num)
+        if account is None:
+            return "The account number was not found"
+        if data_dict['user'] not in account.holders:
+            return "Only account holders can view the operation history of the account"
+        try:
+            page, next_cursor = self.history_page(acct_num, data_dict)
+        except ValueError as e:
+            return str(e)
+        if not page:
+            if 'cursor' in data_dict or 'since' in data_dict or 'until' in data_dict:
+                return f"No more history for account {acct_num} in the requested range"
+            return f"Account {acct_num} doesn't have any history now"
+        return f"The operation history of account {acct_num} is \n{format_history(page, next_cursor)}"
 
     # --------------------- Additional Improvements ---------------------
 
     def apply_interest(self):
-        """Apply interest rate to all loan accounts."""
-        interest_rate = config.get("interest_rate", 0.05)
-        for account in self.accounts:
-            if account['acct_type'] == 'loan':
-                account['lock'].acquire()
-                try:
-                    old_balance = account['balance']
-                    new_balance = int(old_balance * (1 + interest_rate))
-                    account['history'].append(("System", "interest", new_balance - old_balance))
-                    account['balance'] = new_balance
-                    logging.info("Applied interest to loan account %s: old balance %s, new balance %s", account['acct_num'], old_balance, new_balance)
-                finally:
-                    account['lock'].release()
+        """Apply interest to all loan accounts (batched; see interest.InterestEngine)."""
+        return self.interest.run()
 
     def apply_interest_command(self, data_dict):
         """Command handler to manually trigger interest calculation."""
@@ -385,88 +955,1108 @@ class Bank:
         """Show transaction history filtered by an operation type (if provided)."""
         acct_num = int(data_dict['acct_num'])
         operation_filter = data_dict.get('operation', None)
-        for account in self.accounts:
-            if account['acct_num'] == acct_num:
-                if data_dict['user'] not in account['acct_holder']:
-                    return "Only account holders can view the operation history of the account"
-                filtered_history = []
-                for record in account['history']:
-                    if operation_filter is None or (len(record) >= 2 and record[1] == operation_filter):
-                        filtered_history.append(record)
-                if not filtered_history:
-                    return f"No transactions found for operation '{operation_filter}' in account {acct_num}"
-                history_records = "\n".join([str(record) for record in filtered_history])
-                return f"The filtered operation history of account {acct_num} is \n{history_records}"
-        return "The account number was not found"
+        account = self.find_account(acct_num)
+        if account is None:
+            return "The account number was not found"
+        if data_dict['user'] not in account.holders:
+            return "Only account holders can view the operation history of the account"
+        # Uses the store's per-operation index, so only matching rows are read.
+        try:
+            page, next_cursor = self.history_page(acct_num, data_dict, operation_filter)
+        except ValueError as e:
+            return str(e)
+        if not page:
+            return f"No transactions found for operation '{operation_filter}' in account {acct_num}"
+        return f"The filtered operation history of account {acct_num} is \n{format_history(page, next_cursor)}"
+
+    def history_page(self, acct_num, data_dict, operation=None):
+        """
+        One page of acct_num's history. Optional request fields (converted by
+        the command table): cursor (from a previous page), limit, and
+        since/until (epoch seconds). Raises ValueError with the message to
+        send back if the cursor or limit is out of range.
+        """
+        cursor = data_dict.get('cursor', 0)
+        limit = data_dict.get('limit', config.get("history_page_size", 100))
+        if cursor < 0:
+            raise ValueError("Invalid request format: cursor must be 0 or more")
+        if limit < 1:
+            raise ValueError("Invalid request format: limit must be 1 or more")
+        return self.history.query(acct_num, op=operation, since=data_dict.get('since'),
+                                  until=data_dict.get('until'), cursor=cursor, limit=limit)
 
 # --------------------- End of Bank Class ---------------------
 
-def handle_client(client_socket, bank):
-    while True:
-        data = client_socket.recv(1024)
-        if not data:
-            break
-        pairs = data.decode().split()
-        data_dict = dict(pair.split('=') for pair in pairs)
-        if len(data_dict) < 3:
-            response = "Invalid request format."
-            client_socket.send(response.encode())
-            continue
-        logging.info("Request received: user=%s command=%s account=%s, amount=%s",
-                     data_dict['user'], data_dict['command'], data_dict['acct_num'], data_dict.get('amount', 0))
-        if data_dict['command'] == 'create_account':
-            response = bank.create_account(data_dict)
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
-        elif data_dict['command'] == 'show_bank':
-            response = bank.show_bank(data_dict)
-            for i in range(0, len(response), 1024):
-                client_socket.send(response[i:i + 1024].encode())
-            client_socket.send(b"END")
-            continue
-        elif data_dict['command'] == 'show_accountholders':
-            response = bank.show_accountholders(data_dict)
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
-        elif data_dict['command'] == 'deposit':
-            response = bank.deposit(data_dict)
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
-        elif data_dict['command'] == 'withdraw':
-            response = bank.withdraw(data_dict)
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
-        elif data_dict['command'] == 'transfer_to':
-            response = bank.transfer_to(data_dict)
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
-        elif data_dict['command'] == 'pay_loan_check':
-            response = bank.pay_loan_check(data_dict)
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
-        elif data_dict['command'] == 'pay_loan_transfer_to':
-            response = bank.pay_loan_transfer_to(data_dict)
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
-        elif data_dict['command'] == 'show_history':
-            response = bank.show_history(data_dict)
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
-        elif data_dict['command'] == 'apply_interest':
-            response = bank.apply_interest_command(data_dict)
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
-        elif data_dict['command'] == 'show_history_filtered':
-            response = bank.show_history_filtered(data_dict)
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
+# --------------------- Sharded Bank ---------------------
+
+def shard_bank(shard_id, shards, shard_config):
+    """
+    Build the Bank for one shard process: only the accounts it owns, with its
+    own history and data directories (runs in the worker, see sharding.py).
+    """
+    config.update(shard_config)
+    config["data_dir"] = os.path.join(config.get("data_dir", "data"), f"shard-{shard_id}")
+    if config.get("history_dir"):
+        config["history_dir"] = os.path.join(config["history_dir"], f"shard-{shard_id}")
+    bank = Bank(owns=lambda acct_num: sharding.shard_of(acct_num, shards) == shard_id)
+    bank.responses = None  # the coordinator's ShardedBank answers retries
+    if config.get("persistence", False):
+        persistence.attach(bank, config)
+    METRICS.lock_log_rate = config.get("lock_log_sample", 0.0)
+    register_gauges(bank)
+    return bank
+
+class ShardedBank:
+    """
+    Drop-in replacement for Bank (same command methods, so dispatch and the
+    connection handlers are unchanged) that partitions accounts over worker
+    processes. Single-account commands go straight to the owning shard;
+    transfers between shards run as a two-phase commit (see sharding.py).
+
+    The coordinator keeps only a directory of every account's number, type
+    and initial holder, enough to route requests and to enforce the
+    bank-wide create_account rules. It also holds the idempotency cache,
+    in memory only: with shards, retries are not recognised across a restart.
+    """
+
+    def __init__(self, shards, shard_config=None):
+        context = multiprocessing.get_context("spawn")
+        shard_config = dict(config if shard_config is None else shard_config)
+        self.shards = [sharding.ShardClient(context, shard_bank, dispatch, i, shards, shard_config)
+                       for i in range(shards)]
+        self.index_lock = threading.Lock()
+        self.txids = itertools.count(1)
+        self.responses = new_response_cache()
+        self.primary = None   # replication needs the log of a single Bank
+        self.replica = None
+        # Directory: acct_num -> (acct_type, init_acct_holder), and
+        # init_acct_holder -> [(acct_num, acct_type), ...] in account number order.
+        # Holders both ways, so holder checks need no call to a shard:
+        # acct_num -> holder_set of its holders, and holder -> [acct_num, ...]
+        # in account number order.
+        self.directory = {}
+        self.accounts_by_init_holder = {}
+        self.holders = {}
+        self.accounts_by_holder = {}
+        for shard in self.shards:
+            for acct_num, acct_type, init_holder, holders in shard.call('accounts'):
+                self._index_account(acct_num, acct_type, init_holder, holders)
+
+    def _index_account(self, acct_num, acct_type, init_holder, holders):
+        self.directory[acct_num] = (acct_type, init_holder)
+        accounts = self.accounts_by_init_holder.setdefault(init_holder, [])
+        accounts.append((acct_num, acct_type))
+        accounts.sort()
+        self.holders[acct_num] = holder_set(tuple(holders))
+        for holder in dict.fromkeys(holders):
+            self._index_holder(acct_num, holder)
+
+    def _index_holder(self, acct_num, holder):
+        accounts = self.accounts_by_holder.setdefault(holder, [])
+        accounts.append(acct_num)
+        accounts.sort()
+
+    def shard_for(self, acct_num):
+        return self.shards[sharding.shard_of(acct_num, len(self.shards))]
+
+    def find_init_account(self, user, acct_type=None):
+        """acct_num of the first account opened by user (optionally of acct_type), or None."""
+        for acct_num, account_type in self.accounts_by_init_holder.get(user, ()):
+            if acct_type is None or account_type == acct_type:
+                return acct_num
+        return None
+
+    def route(self, data_dict):
+        """Run a single-account command on the shard that owns data_dict['acct_num']."""
+        return self.shard_for(data_dict['acct_num']).call('dispatch', data_dict)
+
+    show_accountholders = route
+    deposit = route
+    withdraw = route
+    pay_loan_check = route
+    show_history = route
+    show_history_filtered = route
+
+    def create_account(self, data_dict):
+        # Uniqueness is bank-wide, so it is checked here against the
+        # directory; index_lock serialises creates like Bank.create_account.
+        with self.index_lock:
+            if data_dict['user'] in self.accounts_by_init_holder:
+                return "One person can only create one account"
+            acct_num = int(data_dict['acct_num'])
+            if acct_num in self.directory:
+                return f"The account number has been used by {self.directory[acct_num][1]}"
+            created, response = self.shard_for(acct_num).call('create_account', data_dict)
+            if created:
+                self._index_account(acct_num, 'checking', data_dict['user'], (data_dict['user'],))
+        return response
+
+    def add_holder(self, data_dict):
+        # Checked here as well as on the shard, so the directory changes
+        # exactly when the account does; index_lock serialises the change.
+        holder = str(data_dict.get('holder', ''))
+        acct_num = int(data_dict['acct_num'])
+        with self.index_lock:
+            if acct_num not in self.directory:
+                return "The account number was not found"
+            error = add_holder_error(data_dict['user'], holder, self.directory[acct_num][1],
+                                     holder in self.holders[acct_num])
+            if error is not None:
+                return error
+            added, response = self.shard_for(acct_num).call('add_holder', data_dict)
+            if added:
+                self.holders[acct_num] = holder_set(tuple(self.holders[acct_num]) + (holder,))
+                self._index_holder(acct_num, holder)
+        return response
+
+    def my_accounts(self, data_dict):
+        """The accounts the user holds, from the directory, with each shard's balances read as of one commit."""
+        acct_nums = list(self.accounts_by_holder.get(data_dict['user'], ()))
+        balances = self.balances_of(acct_nums)
+        return format_my_accounts(data_dict['user'], [(acct_num, *self.directory[acct_num], balances[acct_num])
+                                                      for acct_num in acct_nums])
+
+    def show_bank(self, data_dict):
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view all bank accounts"
+        if 'cursor' in data_dict or 'limit' in data_dict:
+            limit = data_dict.get('limit', config.get("report_page_size", 500))
+            if limit < 1:
+                return "Invalid request format: limit must be 1 or more"
+            return self.bank_page(str(data_dict.get('cursor', '0:0')), limit)
+        return self.bank_report(int(data_dict.get('history', 0)))
+
+    def bank_page(self, cursor, limit):
+        """
+        Bank.bank_page across the shards in turn. The cursor is shard:offset
+        and the commit is every shard's commit number joined with dots.
+        """
+        seqs = [future.result() for future in [shard.submit('commit_seq') for shard in self.shards]]
+        counts = [future.result() for future in [shard.submit('account_count') for shard in self.shards]]
+        shard_id, start = (int(part) for part in cursor.split(':')) if ':' in cursor else (0, int(cursor))
+        rows = []
+        while shard_id < len(self.shards) and len(rows) < limit:
+            chunk = self.shards[shard_id].call('report_rows', start, limit - len(rows), 0)
+            rows += chunk
+            if len(rows) < limit:
+                shard_id, start = shard_id + 1, 0
+            else:
+                start += len(chunk)
+        # Past shards with nothing left, so the last page has no cursor
+        # instead of leading to an empty one.
+        while shard_id < len(self.shards) and start >= counts[shard_id]:
+            shard_id, start = shard_id + 1, 0
+        next_cursor = f"{shard_id}:{start}" if shard_id < len(self.shards) else None
+        return format_report_page(rows, len(self.directory), ".".join(map(str, seqs)), next_cursor)
+
+    def show_changes(self, data_dict):
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view all bank accounts"
+        since = str(data_dict.get('since', '')).split('.')
+        if len(since) != len(self.shards) or not all(seq.isdigit() for seq in since):
+            return "The since field must be a commit number from show_bank or show_changes"
+        limit = int(data_dict.get('limit', config.get("report_page_size", 500)))
+        futures = [shard.submit('change_rows', int(seq), limit) for shard, seq in zip(self.shards, since)]
+        results = [future.result() for future in futures]
+        now = ".".join(str(seq) for seq, _ in results)
+        if any(rows is None for _, rows in results) or sum(len(rows) for _, rows in results) > limit:
+            return format_changes(None, data_dict['since'], now)
+        return format_changes(sorted(row for _, rows in results for row in rows), data_dict['since'], now)
+
+    def show_replicas(self, data_dict):
+        return "No replicas"
+
+    def subscribe(self, data_dict):
+        # Each shard numbers its own commits, so there is no single offset to resume a merged stream from.
+        return "subscribe is not available when the bank is split into shards"
+
+    def bank_report(self, history=0):
+        """Bank.bank_report over every shard in turn, fetching one chunk of rows per call."""
+        yield format_report_header(history)
+        for shard in self.shards:
+            start = 0
+            while True:
+                rows = shard.call('report_rows', start, REPORT_CHUNK_ROWS, history)
+                if not rows:
+                    break
+                yield format_report_rows(rows)
+                start += REPORT_CHUNK_ROWS
+        yield format_totals(self.totals_snapshot())
+
+    def totals_snapshot(self):
+        totals = {}
+        for shard_totals in [future.result() for future in [shard.submit('totals') for shard in self.shards]]:
+            for acct_type, (accounts, balance) in shard_totals.items():
+                combined = totals.get(acct_type, (0, 0))
+                totals[acct_type] = (combined[0] + accounts, combined[1] + balance)
+        return totals
+
+    def show_totals(self, data_dict):
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view bank totals"
+        return format_totals(self.totals_snapshot())
+
+    def show_balances(self, data_dict):
+        """
+        Audit: balances of the comma-separated acct_nums. Each shard's
+        accounts are read as of one commit on that shard; a cross-shard
+        transfer may be visible on one side only.
+        """
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view balances"
+        acct_nums = parse_acct_nums(data_dict)
+        missing = [acct_num for acct_num in acct_nums if acct_num not in self.directory]
+        if missing:
+            return f"Account {missing[0]} was not found"
+        balances = self.balances_of(acct_nums)
+        return format_balances([(acct_num, balances[acct_num]) for acct_num in acct_nums])
+
+    def balances_of(self, acct_nums):
+        """{acct_num: balance}, asking each shard for its accounts in one call."""
+        by_shard = {}
+        for acct_num in acct_nums:
+            by_shard.setdefault(sharding.shard_of(acct_num, len(self.shards)), []).append(acct_num)
+        futures = [(nums, self.shards[shard].submit('balances', nums)) for shard, nums in by_shard.items()]
+        balances = {}
+        for nums, future in futures:
+            balances.update(zip(nums, future.result()))
+        return balances
+
+    def stats(self, data_dict):
+        """Audit: the coordinator's metrics followed by every shard's (labelled shard=N in Prometheus format)."""
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view server statistics"
+        if data_dict.get('format') == 'prometheus':
+            futures = [shard.submit('metric_families', (('shard', i),)) for i, shard in enumerate(self.shards)]
+            return metrics.render(METRICS.families(), *[future.result() for future in futures])
+        futures = [shard.submit('metrics_summary') for shard in self.shards]
+        parts = [f"Coordinator:\n{METRICS.summary()}"]
+        parts += [f"Shard {i}:\n{future.result()}" for i, future in enumerate(futures)]
+        return "\n\n".join(parts)
+
+    def set_lock_logging(self, data_dict):
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can change lock logging"
+        rate = parse_rate(data_dict)
+        if rate is None:
+            return "The rate must be a number between 0 and 1"
+        METRICS.lock_log_rate = rate
+        for future in [shard.submit('set_lock_log_rate', rate) for shard in self.shards]:
+            future.result()
+        return f"Lock logging sample rate set to {rate}"
+
+    def trace_dump(self, data_dict):
+        """Audit: the coordinator's slowest requests (the shards' own phases are not traced)."""
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can view request traces"
+        return trace_dump_reply(data_dict)
+
+    def profile(self, data_dict):
+        """Audit: profile the coordinator process (not the shard processes)."""
+        if data_dict['user'] != 'Audit':
+            return "Access denied: only Audit can profile the server"
+        return profile_reply(data_dict)
+
+    def transfer_to(self, data_dict):
+        amount = int(data_dict.get('amount', 0))
+        if amount <= 0:
+            return "The transfer amount must be a positive number"
+        source = self.find_init_account(data_dict['user'])
+        if source is None:
+            return "The user must be an initiate cardholder of an account in the bank in order to perform a transfer operation"
+        target = int(data_dict['acct_num'])
+        if target not in self.directory:
+            return "Target account does not exist"
+        source_shard, target_shard = self.shard_for(source), self.shard_for(target)
+        if source_shard is target_shard:
+            return source_shard.call('dispatch', data_dict)
+        simulate_latency()
+        txid = next(self.txids)
+        prepared, balance = source_shard.call('prepare_debit', txid, source, amount)
+        if not prepared:
+            return f"The account balance is insufficient and the current balance is {balance}"
+        source_balance, target_balance = self._commit(
+            txid, source_shard, target_shard, target, amount,
+            (data_dict['user'], 'transfer_out', amount, data_dict['acct_num']),
+            (data_dict['user'], 'transfer_in', amount, source))
+        return (f"{data_dict['user']} successfully transferred {amount} dollars from account {source} "
+                f"to account {data_dict['acct_num']}. Current balance for source account is {source_balance} and target account is {target_balance}.")
+
+    def pay_loan_transfer_to(self, data_dict):
+        acct_num = int(data_dict['acct_num'])
+        amount = int(data_dict.get('amount', 0))
+        if amount <= 0:
+            return "Repayment amount must be positive"
+        source = self.find_init_account(data_dict['user'], 'checking')
+        if source is None:
+            return "The user's initial checking account has not been found and the repayment operation cannot be performed."
+        source_shard, loan_shard = self.shard_for(source), self.shard_for(acct_num)
+        if source_shard is loan_shard:
+            return source_shard.call('dispatch', data_dict)
+        # The loan side's vote, from the directory and before anything is
+        # escrowed: the account must be a loan the user holds.
+        if self.directory.get(acct_num, (None,))[0] != 'loan':
+            return "Loan account not found"
+        if data_dict['user'] not in self.holders[acct_num]:
+            return "Only loan account holders can make repayment"
+        txid = next(self.txids)
+        prepared, balance = source_shard.call('prepare_debit', txid, source, amount)
+        if not prepared:
+            return f"Insufficient balance, current balance is {balance}"
+        _, loan_balance = self._commit(
+            txid, source_shard, loan_shard, acct_num, amount,
+            (data_dict['user'], 'transfer_to_loan', amount, acct_num),
+            (data_dict['user'], 'loan_payment_received', amount, source))
+        return (f"{data_dict['user']} successfully transferred {amount} dollars from account {source} for repayment. "
+                f"Current loan for account {acct_num} is {loan_balance}")
+
+    def multi_transfer(self, data_dict):
+        """
+        Run on the shard that owns every leg, or as a two-phase commit: each
+        debit is escrowed on its shard (all are aborted if one is short),
+        then every debit and credit commits in parallel.
+        """
+        try:
+            legs = parse_legs(data_dict)
+        except ValueError as e:
+            return str(e)
+        user = data_dict['user']
+        missing = [acct_num for acct_num, _ in legs if acct_num not in self.directory]
+        if missing:
+            return f"Account {missing[0]} was not found"
+        shards = {self.shard_for(acct_num) for acct_num, _ in legs}
+        if len(shards) == 1:
+            return shards.pop().call('dispatch', data_dict)
+        acct_types = [self.directory[acct_num][0] for acct_num, _ in legs]
+        for (acct_num, amount), acct_type in zip(legs, acct_types):
+            error = leg_error(acct_num, amount, acct_type, user in self.holders[acct_num])
+            if error:
+                return error
+        simulate_latency()
+        txids = {acct_num: next(self.txids) for acct_num, amount in legs if amount < 0}
+        votes = [(acct_num, self.shard_for(acct_num).submit('prepare_debit', txids[acct_num], acct_num, -amount))
+                 for acct_num, amount in legs if amount < 0]
+        short = None
+        prepared = []
+        for acct_num, future in votes:
+            ok, balance = future.result()
+            if ok:
+                prepared.append(acct_num)
+            elif short is None:
+                short = (acct_num, balance)
+        if short is not None:
+            for future in [self.shard_for(acct_num).submit('abort', txids[acct_num]) for acct_num in prepared]:
+                future.result()
+            return f"The balance of account {short[0]} is insufficient, its current balance is {short[1]}"
+        entries = leg_entries(user, legs, acct_types)
+        results = [self.shard_for(acct_num).submit('commit_debit', txids[acct_num], entry) if amount < 0
+                   else self.shard_for(acct_num).submit('credit', acct_num, amount, entry)
+                   for (acct_num, amount), entry in zip(legs, entries)]
+        return format_legs(user, legs, [future.result() for future in results])
+
+    def _commit(self, txid, source_shard, target_shard, target, amount, out_entry, in_entry):
+        """Phase two of a cross-shard transfer; both shards commit in parallel."""
+        debit = source_shard.submit('commit_debit', txid, out_entry)
+        credit = target_shard.submit('credit', target, amount, in_entry)
+        return debit.result(), credit.result()
+
+    def apply_interest(self):
+        """Run the interest pass on every shard at once; returns the number of accounts updated."""
+        futures = [shard.submit('apply_interest') for shard in self.shards]
+        return sum(future.result() for future in futures)
+
+    def apply_interest_command(self, data_dict):
+        if data_dict['user'] != 'Audit':
+            return "Only Audit can apply interest."
+        self.apply_interest()
+        return "Interest applied to all loan accounts."
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+# Accounts per show_bank chunk; each chunk is formatted and sent on its own.
+REPORT_CHUNK_ROWS = 256
+REPORT_COLUMNS = f"{'acct_num':<10} {'acct_type':<9} {'init_holder':<12} {'balance':>12}  acct_holder"
+
+def format_report_header(history=0):
+    header = REPORT_COLUMNS
+    if history:
+        header += f"  [history count, last {history}]"
+    return f"All account information is as follows:\n{header}\n"
+
+def format_report_page(rows, total, commit, next_cursor):
+    """A show_bank page, labelled with the commit show_changes can continue from."""
+    text = f"{total} accounts as of commit {commit}:\n{REPORT_COLUMNS}\n{format_report_rows(rows)}"
+    if next_cursor is not None:
+        text += f"More accounts available: repeat with cursor={next_cursor}\n"
+    return text
+
+def format_changes(rows, since, now):
+    if rows is None:
+        return f"Too many changes since commit {since} to list (now at commit {now}); reload with show_bank\n"
+    return f"{len(rows)} accounts changed since commit {since} (now at commit {now}):\n{REPORT_COLUMNS}\n{format_report_rows(rows)}"
+
+def format_report_rows(rows):
+    """Fixed-width report lines, so chunks line up without knowing every row in advance."""
+    lines = []
+    for row in rows:
+        line = f"{row[0]:<10} {row[1]:<9} {row[2]:<12} {row[3]:>12}  {', '.join(row[4])}"
+        if len(row) > 5:
+            line += f"  [{row[5]}, {row[6]}]"
+        lines.append(line + "\n")
+    return "".join(lines)
+
+# Most legs one multi_transfer may post (the locks of every account are held at once).
+MAX_LEGS = 64
+
+def parse_int_list(value):
+    """1001,1002,... as a list of ints; raises ValueError if a part is not a whole number."""
+    return [int(part) for part in str(value).split(',') if part]
+
+def parse_acct_nums(data_dict):
+    """The account numbers of a multi-account request: acct_nums=1001,1002,... (or acct_num), already prepared."""
+    if 'acct_nums' in data_dict:
+        return data_dict['acct_nums']
+    return [data_dict['acct_num']] if 'acct_num' in data_dict else []
+
+def parse_legs(data_dict):
+    """
+    The legs of a multi_transfer, legs=1001:-50,1003:30,1005:20, as
+    [(acct_num, amount), ...]. Raises ValueError with the message to send
+    back if they are malformed or do not balance.
+    """
+    try:
+        legs = [tuple(int(part) for part in leg.split(':')) for leg in str(data_dict.get('legs', '')).split(',') if leg]
+    except ValueError:
+        legs = None
+    if legs is None or any(len(leg) != 2 for leg in legs):
+        raise ValueError("Legs must be acct_num:amount pairs, e.g. legs=1001:-50,1003:30,1005:20")
+    if not all(I64_MIN <= value <= I64_MAX for leg in legs for value in leg):
+        raise ValueError("Leg account numbers and amounts are out of range")
+    if not 2 <= len(legs) <= MAX_LEGS:
+        raise ValueError(f"A multi_transfer needs between 2 and {MAX_LEGS} legs")
+    if any(amount == 0 for _, amount in legs):
+        raise ValueError("Every leg must move a nonzero amount")
+    if len({acct_num for acct_num, _ in legs}) != len(legs):
+        raise ValueError("Each account may appear in only one leg")
+    total = sum(amount for _, amount in legs)
+    if total:
+        raise ValueError(f"The debits and credits must balance, but the legs sum to {total}")
+    return legs
+
+def leg_error(acct_num, amount, acct_type, is_holder):
+    """Why the user (a holder if is_holder) may not post amount to the account, or None."""
+    if amount < 0 and not is_holder:
+        return f"Only account holders can debit account {acct_num}"
+    if amount > 0 and acct_type == 'loan' and not is_holder:
+        return f"Only loan account holders can make repayment on account {acct_num}"
+    return None
+
+def leg_entries(user, legs, acct_types):
+    """
+    History entries for multi_transfer legs. A leg names its counterparty
+    when there is exactly one account on the other side (a split payment
+    or a sweep).
+    """
+    debits = [acct_num for acct_num, amount in legs if amount < 0]
+    credits = [acct_num for acct_num, amount in legs if amount > 0]
+    entries = []
+    for (acct_num, amount), acct_type in zip(legs, acct_types):
+        if amount < 0:
+            entry, others = (user, 'transfer_out', -amount), credits
         else:
-            response = "Invalid command."
-            client_socket.send(response.encode())
-            client_socket.send(b"END")
+            entry, others = (user, 'loan_payment_received' if acct_type == 'loan' else 'transfer_in', amount), debits
+        entries.append(entry + (others[0],) if len(others) == 1 else entry)
+    return entries
+
+def format_legs(user, legs, balances):
+    lines = [f"{acct_num}: {amount:+d}, balance {balance}" for (acct_num, amount), balance in zip(legs, balances)]
+    return f"{user} successfully posted {len(legs)} legs in one transaction:\n" + "\n".join(lines)
+
+def format_balances(balances):
+    lines = [f"{acct_num}: {balance}" for acct_num, balance in balances]
+    lines.append(f"Total: {sum(balance for _, balance in balances)}")
+    return "Balances as of one commit:\n" + "\n".join(lines)
+
+def add_holder_error(user, holder, init_holder, already):
+    """Why user may not add holder to an account opened by init_holder (None if they may)."""
+    if not holder or holder != holder.strip() or any(c in holder for c in ",;"):
+        return "The holder field must be a name without spaces at either end, commas or semicolons"
+    if user != init_holder:
+        return "Only the account initiate holder can add account holders"
+    if already:
+        return f"{holder} is already a holder of this account"
+    return None
+
+def format_my_accounts(user, rows):
+    """Render (acct_num, acct_type, init_acct_holder, balance) rows, in account number order."""
+    if not rows:
+        return f"{user} is not a holder of any account"
+    lines = [f"{acct_num}: {acct_type}, opened by {init_holder}, balance {balance}"
+             for acct_num, acct_type, init_holder, balance in sorted(rows)]
+    return f"Accounts {user} holds:\n" + "\n".join(lines)
+
+def parse_rate(data_dict):
+    """The rate= field as a float in [0, 1], or None if it is missing or out of range."""
+    try:
+        rate = float(data_dict['rate'])
+    except (KeyError, ValueError):
+        return None
+    return rate if 0 <= rate <= 1 else None
+
+MAX_TRACED = 10000
+
+def trace_dump_reply(data_dict):
+    """
+    trace_dump: the slowest requests traced so far, then (reset=1) start
+    over. slowest=N instead starts keeping the N slowest (0 turns tracing off).
+    """
+    if 'slowest' in data_dict:
+        n = data_dict['slowest']
+        if not 0 <= n <= MAX_TRACED:
+            return f"slowest must be between 0 and {MAX_TRACED}"
+        tracing.configure(n)
+        return f"Tracing on: keeping the {n} slowest requests" if n else "Tracing off"
+    response = tracing.format_slowest()
+    if data_dict.get('reset') and tracing.SLOWEST is not None:
+        tracing.configure(tracing.SLOWEST.n)
+    return response
+
+def profile_reply(data_dict):
+    """profile: start sampling stacks for seconds=S (default 10) at hz=H (default 100)."""
+    seconds, hz = data_dict.get('seconds', 10), data_dict.get('hz', 100)
+    if not 0 < seconds <= tracing.MAX_PROFILE_SECONDS or not 0 < hz <= tracing.MAX_PROFILE_HZ:
+        return (f"seconds must be between 1 and {tracing.MAX_PROFILE_SECONDS}, "
+                f"and hz between 1 and {tracing.MAX_PROFILE_HZ}")
+    try:
+        path = tracing.start_profile(seconds, hz, config.get("profile_dir", "profiles"))
+    except OSError as e:
+        return f"Cannot write the profile: {e}"
+    if path is None:
+        return "A profile is already running"
+    return f"Profiling every thread at {hz} Hz for {seconds} seconds; the stacks will be written to {path}"
+
+def format_totals(totals):
+    """Render {acct_type: (accounts, total balance)} as a table."""
+    table_data = [[acct_type, accounts, balance] for acct_type, (accounts, balance) in sorted(totals.items())]
+    formatted_table = tabulate(table_data, headers=["acct_type", "accounts", "total_balance"], tablefmt="plain")
+    return f"Totals by account type:\n{formatted_table}"
+
+def format_history(page, next_cursor):
+    """Render a HistoryStore.query page, one entry per line, with a continuation hint."""
+    lines = [f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry[0]))} {entry[1:]}" for entry in page]
+    if next_cursor is not None:
+        lines.append(f"More records available: repeat with cursor={next_cursor}")
+    return "\n".join(lines)
+
+def parse_request(data):
+    """
+    Turn a raw "key=value key=value ..." request into a dict. data may be a
+    memoryview of the receive buffer: it is decoded straight from there,
+    without first being copied out as bytes. A malformed request (a token
+    without "=") gives an empty dict, which callers refuse as invalid.
+    """
+    try:
+        return dict(pair.split('=', 1) for pair in str(data, 'utf-8').split())
+    except ValueError:
+        return {}
+
+class Command:
+    """
+    A registered command: the Bank (or ShardedBank) method that runs it, the
+    fields it cannot run without, and the fields converted before it runs
+    (to int, to float, to a list of ints, or checked as a report cursor),
+    so a malformed request is refused instead of failing inside the method.
+    positives are integer fields (page limits) that must be 1 or more.
+    ledger marks commands that may block on account or index locks (run on
+    the worker pool; see admission.py).
+    """
+    __slots__ = ('name', 'method', 'required', 'integers', 'floats', 'int_lists', 'cursors', 'positives', 'ledger',
+                 'labels')
+
+    def __init__(self, name, method, required, integers, floats, int_lists, cursors, positives, ledger):
+        self.name = name
+        self.method = method
+        self.required = required
+        self.integers = integers
+        self.floats = floats
+        self.int_lists = int_lists
+        self.cursors = cursors
+        self.positives = positives
+        self.ledger = ledger
+        self.labels = (("command", name),)   # bank_command_seconds labels, built once
+
+    def prepare(self, data_dict):
+        """Check data_dict and convert its typed fields in place; returns an error message, or None."""
+        for field in self.required:
+            if field not in data_dict:
+                return f"Invalid request format: {self.name} needs {field}"
+        for field in self.integers:
+            value = data_dict.get(field)
+            if value is None:
+                continue
+            if type(value) is not int:
+                try:
+                    value = int(value)
+                except ValueError:
+                    return f"Invalid request format: {field} must be a whole number"
+            # Account numbers and amounts are stored in 64-bit history columns.
+            if not I64_MIN <= value <= I64_MAX:
+                return f"Invalid request format: {field} is out of range"
+            if field in self.positives and value < 1:
+                return f"Invalid request format: {field} must be 1 or more"
+            data_dict[field] = value
+        for field in self.floats:
+            value = data_dict.get(field)
+            if value is None:
+                continue
+            try:
+                value = float(value)
+            except ValueError:
+                value = math.nan
+            # Checked even when already a float, and stored only once checked.
+            if not math.isfinite(value):
+                return f"Invalid request format: {field} must be a number"
+            data_dict[field] = value
+        for field in self.int_lists:
+            value = data_dict.get(field)
+            if value is not None and type(value) is not list:
+                try:
+                    value = parse_int_list(value)
+                except ValueError:
+                    return f"Invalid request format: {field} must be whole numbers separated by commas"
+                if not all(I64_MIN <= number <= I64_MAX for number in value):
+                    return f"Invalid request format: {field} is out of range"
+                data_dict[field] = value
+        for field in self.cursors:
+            value = data_dict.get(field)
+            if value is not None and not all(part.isdigit() for part in str(value).split(':', 1)):
+                return f"Invalid request format: {field} must be an offset (shard:offset with shards)"
+        return None
+
+# Command name -> Command. Requests for anything else get "Invalid command."
+# and are timed as "other".
+COMMAND_TABLE = {}
+OTHER_LABELS = (("command", "other"),)
+
+def register_command(name, method=None, required=(), integers=(), floats=(), int_lists=(), cursors=(), positives=(),
+                     ledger=False):
+    """Make requests with command=name run bank.<method>(data_dict) (method defaults to name)."""
+    COMMAND_TABLE[name] = Command(name, method or name, tuple(required), tuple(integers), tuple(floats),
+                                  tuple(int_lists), tuple(cursors), tuple(positives), ledger)
+
+ACCOUNT = ('acct_num',)
+ACCOUNT_AMOUNT = ('acct_num', 'amount')
+PAGE = ('acct_num', 'cursor', 'limit')
+TIME_RANGE = ('since', 'until')
+
+register_command('create_account', required=ACCOUNT, integers=ACCOUNT_AMOUNT, ledger=True)
+register_command('show_bank', integers=('limit', 'history'), cursors=('cursor',), positives=('limit',), ledger=True)
+register_command('show_accountholders', required=ACCOUNT, integers=ACCOUNT)
+register_command('add_holder', required=ACCOUNT, integers=ACCOUNT, ledger=True)
+register_command('my_accounts')
+register_command('deposit', required=ACCOUNT, integers=ACCOUNT_AMOUNT, ledger=True)
+register_command('withdraw', required=ACCOUNT, integers=ACCOUNT_AMOUNT, ledger=True)
+register_command('transfer_to', required=ACCOUNT, integers=ACCOUNT_AMOUNT, ledger=True)
+register_command('pay_loan_check', required=ACCOUNT, integers=ACCOUNT_AMOUNT, ledger=True)
+register_command('pay_loan_transfer_to', required=ACCOUNT, integers=ACCOUNT_AMOUNT, ledger=True)
+register_command('multi_transfer', ledger=True)
+register_command('show_history', required=ACCOUNT, integers=PAGE, floats=TIME_RANGE, positives=('limit',))
+register_command('show_history_filtered', required=ACCOUNT, integers=PAGE, floats=TIME_RANGE, positives=('limit',))
+register_command('apply_interest', 'apply_interest_command', ledger=True)
+register_command('show_totals')
+register_command('show_balances', integers=ACCOUNT, int_lists=('acct_nums',))
+register_command('show_changes', integers=('limit',), positives=('limit',), ledger=True)
+register_command('subscribe', integers=ACCOUNT, int_lists=('acct_nums',), ledger=True)
+register_command('stats')
+register_command('set_lock_logging')
+register_command('trace_dump', integers=('slowest', 'reset'))
+register_command('profile', integers=('seconds', 'hz'))
+register_command('show_replicas')
+
+def dispatch(bank, data_dict):
+    """
+    Run the Bank method registered for data_dict['command'] and return its
+    response, recording its latency. A streamed report is timed until its
+    generator is returned, not until it has been sent.
+    """
+    command = COMMAND_TABLE.get(data_dict['command'])
+    start = time.perf_counter()
+    try:
+        if command is None:
+            return "Invalid command."
+        if bank.replica is not None:
+            refusal = bank.replica.refuse(command.name)
+            if refusal is not None:
+                return refusal
+        error = command.prepare(data_dict)
+        if error is not None:
+            return error
+        handler = getattr(bank, command.method)
+        try:
+            if protocol.REQUEST_KEY in data_dict and bank.responses is not None:
+                return bank.responses.run(data_dict, lambda: handler(data_dict))
+            return handler(data_dict)
+        except Exception:
+            # One bad request must not take its connection down with it.
+            logging.exception("Command %s failed on %s", command.name, data_dict)
+            METRICS.inc("bank_command_errors_total", labels=command.labels)
+            return f"Request failed: {command.name} could not be completed"
+    finally:
+        METRICS.observe("bank_command_seconds", time.perf_counter() - start,
+                        OTHER_LABELS if command is None else command.labels)
+
+# --------------------- Admission Control ---------------------
+
+# Commands registered with ledger=True take account/index locks or do heavy
+# formatting. In both server modes these run on the worker pool, where they
+# queue and may be shed (admission.py); everything else (parsing, auth
+# checks, balance inquiries, history reads) runs directly on the
+# connection's thread or the event loop.
+
+RATE_LIMITER = admission.RateLimiter(config["rate_limit_per_user"], config.get("rate_limit_burst", 0)) \
+    if config.get("rate_limit_per_user", 0) else None
+
+def new_worker_pool():
+    # executor_workers is what worker_threads was called when only asyncio mode had a pool.
+    return admission.WorkerPool(config.get("worker_threads", config.get("executor_workers", 32)),
+                                config.get("work_queue_size", 1024), config.get("queue_latency_slo_ms", 200))
+
+def is_ledger_request(command, data_dict):
+    """True if data_dict (already prepared) may block on a lock, so it runs on the worker pool."""
+    if command.name in ('deposit', 'withdraw') and data_dict.get('amount', 0) == 0:
+        return False  # balance inquiry, never locks
+    return command.ledger
+
+def rate_limited(data_dict):
+    """The reply refusing a request over its user's rate limit, or None."""
+    if RATE_LIMITER is None or data_dict['command'] in admission.EXEMPT_COMMANDS:
+        return None
+    return RATE_LIMITER.refuse(data_dict['user'])
+
+def admit(bank, data_dict, pool, trace=None):
+    """
+    Answer a request, or queue it on the pool if it is ledger work. Returns
+    the response, or the Future of a queued request. A request that is
+    rate limited or shed gets its refusal instead. A traced request's
+    dispatch marks its phases in trace.
+    """
+    refusal = rate_limited(data_dict)
+    if refusal is not None:
+        return refusal
+    command = COMMAND_TABLE.get(data_dict['command'])
+    if command is None:
+        return dispatch(bank, data_dict)  # answered without running anything
+    error = command.prepare(data_dict)
+    if error is not None:
+        return error
+    if protocol.REQUEST_KEY in data_dict and bank.responses is not None:
+        # A retry of a finished request is answered here, without a trip to the pool.
+        response = bank.responses.peek(data_dict)
+        if response is not None:
+            return response
+    if not is_ledger_request(command, data_dict):
+        return dispatch(bank, data_dict) if trace is None else tracing.run(trace, dispatch, bank, data_dict)
+    try:
+        if trace is None:
+            return pool.admit(dispatch, bank, data_dict)
+        return pool.admit(tracing.run, trace, dispatch, bank, data_dict)
+    except admission.Busy as e:
+        return str(e)
+
+def dispatch_admitted(bank, data_dict, pool, trace=None):
+    if trace is not None:
+        trace.label(data_dict)
+        trace.mark('parse')
+    response = admit(bank, data_dict, pool, trace)
+    if isinstance(response, Future):
+        response = response.result()
+        if trace is not None:
+            trace.mark('queue')
+    return response
+
+def well_formed(data_dict):
+    """True if a parsed request has the user, command and third field every request needs."""
+    return len(data_dict) >= 3 and 'user' in data_dict and 'command' in data_dict
+
+def log_request(data_dict):
+    logging.info("Request received: user=%s command=%s account=%s, amount=%s",
+                 data_dict['user'], data_dict['command'], data_dict.get('acct_num'), data_dict.get('amount', 0))
+
+def handle_client(client_socket, bank, pool):
+    METRICS.inc("bank_connections_total")
+    METRICS.add("bank_connections_active", 1)
+    try:
+        # Text requests are received into one buffer per connection and
+        # parsed from a view of it, so no bytes object is made per request.
+        buffer = memoryview(bytearray(1024))
+        size = client_socket.recv_into(buffer)
+        # Framed clients announce themselves with protocol.MAGIC; anything else
+        # is the original text protocol.
+        if buffer[:len(protocol.MAGIC)] == protocol.MAGIC:
+            METRICS.inc("bank_bytes_received_total", len(protocol.MAGIC))
+            handle_framed_client(client_socket, bank, pool, bytes(buffer[len(protocol.MAGIC):size]))
+            return
+        while size:
+            METRICS.inc("bank_bytes_received_total", size)
+            handle_text_request(client_socket, bank, pool, buffer[:size])
+            size = client_socket.recv_into(buffer)
+        client_socket.close()
+    except ConnectionError:
+        client_socket.close()  # the client went away, typically in the middle of a subscribe stream
+    finally:
+        METRICS.add("bank_connections_active", -1)
+
+def send_text(client_socket, data):
+    client_socket.sendall(data)
+    METRICS.inc("bank_bytes_sent_total", len(data))
+
+def with_end(chunks):
+    """Encode a streamed response's chunks, with END on the last one instead of in a send of its own."""
+    previous = ""
+    for chunk in chunks:
+        if previous:
+            yield previous.encode()
+        previous = chunk
+    yield previous.encode() + b"END"
+
+def handle_text_request(client_socket, bank, pool, data):
+    trace = tracing.begin()
+    data_dict = parse_request(data)
+    if not well_formed(data_dict):
+        response = "Invalid request format."
+        send_text(client_socket, response.encode())
+        return
+    log_request(data_dict)
+    response = dispatch_admitted(bank, data_dict, pool, trace)
+    if isinstance(response, Subscription):
+        # Events are sent as they are committed; END follows only if the stream lags.
+        try:
+            for chunk in response:
+                send_text(client_socket, chunk.encode())
+        finally:
+            response.close()
+        send_text(client_socket, b"END")
+        return
+    if not isinstance(response, str):
+        # Streamed report (Bank.bank_report): send each chunk as it is made.
+        for data in with_end(response):
+            send_text(client_socket, data)
+    else:
+        send_text(client_socket, response.encode() + b"END")
         logging.info("Request handled: %s", data_dict['command'])
-        time.sleep(1)
-    client_socket.close()
+    if trace is not None:
+        trace.mark('send')
+        tracing.finish(trace)
+
+def finish_traces(traces):
+    """Record the traces of responses that have just been sent."""
+    for trace in traces:
+        trace.mark('send')
+        tracing.finish(trace)
+    traces.clear()
+
+def handle_framed_client(client_socket, bank, pool, initial):
+    """
+    Serve a framed (protocol.py) connection. Requests are answered in the
+    order they arrive; responses for requests that were already pipelined
+    in the receive buffer are coalesced into a single sendall.
+    """
+    reader = protocol.FrameReader(client_socket, initial)
+    pending = []
+    traces = []   # of the pending responses' requests, if traced
+    try:
+        for request_id, body in reader:
+            METRICS.inc("bank_bytes_received_total", protocol.HEADER.size + len(body))
+            trace = tracing.begin()
+            data_dict = protocol.decode_fields(body)
+            if not well_formed(data_dict):
+                response = "Invalid request format."
+            else:
+                log_request(data_dict)
+                response = dispatch_admitted(bank, data_dict, pool, trace)
+                if isinstance(response, Subscription):
+                    # One frame per chunk of events, all tagged with the subscribe request's id.
+                    # Requests pipelined behind it wait until the stream ends.
+                    send_text(client_socket, b"".join(pending))
+                    pending.clear()
+                    finish_traces(traces)
+                    try:
+                        for chunk in response:
+                            send_text(client_socket, protocol.pack_response(request_id, chunk))
+                    finally:
+                        response.close()
+                    continue
+                if not isinstance(response, str):
+                    # A frame carries one whole reply, so a streamed report is joined.
+                    response = "".join(response)
+            pending.append(protocol.pack_response(request_id, response))
+            if trace is not None and len(data_dict) >= 3:
+                traces.append(trace)
+            if not reader.has_frame():
+                send_text(client_socket, b"".join(pending))
+                pending.clear()
+                finish_traces(traces)
+    except (protocol.ProtocolError, ConnectionError) as e:
+        logging.warning("Closing framed connection: %s", e)
+    finally:
+        client_socket.close()
+
+# --------------------- asyncio Front End ---------------------
+
+async def dispatch_async(bank, data_dict, executor, trace=None):
+    if not well_formed(data_dict):
+        return "Invalid request format."
+    log_request(data_dict)
+    if trace is not None:
+        trace.label(data_dict)
+        trace.mark('parse')
+    response = admit(bank, data_dict, executor, trace)
+    if isinstance(response, Future):
+        response = await asyncio.wrap_future(response)
+        if trace is not None:
+            trace.mark('queue')
+    return response
+
+async def write_events(writer, subscription, frame=None):
+    """
+    Write a subscribe stream as its events arrive, as text or, given
+    frame(chunk) -> bytes, as frames. Waiting is done on the event loop,
+    not in an executor thread.
+    """
+    try:
+        async for chunk in subscription.stream():
+            write(writer, chunk.encode() if frame is None else frame(chunk))
+            await writer.drain()
+    finally:
+        subscription.close()
+
+async def write_stream(writer, chunks, executor):
+    """
+    Write a streamed report: each chunk is produced on the executor and
+    written with drain(), so a slow reader holds back production instead of
+    letting the report pile up in the write buffer.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = iter(chunks)
+    while True:
+        chunk = await loop.run_in_executor(executor, next, chunks, None)
+        if chunk is None:
+            return
+        write(writer, chunk.encode())
+        await writer.drain()
+
+def write(writer, data):
+    writer.write(data)
+    METRICS.inc("bank_bytes_sent_total", len(data))
+
+async def handle_client_async(reader, writer, bank, executor):
+    """asyncio counterpart of handle_client; negotiates text or framed protocol the same way."""
+    METRICS.inc("bank_connections_total")
+    METRICS.add("bank_connections_active", 1)
+    try:
+        data = await reader.read(1024)
+        if data.startswith(protocol.MAGIC):
+            METRICS.inc("bank_bytes_received_total", len(protocol.MAGIC))
+            await handle_framed_client_async(reader, writer, bank, executor, data[len(protocol.MAGIC):])
+            return
+        while data:
+            METRICS.inc("bank_bytes_received_total", len(data))
+            trace = tracing.begin()
+            data_dict = parse_request(data)
+            if not well_formed(data_dict):
+                write(writer, b"Invalid request format.")
+                trace = None
+            else:
+                response = await dispatch_async(bank, data_dict, executor, trace)
+                if isinstance(response, str):
+                    write(writer, response.encode() + b"END")
+                elif isinstance(response, Subscription):
+                    await write_events(writer, response)
+                    write(writer, b"END")
+                    trace = None
+                else:
+                    await write_stream(writer, response, executor)
+                    write(writer, b"END")
+                logging.info("Request handled: %s", data_dict['command'])
+            await writer.drain()
+            if trace is not None:
+                trace.mark('send')
+                tracing.finish(trace)
+            data = await reader.read(1024)
+    except ConnectionError:
+        pass
+    finally:
+        METRICS.add("bank_connections_active", -1)
+        writer.close()
+
+async def handle_framed_client_async(reader, writer, bank, executor, initial):
+    """
+    Serve a framed connection on the event loop. Each request runs as its own
+    task, so slow ledger requests do not hold up later ones on the same
+    connection; responses go out as they complete, tagged with their id.
+    """
+    frames = protocol.AsyncFrameReader(reader, initial)
+    tasks = set()
+
+    async def answer(request_id, data_dict, trace):
+        response = await dispatch_async(bank, data_dict, executor, trace)
+        if isinstance(response, Subscription):
+            await write_events(writer, response, lambda chunk: protocol.pack_response(request_id, chunk))
+            return
+        if not isinstance(response, str):
+            response = await asyncio.get_running_loop().run_in_executor(executor, "".join, response)
+        write(writer, protocol.pack_response(request_id, response))
+        await writer.drain()
+        if trace is not None and len(data_dict) >= 3:
+            trace.mark('send')
+            tracing.finish(trace)
+
+    try:
+        while True:
+            frame = await frames.read_frame()
+            if frame is None:
+                break
+            request_id, body = frame
+            METRICS.inc("bank_bytes_received_total", protocol.HEADER.size + len(body))
+            trace = tracing.begin()
+            task = asyncio.create_task(answer(request_id, protocol.decode_fields(body), trace))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    except protocol.ProtocolError as e:
+        logging.warning("Closing framed connection: %s", e)
+
+async def serve_async(bank, executor):
+    """Accept connections on an event loop; ledger work goes to the worker pool (executor)."""
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_client_async(reader, writer, bank, executor), HOST, PORT)
+    logging.info("Server (asyncio) listening on host %s on port %s...", HOST, PORT)
+    async with server:
+        await server.serve_forever()
+
+def register_gauges(bank):
+    """Queue depths and cache sizes read whenever metrics are rendered."""
+    if isinstance(bank, Bank):
+        METRICS.gauge("bank_write_queue_depth", bank.batcher.depth)
+        METRICS.gauge("bank_wal_pending_records", lambda: bank.wal.last_lsn - bank.wal.durable_lsn if bank.wal else 0)
+        METRICS.gauge("bank_subscriptions", lambda: len(bank.feed.subscriptions))
+    if bank.primary is not None:
+        METRICS.gauge("bank_replicas", lambda: len(bank.primary.followers))
+    if bank.replica is not None:
+        METRICS.gauge("bank_replica_lsn", lambda: bank.replica.lsn)
+        METRICS.gauge("bank_replica_staleness_seconds", bank.replica.staleness)
+    if bank.responses is not None:
+        METRICS.gauge("bank_idempotency_cache_entries", lambda: len(bank.responses.entries))
+        METRICS.gauge("bank_idempotency_cache_bytes", lambda: bank.responses.bytes)
+
+def serve_connection(client_socket, bank, pool, connections):
+    try:
+        handle_client(client_socket, bank, pool)
+    finally:
+        connections.release()
 
 def interest_thread(bank):
     while True:
@@ -479,20 +2069,64 @@ def interest_thread(bank):
 HOST = socket.gethostbyname(socket.gethostname())
 PORT = config.get("port", 9876)
 ADDR = (HOST, PORT)
-bank = Bank()
-
-# Start the auto-interest thread as a daemon thread.
-auto_interest = threading.Thread(target=interest_thread, args=(bank,), daemon=True)
-auto_interest.start()
-
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server_socket.bind(ADDR)
-server_socket.listen()
-logging.info("Server listening on host %s on port %s...", HOST, PORT)
-
-while True:
-    client_socket, addr = server_socket.accept()
-    logging.info("Client connected from %s", addr)
-    thread = threading.Thread(target=handle_client, args=(client_socket, bank))
-    thread.start()
-    logging.info("%s thread connections running...", threading.active_count() - 1)
+
+def main():
+    METRICS.lock_log_rate = config.get("lock_log_sample", 0.0)
+    tracing.configure(config.get("trace_slowest", 0))
+    if config.get("shards", 0):
+        # Each shard process recovers and persists its own accounts.
+        bank = ShardedBank(config["shards"])
+        render = lambda: bank.stats({'user': 'Audit', 'format': 'prometheus'})
+    else:
+        bank = Bank()
+        if config.get("replica_of"):
+            # State comes from the primary (which also answers retries), not from data_dir.
+            host, port = config["replica_of"].rsplit(":", 1)
+            bank.responses = None
+            bank.replica = replication.Replica(bank, (host, int(port)), ADDR,
+                                               config.get("replica_max_staleness_ms", 1000))
+            bank.replica.start()
+        elif config.get("persistence", False):
+            persistence.attach(bank, config)
+        if config.get("replication_port"):
+            if bank.wal is None:
+                raise SystemExit("replication_port needs persistence: replicas are fed from the write-ahead log")
+            bank.primary = replication.Primary(bank, config["replication_port"],
+                                               config.get("replication_heartbeat_ms", 100),
+                                               config.get("replication_buffer_records", 100000))
+            bank.primary.start(HOST)
+        render = None
+    register_gauges(bank)
+    if config.get("metrics_port"):
+        metrics.serve_http(config["metrics_port"], render)
+        logging.info("Metrics served on port %s at /metrics", config["metrics_port"])
+
+    # Start the auto-interest thread as a daemon thread (a replica gets interest from the primary's log).
+    if bank.replica is None:
+        auto_interest = threading.Thread(target=interest_thread, args=(bank,), daemon=True)
+        auto_interest.start()
+
+    pool = new_worker_pool()
+    METRICS.gauge("bank_work_queue_depth", pool.depth)
+    if config.get("server_mode", "threaded") == "asyncio":
+        asyncio.run(serve_async(bank, pool))
+        return
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.bind(ADDR)
+    server_socket.listen()
+    logging.info("Server listening on host %s on port %s...", HOST, PORT)
+
+    # Each connection has its own thread, which hands its ledger requests to the pool.
+    # Past max_connections, new clients wait in the listen backlog.
+    connections = threading.BoundedSemaphore(config.get("max_connections", 1024))
+    while True:
+        connections.acquire()
+        client_socket, addr = server_socket.accept()
+        logging.info("Client connected from %s", addr)
+        thread = threading.Thread(target=serve_connection, args=(client_socket, bank, pool, connections))
+        thread.start()
+        logging.info("%s thread connections running...", threading.active_count() - 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Multi-process sharding for the Bank.
+
+Accounts are partitioned by acct_num (acct_num % shards) across worker
+processes, each running its own Bank over just its accounts, so ledger work
+is spread over as many cores as there are shards instead of sharing one GIL.
+The listener process keeps a small directory of every account (number,
+type, initial holder, holders) and routes each request to the owning shard
+(see server.ShardedBank).
+
+Each worker answers messages from a single pipe. Calls are multiplexed:
+the coordinator tags every message with an id and a reader thread matches
+replies to waiting callers, so many requests can be in flight per shard.
+Inside the worker a small thread pool runs them against the Bank, which
+does its own locking.
+
+Cross-shard transfers use two-phase commit with the money held in escrow:
+
+    prepare   the source shard checks funds and debits the amount under the
+              account lock, remembering it against a transaction id; the
+              target shard checks the target may be credited
+    commit    the source records the debit (history, write-ahead log) and
+              the target is credited
+    abort     the source puts the escrowed amount back
+
+The escrowed debit only lowers account.balance, which is what later debits
+check under the account lock. It is also counted in Bank.held, which publish
+and snapshots add back, so lock-free reads, show_changes, subscribe and the
+write-ahead log see the balance change only when the debit commits.
+
+Credits cannot fail once prepared (accounts are never removed), so a
+transfer either applies on both shards or on neither. The escrow lives in
+memory: with persistence enabled each shard logs its own half at commit,
+and a crash between the two commits is not reconciled on recovery.
+"""
+import itertools
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from history_store import check_entry
+from metrics import METRICS
+
+
+def shard_of(acct_num, shards):
+    """Index of the shard that owns acct_num."""
+    return int(acct_num) % shards
+
+
+class Participant:
+    """Worker-side handlers for one shard's Bank, including the 2PC escrow."""
+
+    def __init__(self, bank, dispatch):
+        self.bank = bank
+        self.dispatch_command = dispatch
+        self.escrow = {}   # txid -> (account, amount) debited by prepare_debit
+
+    def dispatch(self, data_dict):
+        return self.dispatch_command(self.bank, data_dict)
+
+    def create_account(self, data_dict):
+        """Run a create_account request; returns (created, response) so the coordinator need not read the text."""
+        response = self.dispatch(data_dict)
+        account = self.bank.find_account(data_dict['acct_num'])
+        return account is not None and account.init_acct_holder == data_dict['user'], response
+
+    def add_holder(self, data_dict):
+        """Run an add_holder request; returns (added, response)."""
+        response = self.dispatch(data_dict)
+        account = self.bank.find_account(data_dict['acct_num'])
+        return account is not None and str(data_dict.get('holder', '')) in account.holders, response
+
+    def accounts(self):
+        return [(account.acct_num, account.acct_type, account.init_acct_holder, account.acct_holder)
+                for account in self.bank.accounts]
+
+    def report_rows(self, start, count, history):
+        return self.bank.report_rows(start, count, history)
+
+    def commit_seq(self):
+        return self.bank.commit_seq
+
+    def account_count(self):
+        return len(self.bank.accounts)
+
+    def change_rows(self, since, limit):
+        return self.bank.change_rows(since, limit)
+
+    def totals(self):
+        return self.bank.totals_snapshot()
+
+    def balances(self, acct_nums):
+        return self.bank.read_balances([self.bank.find_account(acct_num) for acct_num in acct_nums])
+
+    def apply_interest(self):
+        return self.bank.apply_interest()
+
+    def metric_families(self, labels):
+        return METRICS.families(labels)
+
+    def metrics_summary(self):
+        return METRICS.summary()
+
+    def set_lock_log_rate(self, rate):
+        METRICS.lock_log_rate = rate
+
+    def prepare_debit(self, txid, acct_num, amount):
+        """
+        Phase one on the source: escrow amount. Returns (ok, balance), the
+        balance left to spend; the committed balance is unchanged.
+        """
+        account = self.bank.find_account(acct_num)
+        with self.bank.locked(account, purpose="transfer prepare"):
+            if account.balance < amount:
+                return False, account.balance
+            account.balance -= amount
+            held = self.bank.held
+            held[acct_num] = held.get(acct_num, 0) + amount
+            self.escrow[txid] = (account, amount)
+            return True, account.balance
+
+    def _release(self, account, amount):
+        """Stop counting amount as held for account (caller holds its lock)."""
+        held = self.bank.held
+        left = held.pop(account.acct_num) - amount
+        if left:
+            held[account.acct_num] = left
+
+    def commit_debit(self, txid, entry):
+        """Phase two on the source: make the escrowed debit permanent. Returns the balance."""
+        account, amount = self.escrow[txid]
+        check_entry(account.acct_num, entry)  # before anything changes, so the debit can still be aborted
+        del self.escrow[txid]
+        with self.bank.locked(account, purpose="transfer commit"):
+            self._release(account, amount)
+            self.bank.record(account, entry)
+            lsn = self.bank.commit_changes((account, -amount, entry))
+            balance = account.balance
+        self.bank.wait_durable(lsn)
+        return balance
+
+    def abort(self, txid):
+        """Return an escrowed amount to its account."""
+        account, amount = self.escrow.pop(txid)
+        with self.bank.locked(account, purpose="transfer abort"):
+            self._release(account, amount)
+            account.balance += amount
+
+    def credit(self, acct_num, amount, entry):
+        """Phase two on the target. Returns the new balance."""
+        account = self.bank.find_account(acct_num)
+        check_entry(acct_num, entry)
+        with self.bank.locked(account, purpose="transfer credit"):
+            account.balance += amount
+            self.bank.record(account, entry)
+            lsn = self.bank.commit_changes((account, amount, entry))
+            balance = account.balance
+        self.bank.wait_durable(lsn)
+        return balance
+
+
+def shard_main(conn, make_bank, dispatch, shard_id, shards, config):
+    """Worker process entry point: build this shard's Bank and serve the pipe until it closes."""
+    participant = Participant(make_bank(shard_id, shards, config), dispatch)
+    send_lock = threading.Lock()
+    logging.info("Shard %s of %s serving %s accounts", shard_id, shards, len(participant.bank.accounts))
+
+    def run(call_id, op, args):
+        try:
+            reply = (call_id, True, getattr(participant, op)(*args))
+        except Exception as e:
+            logging.exception("Shard %s failed on %s", shard_id, op)
+            reply = (call_id, False, e)
+        with send_lock:
+            conn.send(reply)
+
+    with ThreadPoolExecutor(max_workers=config.get("shard_threads", 8)) as executor:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            if message is None:
+                break  # ShardClient.close
+            executor.submit(run, *message)
+
+
+class ShardClient:
+    """Coordinator-side handle on one worker process."""
+
+    def __init__(self, context, make_bank, dispatch, shard_id, shards, config):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=shard_main, name=f"bank-shard-{shard_id}", daemon=True,
+                                       args=(child, make_bank, dispatch, shard_id, shards, config))
+        self.process.start()
+        child.close()
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.ids = itertools.count()
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+
+    def submit(self, op, *args):
+        """Send op to the worker and return a Future for its result."""
+        future = Future()
+        with self.send_lock:
+            call_id = next(self.ids)
+            self.pending[call_id] = future
+            self.conn.send((call_id, op, args))
+        return future
+
+    def call(self, op, *args):
+        return self.submit(op, *args).result()
+
+    def _read_loop(self):
+        while True:
+            try:
+                call_id, ok, value = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self.pending.pop(call_id)
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        for future in self.pending.values():
+            future.set_exception(ConnectionError("shard process exited"))
+
+    def close(self):
+        # Closing our end does not reach the worker while the reader thread
+        # is blocked in recv() on it, so ask the worker to stop first.
+        try:
+            with self.send_lock:
+                self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        self.conn.close()
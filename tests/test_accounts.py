@@ -0,0 +1,133 @@
+"""Account records and the Bank's lookup indexes, including the holder index."""
+import threading
+
+import pytest
+
+import persistence
+import server
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+def call(bank, user, command, acct_num=0, **fields):
+    return server.dispatch(bank, dict(fields, user=user, command=command, acct_num=str(acct_num)))
+
+
+def test_find_account_by_number(bank):
+    for acct_num, acct_type, init_holder, _, balance in server.SEED_ACCOUNTS:
+        account = bank.find_account(acct_num)
+        assert (account.acct_num, account.acct_type, account.init_acct_holder, account.balance) == \
+            (acct_num, acct_type, init_holder, balance)
+    assert bank.find_account('1001') is bank.find_account(1001)
+    assert bank.find_account(999) is None
+
+
+def test_find_init_account(bank):
+    assert bank.find_init_account('Alice').acct_num == 1001
+    assert bank.find_init_account('Alice', 'loan').acct_num == 1002
+    assert bank.find_init_account('Alice', 'savings') is None
+    assert bank.find_init_account('Zed') is None
+
+
+def test_created_account_is_indexed(bank):
+    count = bank.totals['checking'][0]
+    assert call(bank, 'Zed', 'create_account', 5555, amount='9').startswith("Successfully created")
+    account = bank.find_account(5555)
+    assert account is bank.accounts[-1]
+    assert bank.find_init_account('Zed') is account
+    assert bank.totals['checking'][0] == count + 1
+    assert call(bank, 'Zed', 'create_account', 5556) == "One person can only create one account"
+    assert call(bank, 'Yan', 'create_account', 5555) == "The account number has been used by Zed"
+
+
+def test_concurrent_creates_claim_a_number_once(bank):
+    start = threading.Barrier(8)
+    responses = []
+
+    def create(user):
+        start.wait()
+        responses.append(call(bank, user, 'create_account', 7777, amount='1'))
+
+    threads = [threading.Thread(target=create, args=(f"User{n}",)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(response.startswith("Successfully created") for response in responses) == 1
+    assert sum(1 for account in bank.accounts if account.acct_num == 7777) == 1
+
+
+def test_account_records_are_compact(bank):
+    a, b = bank.find_account(1001), bank.find_account(1048)
+    assert not hasattr(a, '__dict__')
+    assert a.init_acct_holder is b.acct_holder[2]     # interned: 'Alice' is stored once
+    # Locks are shared stripes: an account a stripe count away shares 1001's.
+    call(bank, 'Zed', 'create_account', 1001 + len(bank.lock_stripes))
+    assert bank.find_account(1001 + len(bank.lock_stripes)).lock is a.lock is bank.lock_for(1001)
+
+
+def test_holders_switch_to_a_set_past_the_small_count(bank):
+    account = bank.find_account(1001)
+    assert type(account.holders) is tuple
+    for n in range(server.SMALL_HOLDER_COUNT):
+        assert call(bank, 'Alice', 'add_holder', 1001, holder=f"Extra{n}") == f"Extra{n} is now a holder of account 1001"
+    assert type(account.holders) is frozenset
+    assert account.acct_holder[-1] == f"Extra{server.SMALL_HOLDER_COUNT - 1}"
+    assert 'Jason' in account.holders and 'Extra0' in account.holders and 'Zed' not in account.holders
+
+
+def test_added_holder_is_indexed(bank):
+    assert call(bank, 'Zed', 'my_accounts') == "Zed is not a holder of any account"
+    assert call(bank, 'Alice', 'add_holder', 1001, holder='Zed') == "Zed is now a holder of account 1001"
+    assert bank.accounts_for_holder('Zed') == [bank.find_account(1001)]
+    balance = bank.find_account(1001).balance
+    assert call(bank, 'Zed', 'my_accounts') == f"Accounts Zed holds:\n1001: checking, opened by Alice, balance {balance}"
+    assert call(bank, 'Zed', 'withdraw', 1001, amount='5').startswith("Zed successfully withdrew")
+
+
+def test_my_accounts_reads_the_index(bank):
+    mine = call(bank, 'Alice', 'my_accounts').splitlines()
+    assert mine[0] == "Accounts Alice holds:"
+    assert [int(line.split(":")[0]) for line in mine[1:]] == sorted(
+        account.acct_num for account in bank.accounts if 'Alice' in account.holders)
+    # Only the index is consulted: an account missing from it is not listed.
+    bank.accounts_by_holder['Alice'].remove(bank.find_account(1048))
+    assert "1048:" not in call(bank, 'Alice', 'my_accounts')
+
+
+@pytest.mark.parametrize("user, acct_num, holder, error", [
+    ('Alice', 1001, '', "The holder field must be a name"),
+    ('Alice', 1001, ' Zed', "The holder field must be a name"),
+    ('Alice', 1001, 'Zed;Yan', "The holder field must be a name"),
+    ('Jason', 1001, 'Zed', "Only the account initiate holder can add account holders"),
+    ('Alice', 1027, 'Zed', "Only the account initiate holder can add account holders"),
+    ('Alice', 1001, 'Jason', "Jason is already a holder of this account"),
+    ('Alice', 999, 'Zed', "The account number was not found"),
+])
+def test_add_holder_refusals(bank, user, acct_num, holder, error):
+    before = dict((name, list(accounts)) for name, accounts in bank.accounts_by_holder.items())
+    assert call(bank, user, 'add_holder', acct_num, holder=holder).startswith(error)
+    assert bank.accounts_by_holder == before
+
+
+def test_added_holder_survives_recovery(tmp_path):
+    config = {'wal_fsync': False, 'snapshot_interval': 0, 'data_dir': str(tmp_path)}
+    bank = server.Bank()
+    persistence.attach(bank, config)
+    call(bank, 'Alice', 'add_holder', 1001, holder='Zed')
+    bank.wal.close()
+    bank.history.close()
+
+    bank = server.Bank()
+    persistence.attach(bank, config)
+    try:
+        assert bank.accounts_for_holder('Zed') == [bank.find_account(1001)]
+        assert 'Zed' in bank.find_account(1001).holders
+    finally:
+        bank.wal.close()
+        bank.history.close()
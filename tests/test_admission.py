@@ -0,0 +1,90 @@
+"""Admission control: shedding from the worker pool and per-user rate limits."""
+import threading
+import time
+
+import pytest
+
+import admission
+import protocol
+import server
+
+
+@pytest.fixture
+def blocked_pool():
+    """A one-worker pool whose worker is stuck until the test sets the event (or ends)."""
+    pool = admission.WorkerPool(workers=1, max_queue=2, slo_ms=0)
+    release = threading.Event()
+    running = threading.Event()
+
+    def block():
+        running.set()
+        release.wait()
+
+    pool.admit(block)
+    running.wait()
+    yield pool, release
+    release.set()
+    pool.shutdown()
+
+
+def test_full_queue_is_shed(blocked_pool):
+    pool, release = blocked_pool
+    queued = [pool.admit(lambda n=n: n) for n in range(2)]
+    with pytest.raises(admission.Busy) as refused:
+        pool.admit(lambda: 'never')
+    response = str(refused.value)
+    assert response.startswith(protocol.SERVER_BUSY)
+    assert protocol.retry_after(response) == refused.value.retry_after_ms / 1000.0 > 0
+    # Work for a request already admitted is queued regardless.
+    extra = pool.submit(lambda: 'extra')
+    assert pool.depth() == 3
+    release.set()
+    assert [future.result(5) for future in queued + [extra]] == [0, 1, 'extra']
+
+
+def test_requests_are_shed_once_the_oldest_has_waited_past_the_slo():
+    pool = admission.WorkerPool(workers=1, max_queue=100, slo_ms=20)
+    release = threading.Event()
+    try:
+        pool.admit(release.wait)
+        pool.admit(lambda: None)
+        time.sleep(0.05)
+        with pytest.raises(admission.Busy) as refused:
+            pool.admit(lambda: None)
+        assert refused.value.retry_after_ms >= 50
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_rate_limit_per_user(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, 'monotonic', lambda: now[0])
+    limiter = admission.RateLimiter(10, burst=2)
+    assert limiter.refuse('Alice') is None
+    assert limiter.refuse('Alice') is None
+    response = limiter.refuse('Alice')
+    assert response == f"{protocol.RATE_LIMITED} for Alice, retry after 100 ms"
+    assert protocol.retry_after(response) == 0.1
+    assert limiter.refuse('Bob') is None
+    now[0] += 0.1
+    assert limiter.refuse('Alice') is None
+    assert limiter.refuse('Alice') is not None
+
+
+def test_admit_refuses_before_running_and_exempts_stats(monkeypatch):
+    monkeypatch.setattr(server, 'RATE_LIMITER', admission.RateLimiter(1, burst=1))
+    bank = server.Bank()
+    try:
+        request = {'user': 'Alice', 'command': 'withdraw', 'acct_num': '1001', 'amount': '10'}
+        balance = bank.read_balance(bank.find_account(1001))
+        assert server.admit(bank, dict(request, command='my_accounts'), None).startswith("Accounts Alice holds")
+        assert server.admit(bank, dict(request), None).startswith(protocol.RATE_LIMITED)
+        assert bank.read_balance(bank.find_account(1001)) == balance
+        assert not server.admit(bank, {'user': 'Alice', 'command': 'stats'}, None).startswith(protocol.RATE_LIMITED)
+    finally:
+        bank.history.close()
+
+
+def test_retry_after_ignores_other_responses():
+    assert protocol.retry_after("Successfully deposited 5 dollars") is None
@@ -0,0 +1,110 @@
+"""The asyncio server mode, over real sockets: text and framed clients on one event loop."""
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+import admission
+import protocol
+import server
+
+HOST = "127.0.0.1"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def address(monkeypatch):
+    """Run serve_async on a thread of its own; yields the address it listens on."""
+    port = free_port()
+    monkeypatch.setattr(server, 'HOST', HOST)
+    monkeypatch.setattr(server, 'PORT', port)
+    bank = server.Bank()
+    pool = admission.WorkerPool(4)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(server.serve_async(bank, pool))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass   # the fixture's teardown
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    for _ in range(100):
+        try:
+            socket.create_connection((HOST, port)).close()
+            break
+        except OSError:
+            time.sleep(0.02)
+    yield HOST, port
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join()
+    loop.close()
+    pool.shutdown()
+    bank.history.close()
+
+
+def text_request(sock, request):
+    """Send one text request and read its response up to END."""
+    sock.sendall(request.encode())
+    data = b""
+    while not data.endswith(b"END"):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data[:-3].decode()
+
+
+def test_text_requests_share_a_connection(address):
+    with socket.create_connection(address) as sock:
+        assert text_request(sock, "user=Alice command=deposit acct_num=1001 amount=5") == \
+            "Successfully deposited 5 dollars into account 1001, current balance is 2105 dollars"
+        assert text_request(sock, "user=Alice command=my_accounts acct_num=0").startswith("Accounts Alice holds")
+        sock.sendall(b"user=Alice command")
+        assert sock.recv(1024) == b"Invalid request format."
+
+
+def test_streamed_report(address):
+    with socket.create_connection(address) as sock:
+        report = text_request(sock, "user=Audit command=show_bank acct_num=0")
+    assert all(str(acct_num) in report for acct_num, *_ in server.SEED_ACCOUNTS)
+
+
+def test_many_clients_at_once(address):
+    responses = []
+
+    def client(n):
+        with socket.create_connection(address) as sock:
+            for _ in range(20):
+                responses.append(text_request(sock, "user=Alice command=deposit acct_num=1001 amount=1"))
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(responses) == 200 and all(r.startswith("Successfully deposited") for r in responses)
+    with socket.create_connection(address) as sock:
+        assert text_request(sock, "user=Alice command=withdraw acct_num=1001 amount=0") == \
+            "The current balance for account 1001 is 2300 dollars"
+
+
+def test_framed_requests_are_pipelined(address):
+    connection = protocol.FramedConnection(socket.create_connection(address))
+    try:
+        requests = [{'user': 'Alice', 'command': 'deposit', 'acct_num': '1001', 'amount': str(n)} for n in range(1, 11)]
+        requests.append({'user': 'Alice', 'command': 'bogus', 'acct_num': '0'})
+        responses = connection.request_many(requests)
+        assert all(response.startswith("Successfully deposited") for response in responses[:10])
+        assert responses[10] == "Invalid command."
+    finally:
+        connection.close()
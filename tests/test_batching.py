@@ -0,0 +1,86 @@
+"""Per-account write batching: batches form under contention and every command still gets its own outcome."""
+import threading
+
+import pytest
+
+import persistence
+import server
+from batching import WriteBatcher
+from history_store import I64_MAX
+
+
+@pytest.fixture
+def bank(tmp_path):
+    bank = server.Bank()
+    # The log on, as batching is meant to run: commands queue while a batch waits for it.
+    persistence.attach(bank, {'wal_fsync': False, 'snapshot_interval': 0, 'data_dir': str(tmp_path)})
+    bank.batcher = WriteBatcher(bank, 8)
+    yield bank
+    bank.wal.close()
+    bank.history.close()
+
+
+def test_hot_account_under_contention(bank):
+    account = bank.find_account(1001)
+    opening = bank.read_balance(account)
+    responses = []
+    lowest = [opening]
+
+    def worker():
+        for n in range(200):
+            if n % 2:
+                response = bank.withdraw({'user': 'Alice', 'acct_num': 1001, 'amount': 30})
+            else:
+                response = bank.deposit({'user': 'Alice', 'acct_num': 1001, 'amount': 10})
+            lowest[0] = min(lowest[0], bank.read_balance(account))
+            responses.append(response)
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    succeeded = [response for response in responses if 'insufficient' not in response]
+    entries = bank.history.entries(1001)
+    assert len(entries) == len(succeeded)
+    assert bank.read_balance(account) == opening + sum(amount if op == 'deposit' else -amount
+                                                        for _, op, amount in entries)
+    assert lowest[0] >= 0
+    # Refusals happen once the deposits cannot cover the withdrawals.
+    assert len(succeeded) < len(responses)
+    assert bank.batcher.ops == len(responses)
+    assert bank.batcher.batches < bank.batcher.ops
+    assert bank.batcher.depth() == 0
+
+
+def test_a_failing_command_does_not_fail_its_batch(bank):
+    account = bank.find_account(1001)
+    opening = bank.read_balance(account)
+    start = threading.Barrier(8)
+    outcomes = {}
+
+    def apply(account, data_dict):
+        if data_dict['n'] == 3:
+            raise RuntimeError("boom")
+        amount = I64_MAX + 1 if data_dict['n'] == 5 else 1
+        return f"ok {data_dict['n']}", (account, amount, ('Alice', 'deposit', amount))
+
+    def worker(n):
+        start.wait()
+        try:
+            outcomes[n] = bank.batcher.submit(account, apply, {'n': n})
+        except Exception as e:
+            outcomes[n] = type(e).__name__
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert outcomes[3] == 'RuntimeError'
+    assert outcomes[5] == 'ValueError'
+    assert all(outcomes[n] == f"ok {n}" for n in (0, 1, 2, 4, 6, 7))
+    assert bank.read_balance(account) == opening + 6
+    assert len(bank.history.entries(1001)) == 6
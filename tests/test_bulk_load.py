@@ -0,0 +1,81 @@
+"""Bulk import of accounts and history from CSV files."""
+import pytest
+
+import bulk_load
+import server
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+ACCOUNTS = """acct_num,acct_type,init_acct_holder,acct_holder,balance
+5001,checking,Nina,Nina;Omar,100
+5002,loan,Nina,,-50
+5003,checking,Omar,Omar,7
+1001,checking,Pia,Pia,1
+5004,savings,Pia,Pia,1
+5005,checking,Nina,Nina,1
+5006,checking,Quin,Rex,1
+5007,checking,Sam,Sam,99999999999999999999
+5008,checking,Tia
+"""
+
+HISTORY = """acct_num,ts,actor,operation,amount,counterparty
+5001,100.0,Nina,deposit,100,
+5001,101.0,Nina,transfer_out,10,5003
+5003,101.0,Nina,transfer_in,10,5001
+5001,99.0,Nina,deposit,1,
+9999,100.0,Nina,deposit,1,
+5003,102.0,Omar,deposit,18446744073709551616,
+5003,103.0,Omar,withdraw,3,
+"""
+
+
+def test_valid_accounts_are_indexed_and_bad_rows_skipped(bank, tmp_path):
+    checking = list(bank.totals['checking'])
+    report = bulk_load.load_accounts(bank, write(tmp_path / "accounts.csv", ACCOUNTS))
+    assert report["loaded"] == 3 and report["rejected"] == 6
+    assert [error.split(": ", 1)[1] for error in report["errors"][:5]] == [
+        "account number 1001 is already used",
+        "unknown acct_type 'savings'",
+        "Nina already opened a checking account",
+        "init_acct_holder Quin is not among the holders",
+        "acct_num or balance does not fit in 64 bits",
+    ]
+    assert report["errors"][5].startswith(f"{tmp_path / 'accounts.csv'}:10: ")   # the short row
+    assert bank.find_account(5001).acct_holder == ('Nina', 'Omar')
+    assert bank.find_account(5002).acct_holder == ('Nina',)
+    assert [account.acct_num for account in bank.accounts_for_holder('Omar')] == [5001, 5003]
+    assert bank.totals['checking'] == [checking[0] + 2, checking[1] + 107]
+
+
+def test_history_rows_are_checked_before_any_is_written(bank, tmp_path):
+    bulk_load.load_accounts(bank, write(tmp_path / "accounts.csv", ACCOUNTS))
+    report = bulk_load.load_history(bank, write(tmp_path / "history.csv", HISTORY))
+    assert report["loaded"] == 4 and report["rejected"] == 3
+    assert "older than the one before it" in report["errors"][0]
+    assert "unknown account 9999" in report["errors"][1]
+    assert "does not fit in 64 bits" in report["errors"][2]
+    assert bank.history.entries(5001) == [('Nina', 'deposit', 100), ('Nina', 'transfer_out', 10, 5003)]
+    assert bank.history.entries(5003, with_ts=True) == [(101.0, 'Nina', 'transfer_in', 10, 5001),
+                                                        (103.0, 'Omar', 'withdraw', 3)]
+
+
+def test_owns_picks_a_shards_share(bank, tmp_path):
+    report = bulk_load.load_accounts(bank, write(tmp_path / "accounts.csv", ACCOUNTS), owns=lambda n: n % 2 == 0)
+    assert report["loaded"] == 1
+    assert bank.find_account(5002) is not None and bank.find_account(5001) is None
+
+
+def test_missing_column_is_a_load_error(bank, tmp_path):
+    with pytest.raises(bulk_load.LoadError):
+        bulk_load.load_accounts(bank, write(tmp_path / "accounts.csv", "acct_num,acct_type\n5001,checking\n"))
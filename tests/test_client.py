@@ -0,0 +1,104 @@
+"""client.ConnectionPool against the threaded connection handler: reuse, batches and retries."""
+import socket
+import threading
+
+import pytest
+
+import admission
+import client
+import protocol
+import server
+
+HOST = "127.0.0.1"
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+@pytest.fixture
+def address(bank):
+    """Accept connections on a free port, each served by server.handle_client on its own thread."""
+    listener = socket.socket()
+    listener.bind((HOST, 0))
+    listener.listen()
+    pool = admission.WorkerPool(4)
+    handlers = []
+
+    def accept():
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return
+            handler = threading.Thread(target=server.handle_client, args=(sock, bank, pool))
+            handler.start()
+            handlers.append(handler)
+
+    acceptor = threading.Thread(target=accept)
+    acceptor.start()
+    yield listener.getsockname()
+    listener.shutdown(socket.SHUT_RDWR)
+    listener.close()
+    acceptor.join()
+    for handler in handlers:
+        handler.join()
+    pool.shutdown()
+
+
+def deposit(amount):
+    return {'user': 'Alice', 'command': 'deposit', 'acct_num': 1001, 'amount': amount}
+
+
+def test_connections_are_reused(address):
+    pool = client.ConnectionPool(address, size=2, verbose=False)
+    try:
+        for amount in range(1, 6):
+            assert pool.send(deposit(amount)).startswith(f"Successfully deposited {amount} dollars")
+        assert pool.open_count == 1
+    finally:
+        pool.close()
+
+
+def test_batch_answers_in_request_order(address):
+    pool = client.ConnectionPool(address, verbose=False)
+    try:
+        responses = pool.send_batch([deposit(amount) for amount in range(1, 11)], depth=3)
+        assert [response.split()[2] for response in responses] == [str(amount) for amount in range(1, 11)]
+        assert responses[-1].endswith("current balance is 2155 dollars")
+    finally:
+        pool.close()
+
+
+def test_rate_limited_requests_are_sent_again(address, monkeypatch):
+    monkeypatch.setattr(server, 'RATE_LIMITER', admission.RateLimiter(50, burst=1))
+    pool = client.ConnectionPool(address, retries=10, verbose=False)
+    try:
+        responses = pool.send_batch([deposit(1) for _ in range(4)])
+        assert all(response.startswith("Successfully deposited") for response in responses)
+        assert pool.send(deposit(1)).startswith("Successfully deposited")
+    finally:
+        pool.close()
+
+
+def test_keyed_request_is_resent_on_a_new_connection(address, bank):
+    pool = client.ConnectionPool(address, verbose=False)
+    try:
+        request = protocol.with_request_key(deposit(7))
+        first = pool.send(request)
+        # The pooled connection dies; the repeat goes out on a new one and gets the first answer.
+        pool.idle.queue[0].sock.shutdown(socket.SHUT_RDWR)
+        assert pool.send(request) == first
+        assert len(bank.history.entries(1001)) == 1
+    finally:
+        pool.close()
+
+
+def test_parse_command():
+    assert client.parse_command("Alice deposit 1001 50 note=rent".split()) == \
+        {'user': 'Alice', 'command': 'deposit', 'acct_num': 1001, 'amount': 50, 'note': 'rent'}
+    with pytest.raises(ValueError):
+        client.parse_command(["Alice"])
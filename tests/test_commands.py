@@ -0,0 +1,84 @@
+"""The command table: malformed fields are refused before a handler runs, and handler errors are contained."""
+import pytest
+
+import server
+from metrics import METRICS
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+@pytest.mark.parametrize("fields, error", [
+    ({'command': 'deposit', 'acct_num': '1001', 'amount': 'ten'}, "amount must be a whole number"),
+    ({'command': 'deposit', 'amount': '10'}, "deposit needs acct_num"),
+    ({'command': 'show_history', 'acct_num': '1001', 'since': 'yesterday'}, "since must be a number"),
+    ({'command': 'show_history', 'acct_num': '1001', 'until': 'nan'}, "until must be a number"),
+    ({'command': 'show_history_filtered', 'acct_num': '1001', 'since': 'inf'}, "since must be a number"),
+    ({'command': 'show_history', 'acct_num': '1001', 'cursor': '-1'}, "cursor must be 0 or more"),
+    ({'command': 'show_history', 'acct_num': '1001', 'limit': '0'}, "limit must be 1 or more"),
+    ({'command': 'show_balances', 'acct_num': '0', 'acct_nums': '1001,x'},
+     "acct_nums must be whole numbers separated by commas"),
+    ({'command': 'show_bank', 'acct_num': '0', 'cursor': '1:x'}, "cursor must be an offset"),
+    ({'command': 'show_bank', 'acct_num': '0', 'limit': '-5'}, "limit must be 1 or more"),
+    ({'command': 'show_changes', 'acct_num': '0', 'since': '0', 'limit': '0'}, "limit must be 1 or more"),
+])
+def test_malformed_field_is_refused(bank, fields, error):
+    user = 'Audit' if fields['command'] in ('show_bank', 'show_balances', 'show_changes') else 'Alice'
+    response = server.dispatch(bank, dict(fields, user=user))
+    assert response.startswith("Invalid request format: ")
+    assert error in response
+
+
+def test_malformed_request_changes_nothing(bank):
+    account = bank.find_account(1001)
+    balance = bank.read_balance(account)
+    server.dispatch(bank, {'user': 'Alice', 'command': 'withdraw', 'acct_num': '1001', 'amount': '1.5'})
+    assert bank.read_balance(account) == balance
+    assert bank.history.entries(1001) == []
+
+
+def test_unknown_command(bank):
+    assert server.dispatch(bank, {'user': 'Alice', 'command': 'nope', 'acct_num': '0'}) == "Invalid command."
+
+
+def test_handler_error_is_answered_and_counted(bank, monkeypatch):
+    def broken(data_dict):
+        raise KeyError('boom')
+
+    monkeypatch.setattr(bank, 'deposit', broken)
+    labels = server.COMMAND_TABLE['deposit'].labels
+    errors = METRICS.values.get(("bank_command_errors_total", labels), 0)
+    response = server.dispatch(bank, {'user': 'Alice', 'command': 'deposit', 'acct_num': '1001', 'amount': '5'})
+    assert response == "Request failed: deposit could not be completed"
+    assert METRICS.values[("bank_command_errors_total", labels)] == errors + 1
+    # The bank still answers the next request.
+    response = server.dispatch(bank, {'user': 'Alice', 'command': 'withdraw', 'acct_num': '1001', 'amount': '0'})
+    assert response.startswith("The current balance for account 1001 is")
+
+
+def test_refused_float_is_refused_again(bank):
+    # admit() prepares a request before dispatch() does; a value refused the
+    # first time must not slip through as an already-converted float.
+    request = {'user': 'Alice', 'command': 'show_history', 'acct_num': '1001', 'since': 'nan'}
+    assert server.admit(bank, request, None) == "Invalid request format: since must be a number"
+    assert server.dispatch(bank, request) == "Invalid request format: since must be a number"
+    request['since'] = float('inf')
+    assert server.dispatch(bank, request) == "Invalid request format: since must be a number"
+
+
+@pytest.mark.parametrize("fields", [
+    {'foo': '1', 'bar': '2', 'baz': '3'},
+    {'user': 'Alice', 'acct_num': '1001', 'amount': '5'},
+    {'command': 'deposit', 'acct_num': '1001', 'amount': '5'},
+    {'user': 'Alice', 'command': 'deposit'},
+])
+def test_request_without_user_or_command_is_malformed(fields):
+    assert not server.well_formed(fields)
+
+
+def test_well_formed_request():
+    assert server.well_formed({'user': 'Alice', 'command': 'deposit', 'acct_num': '1001'})
@@ -0,0 +1,83 @@
+"""The subscribe change feed: live events, filters, resuming from a commit and cutting off a lagging consumer."""
+import json
+
+import pytest
+
+import server
+from events import Subscription
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+def call(bank, user, command, acct_num=0, **fields):
+    return server.dispatch(bank, dict(fields, user=user, command=command, acct_num=str(acct_num)))
+
+
+def lines(chunk):
+    return [json.loads(line) for line in chunk.splitlines()]
+
+
+def test_live_events_in_commit_order(bank):
+    subscription = call(bank, 'Audit', 'subscribe', acct_nums='1001,1003')
+    assert isinstance(subscription, Subscription)
+    stream = iter(subscription)
+    assert lines(next(stream)) == [{"subscribed": True, "seq": bank.commit_seq}]
+    call(bank, 'Alice', 'deposit', 1001, amount='50')
+    call(bank, 'Alice', 'deposit', 1002, amount='5')            # not followed
+    call(bank, 'Alice', 'transfer_to', 1003, amount='20')
+    events = lines(next(stream))
+    assert [(e["acct_num"], e["delta"], e["op"]) for e in events] == [
+        (1001, 50, 'deposit'), (1001, -20, 'transfer_out'), (1003, 20, 'transfer_in')]
+    assert events[1]["seq"] == events[2]["seq"] == bank.commit_seq
+    assert events[1]["counterparty"] == 1003
+    stream.close()
+    assert bank.feed.subscriptions == ()
+
+
+def test_ops_filter(bank):
+    stream = iter(call(bank, 'Alice', 'subscribe', acct_nums='1001', ops='withdraw'))
+    next(stream)
+    call(bank, 'Alice', 'deposit', 1001, amount='50')
+    call(bank, 'Alice', 'withdraw', 1001, amount='30')
+    assert [(e["op"], e["amount"]) for e in lines(next(stream))] == [('withdraw', 30)]
+    stream.close()
+
+
+def test_resume_from_an_earlier_commit(bank):
+    call(bank, 'Alice', 'deposit', 1001, amount='1')
+    since = bank.commit_seq
+    call(bank, 'Alice', 'deposit', 1001, amount='2')
+    call(bank, 'Alice', 'deposit', 1001, amount='3')
+    stream = iter(call(bank, 'Alice', 'subscribe', acct_nums='1001', **{'from': str(since)}))
+    assert lines(next(stream)) == [{"subscribed": True, "seq": since}]
+    assert [e["amount"] for e in lines(next(stream))] == [2, 3]
+    stream.close()
+
+
+def test_lagging_subscriber_is_cut_off(bank, monkeypatch):
+    monkeypatch.setitem(server.config, "subscriber_buffer_events", 2)
+    stream = iter(call(bank, 'Alice', 'subscribe', acct_nums='1001'))
+    next(stream)
+    for amount in range(1, 5):
+        call(bank, 'Alice', 'deposit', 1001, amount=str(amount))
+    assert [e["amount"] for e in lines(next(stream))] == [1, 2]
+    assert lines(next(stream)) == [{"lagged": True, "resume_from": bank.commit_seq - 2}]
+    assert list(stream) == []
+    assert bank.feed.subscriptions == ()
+
+
+@pytest.mark.parametrize("user, fields, error", [
+    ('Zed', {}, "The user must be an account holder to subscribe"),
+    ('Bob', {'acct_nums': '1001'}, "Only the account holder can subscribe to an account"),
+    ('Alice', {'acct_nums': '999'}, "Account 999 does not exist"),
+    ('Alice', {'from': 'last'}, "The from field must be a commit number"),
+    ('Alice', {'from': '99'}, "Offset 99 is not available"),
+])
+def test_refused_subscriptions(bank, user, fields, error):
+    assert call(bank, user, 'subscribe', **fields).startswith(error)
+    assert bank.feed.subscriptions == ()
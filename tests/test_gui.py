@@ -0,0 +1,54 @@
+"""The GUI's request worker and the reply formats it parses (no display needed)."""
+import pytest
+
+pytest.importorskip("tkinter")
+
+import gui
+import protocol
+import server
+
+
+class FakePool:
+    """Stands in for client.ConnectionPool: answers from a list of replies or exceptions."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def send(self, request):
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return f"{reply} {request['n']}"
+
+
+def test_worker_reports_errors_and_keeps_serving():
+    worker = gui.RequestWorker(("127.0.0.1", 1))
+    worker.pool = FakePool(["ok", OSError("refused"), protocol.ProtocolError("bad frame"), KeyError("x"), "ok"])
+    worker.start()
+    for n in range(5):
+        worker.submit({'n': n}, n)
+    replies = [worker.replies.get(timeout=5) for _ in range(5)]
+    assert replies == [
+        (0, ("ok 0", None)),
+        (1, (None, "Error: refused")),
+        (2, (None, "Error: bad frame")),
+        (3, (None, "Error: KeyError: 'x'")),
+        (4, ("ok 4", None)),
+    ]
+
+
+def test_reply_formats_match_the_server():
+    bank = server.Bank()
+    try:
+        page = server.dispatch(bank, {'user': 'Audit', 'command': 'show_bank', 'acct_num': '0', 'limit': '5'})
+        lines = page.splitlines()
+        header = gui.PAGE_HEADER.match(lines[0])
+        assert header.groups() == (str(len(bank.accounts)), str(bank.commit_seq))
+        assert gui.MORE.search(lines[-1]).group(1) == "5"
+        assert len(lines[2:-1]) == 5 and lines[2].split(None, 4)[0] == "1001"
+        server.dispatch(bank, {'user': 'Alice', 'command': 'deposit', 'acct_num': '1001', 'amount': '5'})
+        changes = server.dispatch(bank, {'user': 'Audit', 'command': 'show_changes', 'acct_num': '0',
+                                         'since': header.group(2)})
+        assert gui.CHANGES_HEADER.match(changes).group(1) == str(bank.commit_seq)
+    finally:
+        bank.history.close()
@@ -0,0 +1,105 @@
+"""The memory-mapped history store: 64-bit bounds, growth, paged queries and rebuilding on recovery."""
+import pytest
+
+import persistence
+import server
+from history_store import HistoryStore, I64_MAX, I64_MIN
+
+
+@pytest.fixture
+def store():
+    store = HistoryStore(initial_rows=4)
+    yield store
+    store.close()
+
+
+def test_rows_survive_the_columns_growing(store):
+    for i in range(10):
+        store.append(1001, ('Alice', 'deposit', i), ts=100.0 + i)
+    store.append(1002, ('Bob', 'transfer_to', I64_MAX, 1001), ts=200.0)
+    assert store.capacity >= 11
+    assert store.entries(1001) == [('Alice', 'deposit', i) for i in range(10)]
+    assert store.entries(1002) == [('Bob', 'transfer_to', I64_MAX, 1001)]
+    assert store.tail(1001, 2) == [('Alice', 'deposit', 8), ('Alice', 'deposit', 9)]
+
+
+def test_query_pages_filters_and_time_range(store):
+    for i in range(6):
+        store.append(1001, ('Alice', 'deposit' if i % 2 else 'withdraw', i), ts=100.0 + i)
+    page, cursor = store.query(1001, limit=4)
+    assert [entry[3] for entry in page] == [0, 1, 2, 3]
+    page, cursor = store.query(1001, cursor=cursor, limit=4)
+    assert [entry[3] for entry in page] == [4, 5] and cursor is None
+    page, cursor = store.query(1001, op='deposit')
+    assert [entry[3] for entry in page] == [1, 3, 5]
+    page, cursor = store.query(1001, since=102.0, until=104.0)
+    assert [entry[0] for entry in page] == [102.0, 103.0]
+    assert store.query(1001, op='never') == ([], None)
+    with pytest.raises(ValueError):
+        store.query(1001, cursor=-1)
+
+
+def test_timestamps_stay_in_order_per_account(store):
+    store.append(1001, ('Alice', 'deposit', 1), ts=200.0)
+    store.append(1001, ('Alice', 'deposit', 2), ts=150.0)
+    assert [entry[0] for entry in store.entries(1001, with_ts=True)] == [200.0, 200.0]
+
+
+@pytest.mark.parametrize("acct_num, entry", [
+    (1001, ('Alice', 'deposit', I64_MAX + 1)),
+    (1001, ('Alice', 'deposit', I64_MIN - 1)),
+    (I64_MAX + 1, ('Alice', 'deposit', 1)),
+    (1001, ('Alice', 'transfer_to', 1, I64_MAX + 1)),
+])
+def test_out_of_range_row_is_refused(store, acct_num, entry):
+    with pytest.raises(ValueError):
+        store.append(acct_num, entry)
+    assert store.rows == 0
+
+
+def test_batch_with_one_bad_row_writes_nothing(store):
+    with pytest.raises(ValueError):
+        store.append_batch([(1001, ('Audit', 'interest', 5)), (1002, ('Audit', 'interest', I64_MAX + 1))])
+    assert store.rows == 0 and store.entries(1001) == []
+
+
+def test_bank_refuses_an_out_of_range_amount_before_changing_anything():
+    bank = server.Bank()
+    try:
+        account = bank.find_account(1001)
+        balance, seq = bank.read_balance(account), bank.commit_seq
+        response = server.dispatch(bank, {'user': 'Alice', 'command': 'deposit', 'acct_num': '1001',
+                                          'amount': str(2 ** 64)})
+        assert response == "Invalid request format: amount is out of range"
+        with pytest.raises(ValueError):
+            bank.post([(account, 10, ('Alice', 'deposit', 10)),
+                       (bank.find_account(1002), -10, ('Alice', 'transfer_to', I64_MAX + 1))], 'test')
+        assert bank.read_balance(account) == balance and bank.commit_seq == seq
+        assert bank.history.entries(1001) == []
+    finally:
+        bank.history.close()
+
+
+def test_history_is_rebuilt_when_the_bank_reopens(tmp_path):
+    config = {'wal_fsync': False, 'snapshot_interval': 0, 'data_dir': str(tmp_path)}
+    bank = server.Bank()
+    persistence.attach(bank, config)
+    for amount in range(1, 6):
+        server.dispatch(bank, {'user': 'Alice', 'command': 'deposit', 'acct_num': '1001', 'amount': str(amount)})
+    before = bank.history.entries(1001, with_ts=True)
+    assert before
+    bank.wal.close()
+    bank.history.close()
+
+    bank = server.Bank()
+    persistence.attach(bank, config)
+    try:
+        # Replayed rows carry the log record's time, taken just after the original.
+        after = bank.history.entries(1001, with_ts=True)
+        assert [entry[1:] for entry in after] == [entry[1:] for entry in before]
+        assert all(abs(a[0] - b[0]) < 1 for a, b in zip(after, before))
+        page, cursor = bank.history.query(1001, op='deposit', cursor=3)
+        assert [entry[3] for entry in page] == [4, 5] and cursor is None
+    finally:
+        bank.wal.close()
+        bank.history.close()
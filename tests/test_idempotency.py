@@ -0,0 +1,90 @@
+"""Idempotency keys: a retried request gets the first response instead of running again."""
+import threading
+import time
+
+import pytest
+
+import idempotency
+import server
+from protocol import REQUEST_KEY
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+def deposit(key, amount='10', user='Alice'):
+    return {'user': user, 'command': 'deposit', 'acct_num': '1001', 'amount': amount, REQUEST_KEY: key}
+
+
+def test_retry_gets_the_first_response(bank):
+    first = server.dispatch(bank, deposit('k1'))
+    assert server.dispatch(bank, deposit('k1')) == first
+    assert server.admit(bank, deposit('k1'), None) == first      # answered before reaching the pool
+    assert len(bank.history.entries(1001)) == 1
+    assert server.dispatch(bank, deposit('k2')) != first
+    assert len(bank.history.entries(1001)) == 2
+
+
+def test_key_reused_for_a_different_request(bank):
+    server.dispatch(bank, deposit('k1'))
+    assert server.dispatch(bank, deposit('k1', amount='11')) == idempotency.KEY_REUSED
+    # Keys belong to a user: another user's key of the same name is separate.
+    assert server.dispatch(bank, deposit('k1', user='Jason')).startswith("Successfully deposited")
+
+
+def test_reads_ignore_the_key(bank):
+    request = {'user': 'Alice', 'command': 'my_accounts', 'acct_num': '0', REQUEST_KEY: 'k1'}
+    server.dispatch(bank, request)
+    assert bank.responses.entries == {}
+
+
+def test_concurrent_repeats_wait_for_the_first():
+    cache = idempotency.ResponseCache()
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def execute():
+        runs.append(1)
+        started.set()
+        release.wait()
+        return "done"
+
+    request = deposit('k1')
+    results = []
+    first = threading.Thread(target=lambda: results.append(cache.run(request, execute)))
+    first.start()
+    started.wait()
+    repeats = [threading.Thread(target=lambda: results.append(cache.run(dict(request), execute))) for _ in range(3)]
+    for thread in repeats:
+        thread.start()
+    release.set()
+    for thread in [first] + repeats:
+        thread.join()
+    assert results == ["done"] * 4 and len(runs) == 1
+
+
+def test_failed_run_is_not_cached():
+    cache = idempotency.ResponseCache()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        cache.run(deposit('k1'), fail)
+    assert cache.run(deposit('k1'), lambda: "ran") == "ran"
+
+
+def test_entries_expire_and_are_evicted(monkeypatch):
+    cache = idempotency.ResponseCache(ttl=60, max_entries=2)
+    for n in range(3):
+        cache.run(deposit(f"k{n}"), lambda n=n: f"response {n}")
+    assert list(cache.entries) == [('Alice', 'k1'), ('Alice', 'k2')]
+    assert cache.bytes == 2 * (len("response 0") + idempotency.ENTRY_OVERHEAD)
+    later = time.time() + 61
+    monkeypatch.setattr(idempotency.time, 'time', lambda: later)
+    assert cache.peek(deposit('k2')) is None
+    assert cache.export() == []
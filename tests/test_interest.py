@@ -0,0 +1,63 @@
+"""The batched interest engine: rates, and passes that run alongside other writes."""
+import threading
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+def test_pass_applies_the_rate_to_every_loan(bank):
+    loans = [account for account in bank.accounts if account.acct_type == 'loan']
+    before = {account.acct_num: account.balance for account in loans}
+    assert bank.apply_interest() == len(loans)
+    for account in loans:
+        delta = int(before[account.acct_num] * 1.05) - before[account.acct_num]
+        assert bank.read_balance(account) == before[account.acct_num] + delta
+        assert bank.history.entries(account.acct_num) == [("System", "interest", delta)]
+    assert bank.read_balance(bank.find_account(1001)) == 2100   # checking accounts are left alone
+
+
+def test_tiers_and_overrides(bank):
+    bank.interest.config = dict(server.config, interest_rate=0.1, interest_tiers=[[1000, 0.2]])
+    bank.interest.set_rate(1012, 0.5)
+    bank.apply_interest()
+    assert bank.read_balance(bank.find_account(1002)) == -330       # -300: base rate
+    assert bank.read_balance(bank.find_account(1006)) == -3840      # -3200: owes over 1000
+    assert bank.read_balance(bank.find_account(1012)) == -150       # -100: own rate
+
+
+def test_concurrent_repayments_are_kept_in_commit_order(bank):
+    """Replaying each loan's history from its opening balance must reproduce every interest amount."""
+    opening = {account.acct_num: account.balance for account in bank.accounts if account.acct_type == 'loan'}
+    stop = threading.Event()
+
+    def repay(acct_num, user):
+        while not stop.is_set():
+            server.dispatch(bank, {'user': user, 'command': 'pay_loan_check', 'acct_num': str(acct_num),
+                                   'amount': '7'})
+
+    threads = [threading.Thread(target=repay, args=(acct_num, account.acct_holder[0]))
+               for acct_num, account in ((n, bank.find_account(n)) for n in (1002, 1004, 1006, 1008))]
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(20):
+            bank.apply_interest()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    for acct_num, balance in opening.items():
+        for actor, op, amount in bank.history.entries(acct_num):
+            if op == 'interest':
+                assert amount == int(balance * 1.05) - balance, acct_num
+            balance += amount
+        assert bank.read_balance(bank.find_account(acct_num)) == balance
@@ -0,0 +1,43 @@
+"""simulation_latency is spent before any lock is taken, so it never serialises writers."""
+import threading
+import time
+
+import pytest
+
+import server
+
+LATENCY = 0.1
+
+
+@pytest.fixture
+def bank(monkeypatch):
+    monkeypatch.setitem(server.config, "simulation_latency", LATENCY)
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+@pytest.mark.parametrize("command, fields", [
+    ('deposit', {'acct_num': '1001', 'amount': '1'}),
+    ('withdraw', {'acct_num': '1001', 'amount': '1'}),
+    ('transfer_to', {'acct_num': '1003', 'amount': '1'}),
+])
+def test_writers_to_one_account_wait_in_parallel(bank, command, fields):
+    threads = [threading.Thread(target=server.dispatch, args=(bank, dict(fields, user='Alice', command=command)))
+               for _ in range(8)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    assert len(bank.history.entries(1001)) == 8
+    # Held under the account lock, the delays would add up to 8 * LATENCY.
+    assert elapsed < 4 * LATENCY
+
+
+def test_no_delay_by_default(monkeypatch):
+    monkeypatch.setitem(server.config, "simulation_latency", 0)
+    start = time.perf_counter()
+    server.simulate_latency()
+    assert time.perf_counter() - start < LATENCY
@@ -0,0 +1,76 @@
+"""The load test's workload model and report comparison (benchmarks/loadtest.py), without a server."""
+import os
+import random
+import sys
+
+import pytest
+
+import server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import loadtest
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+def test_parse_mix():
+    assert loadtest.parse_mix("transfers") == {"transfer_to": 100}
+    assert loadtest.parse_mix("deposit=5, show_history") == {"deposit": 5.0, "show_history": 1.0}
+
+
+def test_accounts_are_discovered_from_show_bank(bank):
+    report = "".join(server.dispatch(bank, {'user': 'Audit', 'command': 'show_bank', 'acct_num': '0', 'history': '2'}))
+    accounts = loadtest.parse_accounts(report)
+    assert len(accounts) == len(server.SEED_ACCOUNTS)
+    assert accounts[0] == (1001, 'checking', 'Alice', ['Alice', 'Jason', 'David'])
+
+
+def test_zipf_skews_towards_a_few_items():
+    rng = random.Random(1)
+    counts = {}
+    zipf = loadtest.Zipf(range(100), 1.2, rng)
+    for _ in range(10000):
+        item = zipf.pick(rng)
+        counts[item] = counts.get(item, 0) + 1
+    top = sorted(counts.values(), reverse=True)
+    assert sum(top[:5]) > 5000
+    uniform = loadtest.Zipf(range(100), 0, rng)
+    assert len({uniform.pick(rng) for _ in range(5000)}) == 100
+
+
+def test_workload_requests_are_ones_the_bank_accepts(bank):
+    accounts = loadtest.parse_accounts("".join(server.dispatch(bank, {'user': 'Audit', 'command': 'show_bank',
+                                                                       'acct_num': '0'})))
+    workload = loadtest.Workload(accounts, loadtest.MIXES["default"], 1.0, seed=7)
+    seen = set()
+    for _ in range(300):
+        command, fields = workload.next()
+        seen.add(command)
+        response = server.dispatch(bank, {key: str(value) for key, value in fields.items()})
+        if not isinstance(response, str):
+            response = "".join(response)
+        assert not response.startswith(("Invalid", "Request failed")), (fields, response)
+    assert seen == set(loadtest.MIXES["default"])
+
+
+def test_compare_flags_regressions():
+    def report(throughput, p99):
+        summary = {"throughput": throughput, "latency_ms": {"p99": p99}}
+        return {"total": summary, "commands": {"deposit": summary}}
+
+    baseline = report(1000.0, 2.0)
+    assert loadtest.compare(report(950.0, 2.1), baseline, 0.1) == []
+    problems = loadtest.compare(report(800.0, 3.0), baseline, 0.1)
+    assert len(problems) == 4 and problems[0].startswith("total: throughput 800/s")
+
+
+def test_summarize():
+    summary = loadtest.summarize([0.001, 0.002, 0.003, 0.004], rejected=1, errors=1, elapsed=2.0)
+    assert summary["requests"] == 5 and summary["throughput"] == 2.0
+    assert summary["latency_ms"]["p50"] == 3.0 and summary["latency_ms"]["max"] == 4.0
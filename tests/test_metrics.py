@@ -0,0 +1,81 @@
+"""Metrics: histograms, the Prometheus rendering, and what the request path records."""
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics
+import server
+from metrics import METRICS, Histogram, Metrics
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(0.001, 0.01, 0.1))
+    assert histogram.quantile(0.5) is None
+    for value in (0.0005, 0.005, 0.005, 0.05, 5.0):
+        histogram.observe(value)
+    assert histogram.count == 5 and histogram.sum == pytest.approx(5.0605)
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(0.99) == float("inf")
+
+
+def test_prometheus_text():
+    registry = Metrics()
+    registry.inc("requests_total", labels=(("command", "deposit"),))
+    registry.inc("requests_total", 2, labels=(("command", "deposit"),))
+    registry.add("open", 3)
+    registry.gauge("depth", lambda: 7)
+    registry.gauge("broken", lambda: 1 / 0)     # left out, not fatal
+    registry.observe("seconds", 0.003)
+    text = registry.prometheus(extra_labels=(("shard", "0"),))
+    assert '# TYPE requests_total counter\nrequests_total{shard="0",command="deposit"} 3' in text
+    assert 'open{shard="0"} 3' in text and 'depth{shard="0"} 7' in text
+    assert 'broken' not in text
+    assert 'seconds_bucket{shard="0",le="0.0025"} 0' in text
+    assert 'seconds_bucket{shard="0",le="0.005"} 1' in text
+    assert 'seconds_count{shard="0"} 1' in text
+
+
+def test_lock_timing_ranks_the_most_contended_accounts():
+    registry = Metrics()
+    bank = server.Bank()
+    try:
+        a, b = bank.find_account(1001), bank.find_account(1003)
+        registry.lock_timing((a,), 0.001, 0.002)
+        registry.lock_timing((a, b), 0.010, 0.001)
+        assert registry.hottest_accounts(1) == [(1001, 2, pytest.approx(0.011), pytest.approx(0.003))]
+        assert registry.lock_wait.count == 2
+    finally:
+        bank.history.close()
+
+
+def test_requests_are_timed_and_stats_are_audit_only():
+    bank = server.Bank()
+    try:
+        key = ("bank_command_seconds", (("command", "deposit"),))
+        before = METRICS.histograms[key].count if key in METRICS.histograms else 0
+        server.dispatch(bank, {'user': 'Alice', 'command': 'deposit', 'acct_num': '1001', 'amount': '5'})
+        assert METRICS.histograms[key].count == before + 1
+        assert server.dispatch(bank, {'user': 'Alice', 'command': 'stats'}) == \
+            "Access denied: only Audit can view server statistics"
+        assert server.dispatch(bank, {'user': 'Audit', 'command': 'stats'}).startswith("Counters and gauges:")
+        assert 'bank_command_seconds_count{command="deposit"}' in \
+            server.dispatch(bank, {'user': 'Audit', 'command': 'stats', 'format': 'prometheus'})
+    finally:
+        bank.history.close()
+
+
+def test_metrics_over_http():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    http = metrics.serve_http(port, lambda: "up 1\n")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.read() == b"up 1\n"
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/other")
+    finally:
+        http.shutdown()
+        http.server_close()
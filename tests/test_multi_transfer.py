@@ -0,0 +1,77 @@
+"""multi_transfer: several legs posted as one commit, all or nothing, without deadlocks."""
+import threading
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+def transfer(bank, user, legs):
+    return server.dispatch(bank, {'user': user, 'command': 'multi_transfer', 'acct_num': '0', 'legs': legs})
+
+
+def balances(bank, *acct_nums):
+    return [bank.read_balance(bank.find_account(acct_num)) for acct_num in acct_nums]
+
+
+def test_split_payment(bank):
+    before = balances(bank, 1001, 1003, 1002)
+    seq = bank.commit_seq
+    response = transfer(bank, 'Alice', '1001:-150,1003:100,1002:50')
+    assert response.startswith("Alice successfully posted 3 legs in one transaction:")
+    assert balances(bank, 1001, 1003, 1002) == [before[0] - 150, before[1] + 100, before[2] + 50]
+    assert bank.commit_seq == seq + 1
+    assert bank.history.entries(1001) == [('Alice', 'transfer_out', 150)]
+    assert bank.history.entries(1003) == [('Alice', 'transfer_in', 100, 1001)]
+    assert bank.history.entries(1002) == [('Alice', 'loan_payment_received', 50, 1001)]
+
+
+def test_short_leg_applies_nothing(bank):
+    before = balances(bank, 1001, 1027, 1003)
+    response = transfer(bank, 'Alice', f"1001:-10,1027:-{before[1] + 1},1003:{before[1] + 11}")
+    assert response == f"The balance of account 1027 is insufficient, its current balance is {before[1]}"
+    assert balances(bank, 1001, 1027, 1003) == before
+    assert bank.history.entries(1001) == []
+
+
+@pytest.mark.parametrize("legs, error", [
+    ("1001:-5", "A multi_transfer needs between 2 and"),
+    ("1001:-5,1003", "Legs must be acct_num:amount pairs"),
+    ("1001:-5,1003:4", "The debits and credits must balance, but the legs sum to -1"),
+    ("1001:-5,1001:5", "Each account may appear in only one leg"),
+    ("1001:0,1003:0", "Every leg must move a nonzero amount"),
+    (f"1001:-{2 ** 63},1003:{2 ** 63}", "Leg account numbers and amounts are out of range"),
+    ("1001:-5,999:5", "Account 999 was not found"),
+    ("1003:-5,1001:5", "Only account holders can debit account 1003"),
+    ("1001:-5,1004:5", "Only loan account holders can make repayment on account 1004"),
+])
+def test_refused_legs(bank, legs, error):
+    seq = bank.commit_seq
+    assert transfer(bank, 'Alice', legs).startswith(error)
+    assert bank.commit_seq == seq
+
+
+def test_opposing_transfers_do_not_deadlock(bank):
+    total = sum(balances(bank, 1001, 1027, 1002))
+    seq = bank.commit_seq
+    legs = ['1001:-3,1027:3', '1027:-3,1001:2,1002:1', '1001:-2,1002:1,1027:1']
+
+    def worker(n):
+        for i in range(200):
+            transfer(bank, 'Alice', legs[(n + i) % 3])
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert not any(thread.is_alive() for thread in threads)
+    assert sum(balances(bank, 1001, 1027, 1002)) == total
+    assert bank.commit_seq == seq + 1200
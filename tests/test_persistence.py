@@ -0,0 +1,81 @@
+"""Recovery of a persistent Bank from its snapshot and write-ahead log."""
+import persistence
+import protocol
+import server
+
+CONFIG = {'wal_fsync': False, 'snapshot_interval': 0}
+
+
+def call(bank, user, command, acct_num=0, **fields):
+    return server.dispatch(bank, dict(fields, user=user, command=command, acct_num=str(acct_num)))
+
+
+def open_bank(data_dir):
+    bank = server.Bank()
+    persistence.attach(bank, dict(CONFIG, data_dir=str(data_dir)))
+    return bank
+
+
+def close_bank(bank):
+    bank.wal.close()
+    bank.history.close()
+
+
+def state(bank):
+    return {account.acct_num: (account.acct_type, account.acct_holder, bank.read_balance(account),
+                               bank.history.entries(account.acct_num))
+            for account in bank.accounts}
+
+
+def test_restart_restores_balances_history_and_holders(tmp_path):
+    bank = open_bank(tmp_path)
+    call(bank, 'Alice', 'deposit', 1001, amount='50')
+    call(bank, 'Alice', 'transfer_to', 1003, amount='20')
+    persistence.snapshot(bank)
+    # After the snapshot: replayed from the log.
+    call(bank, 'Zed', 'create_account', 5555, amount='9')
+    call(bank, 'Zed', 'add_holder', 5555, holder='Alice')
+    call(bank, 'Alice', 'pay_loan_transfer_to', 1002, amount='30')
+    call(bank, 'Audit', 'apply_interest')
+    before = state(bank)
+    close_bank(bank)
+
+    bank = open_bank(tmp_path)
+    try:
+        assert state(bank) == before
+        assert bank.find_account(5555).acct_holder == ('Zed', 'Alice')
+        assert '5555' in call(bank, 'Alice', 'my_accounts')
+        assert bank.totals == {acct_type: [sum(1 for a in bank.accounts if a.acct_type == acct_type),
+                                           sum(bank.read_balance(a) for a in bank.accounts if a.acct_type == acct_type)]
+                               for acct_type in bank.totals}
+    finally:
+        close_bank(bank)
+
+
+def test_restart_answers_a_retry_with_the_cached_response(tmp_path):
+    bank = open_bank(tmp_path)
+    request = {protocol.REQUEST_KEY: 'k1', 'amount': '25'}
+    first = call(bank, 'Alice', 'deposit', 1001, **request)
+    close_bank(bank)
+
+    bank = open_bank(tmp_path)
+    try:
+        balance = bank.read_balance(bank.find_account(1001))
+        assert call(bank, 'Alice', 'deposit', 1001, **request) == first
+        assert bank.read_balance(bank.find_account(1001)) == balance
+    finally:
+        close_bank(bank)
+
+
+def test_snapshot_keeps_cached_responses(tmp_path):
+    bank = open_bank(tmp_path)
+    request = {protocol.REQUEST_KEY: 'k2', 'amount': '5'}
+    first = call(bank, 'Bob', 'withdraw', 1003, **request)
+    persistence.snapshot(bank)
+    close_bank(bank)
+
+    bank = open_bank(tmp_path)
+    try:
+        assert call(bank, 'Bob', 'withdraw', 1003, **request) == first
+    finally:
+        close_bank(bank)
@@ -0,0 +1,77 @@
+"""The framed protocol: field encoding, frame reading and a pipelined connection to the threaded handler."""
+import socket
+import threading
+
+import pytest
+
+import admission
+import protocol
+import server
+
+
+def test_fields_round_trip():
+    fields = {'user': 'Zoë', 'command': 'deposit', 'acct_num': '1001', 'amount': '5'}
+    assert protocol.decode_fields(protocol.encode_fields(fields)) == fields
+
+
+@pytest.mark.parametrize("body", [
+    protocol.encode_fields({'user': 'Alice'})[:-1],        # truncated field
+    protocol.encode_fields({'user': 'Alice'})[:3],         # truncated header
+    protocol.encode_fields({'user': 'Alice'})[:-1] + b"\xff",   # not UTF-8
+])
+def test_malformed_body_raises_protocol_error(body):
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode_fields(body)
+
+
+class Trickle:
+    """A socket stand-in that hands out its data a few bytes per recv."""
+
+    def __init__(self, data, step=3):
+        self.data = data
+        self.step = step
+
+    def recv(self, size):
+        chunk, self.data = self.data[:min(size, self.step)], self.data[min(size, self.step):]
+        return chunk
+
+
+def test_frames_split_across_reads():
+    data = protocol.pack_response(7, "first") + protocol.pack_response(8, "sécond")
+    reader = protocol.FrameReader(Trickle(data[5:]), initial=data[:5])
+    assert list(reader) == [(7, b"first"), (8, "sécond".encode())]
+
+
+def test_peer_closing_mid_frame_ends_the_stream():
+    reader = protocol.FrameReader(Trickle(protocol.pack_response(1, "cut off")[:-2]))
+    assert reader.read_frame() is None
+
+
+def test_oversized_frame_is_refused():
+    reader = protocol.FrameReader(Trickle(protocol.HEADER.pack(protocol.MAX_FRAME + 1, 1)))
+    with pytest.raises(protocol.ProtocolError):
+        reader.read_frame()
+
+
+def test_pipelined_requests_on_the_threaded_handler():
+    bank = server.Bank()
+    pool = admission.WorkerPool(2)
+    ours, theirs = socket.socketpair()
+    handler = threading.Thread(target=server.handle_client, args=(theirs, bank, pool))
+    handler.start()
+    connection = protocol.FramedConnection(ours)
+    try:
+        requests = [{'user': 'Alice', 'command': 'deposit', 'acct_num': '1001', 'amount': str(n)} for n in range(1, 6)]
+        requests.insert(2, {'user': 'Alice'})
+        responses = connection.request_many(requests)
+        assert responses[2] == "Invalid request format."
+        assert responses[-1] == "Successfully deposited 5 dollars into account 1001, current balance is 2115 dollars"
+        # A malformed frame closes the connection.
+        ours.sendall(protocol.pack_frame(99, protocol.encode_fields({'user': 'Alice'})[:-1]))
+        with pytest.raises(ConnectionError):
+            connection.recv()
+    finally:
+        connection.close()
+        handler.join()
+        pool.shutdown()
+        bank.history.close()
@@ -0,0 +1,82 @@
+"""A read replica copies the primary's accounts, then keeps up with its log."""
+import socket
+import time
+
+import persistence
+import replication
+import server
+from metrics import METRICS
+
+HOST = "127.0.0.1"
+
+
+def call(bank, user, command, acct_num=0, **fields):
+    return server.dispatch(bank, dict(fields, user=user, command=command, acct_num=str(acct_num)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_primary(data_dir, max_records=100000):
+    bank = server.Bank()
+    persistence.attach(bank, {'data_dir': str(data_dir), 'wal_fsync': False, 'snapshot_interval': 0})
+    bank.primary = replication.Primary(bank, free_port(), heartbeat_ms=20, max_records=max_records)
+    bank.primary.start(HOST)
+    return bank
+
+
+def start_replica(primary):
+    bank = server.Bank()
+    bank.responses = None
+    bank.replica = replication.Replica(bank, (HOST, primary.primary.port), (HOST, free_port()))
+    bank.replica.start()
+    return bank
+
+
+def state(bank):
+    return {account.acct_num: (account.acct_holder, bank.read_balance(account), bank.history.entries(account.acct_num))
+            for account in bank.accounts}
+
+
+def wait_until_caught_up(primary, replica, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if replica.replica.lsn == primary.wal.last_lsn and state(replica) == state(primary):
+            return
+        time.sleep(0.02)
+    raise AssertionError(f"replica at lsn {replica.replica.lsn}, primary at {primary.wal.last_lsn}")
+
+
+def test_replica_copies_then_follows_the_log(tmp_path):
+    primary = start_primary(tmp_path)
+    # Before the replica joins: part of the copy.
+    call(primary, 'Alice', 'deposit', 1001, amount='50')
+    call(primary, 'Zed', 'create_account', 5555, amount='9')
+    replica = start_replica(primary)
+    wait_until_caught_up(primary, replica)
+    # After it joins: streamed.
+    call(primary, 'Alice', 'transfer_to', 1003, amount='20')
+    call(primary, 'Zed', 'add_holder', 5555, holder='Bob')
+    call(primary, 'Audit', 'apply_interest')
+    wait_until_caught_up(primary, replica)
+    assert replica.find_account(5555).acct_holder == ('Zed', 'Bob')
+    assert call(replica, 'Bob', 'show_accountholders', 5555) == call(primary, 'Bob', 'show_accountholders', 5555)
+    assert call(replica, 'Alice', 'deposit', 1001, amount='1').startswith(
+        "Not answered by this replica: deposit must be sent to the primary")
+
+
+def test_replica_that_falls_behind_copies_again(tmp_path):
+    # A follower queue that holds no records overflows on the first one, so
+    # the replica is dropped and must reconnect and take a fresh copy.
+    primary = start_primary(tmp_path, max_records=0)
+    replica = start_replica(primary)
+    wait_until_caught_up(primary, replica)
+    dropped = METRICS.values.get(("bank_replicas_dropped_total", ()), 0)
+    for _ in range(5):
+        call(primary, 'Alice', 'deposit', 1001, amount='1')
+    wait_until_caught_up(primary, replica)
+    assert METRICS.values[("bank_replicas_dropped_total", ())] > dropped
+    assert replica.read_balance(replica.find_account(1001)) == primary.read_balance(primary.find_account(1001))
@@ -0,0 +1,75 @@
+"""The audit report: streamed in chunks, paged with a cursor, refreshed with show_changes, totals kept as it goes."""
+import re
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+def call(bank, user, command, acct_num=0, **fields):
+    return server.dispatch(bank, dict(fields, user=user, command=command, acct_num=str(acct_num)))
+
+
+def report_acct_nums(text):
+    return [int(line.split()[0]) for line in text.splitlines() if line[:1].isdigit() and ' ' in line
+            and line.split()[1] in ('checking', 'savings', 'loan')]
+
+
+def add_accounts(bank, count):
+    for n in range(count):
+        call(bank, f"Extra{n}", 'create_account', 20000 + n, amount=str(n))
+
+
+def test_full_report_is_streamed_in_chunks(bank):
+    add_accounts(bank, server.REPORT_CHUNK_ROWS)
+    chunks = list(call(bank, 'Audit', 'show_bank'))
+    assert chunks[0].startswith("All account information is as follows:")
+    assert chunks[-1].startswith("Totals by account type:")
+    assert len(chunks) == 4     # header, two chunks of rows, totals
+    assert report_acct_nums("".join(chunks)) == [account.acct_num for account in bank.accounts]
+
+
+def test_pages_cover_every_account_once(bank):
+    add_accounts(bank, 30)
+    seen, cursor = [], 0
+    while cursor is not None:
+        page = call(bank, 'Audit', 'show_bank', cursor=str(cursor), limit='25')
+        seen += report_acct_nums(page)
+        match = re.search(r"cursor=(\d+)", page)
+        cursor = match.group(1) if match else None
+    assert seen == [account.acct_num for account in bank.accounts]
+
+
+def test_changes_since_a_page(bank):
+    page = call(bank, 'Audit', 'show_bank', cursor='0', limit='10')
+    commit = re.search(r"as of commit (\d+)", page).group(1)
+    call(bank, 'Alice', 'deposit', 1001, amount='5')
+    call(bank, 'Alice', 'transfer_to', 1003, amount='5')
+    changes = call(bank, 'Audit', 'show_changes', since=commit)
+    assert changes.startswith(f"2 accounts changed since commit {commit} (now at commit {bank.commit_seq})")
+    assert report_acct_nums(changes) == [1001, 1003]
+    assert call(bank, 'Audit', 'show_changes', since=commit, limit='1').startswith("Too many changes")
+    assert call(bank, 'Audit', 'show_changes', since=str(bank.commit_seq)).startswith("0 accounts changed")
+    assert call(bank, 'Audit', 'show_changes', since='x') == \
+        "The since field must be a commit number from show_bank or show_changes"
+
+
+def test_totals_follow_every_commit(bank):
+    call(bank, 'Alice', 'deposit', 1001, amount='50')
+    call(bank, 'Alice', 'withdraw', 1001, amount='20')
+    call(bank, 'Alice', 'pay_loan_transfer_to', 1002, amount='30')
+    call(bank, 'Zed', 'create_account', 5555, amount='9')
+    bank.apply_interest()
+    expected = {}
+    for account in bank.accounts:
+        totals = expected.setdefault(account.acct_type, [0, 0])
+        totals[0] += 1
+        totals[1] += bank.read_balance(account)
+    assert {acct_type: list(totals) for acct_type, totals in bank.totals_snapshot().items()} == expected
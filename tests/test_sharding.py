@@ -0,0 +1,99 @@
+"""Cross-shard transfers: two-phase commit and abort, and the escrow they hold."""
+import pytest
+
+import server
+import sharding
+
+SHARDS = 3
+
+
+def call(bank, user, command, acct_num=0, **fields):
+    return server.dispatch(bank, dict(fields, user=user, command=command, acct_num=str(acct_num)))
+
+
+@pytest.fixture(scope="module")
+def bank():
+    bank = server.ShardedBank(SHARDS)
+    yield bank
+    bank.close()
+
+
+def history(bank, user, acct_num):
+    return call(bank, user, 'show_history', acct_num)
+
+
+def test_accounts_are_on_different_shards():
+    assert len({sharding.shard_of(acct_num, SHARDS) for acct_num in (1001, 1002, 1003, 1027)}) == SHARDS
+
+
+def test_cross_shard_transfer_commits_on_both_shards(bank):
+    before = bank.balances_of([1001, 1003])
+    response = call(bank, 'Alice', 'transfer_to', 1003, amount='100')
+    assert response.startswith("Alice successfully transferred 100 dollars")
+    assert bank.balances_of([1001, 1003]) == {1001: before[1001] - 100, 1003: before[1003] + 100}
+    assert "('Alice', 'transfer_out', 100, 1003)" in history(bank, 'Alice', 1001)
+    assert "('Alice', 'transfer_in', 100, 1001)" in history(bank, 'Bob', 1003)
+
+
+def test_short_leg_aborts_every_shard(bank):
+    before = bank.balances_of([1001, 1003, 1027])
+    response = call(bank, 'Alice', 'multi_transfer', legs=f"1001:-50,1027:-{before[1027] + 1},1003:{before[1027] + 51}")
+    assert "insufficient" in response.lower()
+    assert bank.balances_of([1001, 1003, 1027]) == before
+    # The released escrow can be spent again.
+    response = call(bank, 'Alice', 'transfer_to', 1003, amount=str(before[1001]))
+    assert response.startswith("Alice successfully transferred")
+    assert bank.balances_of([1001])[1001] == 0
+
+
+def test_rejected_loan_repayment_escrows_nothing(bank):
+    before = bank.balances_of([1001, 1003])
+    assert call(bank, 'Alice', 'pay_loan_transfer_to', 1003, amount='1') == "Loan account not found"
+    assert call(bank, 'Bob', 'pay_loan_transfer_to', 1002, amount='1') == "Only loan account holders can make repayment"
+    assert bank.balances_of([1001, 1003]) == before
+
+
+def test_escrow_is_not_a_committed_balance():
+    local = server.Bank()
+    participant = sharding.Participant(local, server.dispatch)
+    account = local.find_account(1001)
+    committed = local.read_balance(account)
+    assert participant.prepare_debit(1, 1001, 500) == (True, committed - 500)
+    # Another commit on the account while the debit is held does not publish it.
+    call(local, 'Alice', 'deposit', 1001, amount='5')
+    assert local.read_balance(account) == committed + 5
+    participant.abort(1)
+    assert local.read_balance(account) == account.balance == committed + 5
+    assert local.held == {}
+    participant.prepare_debit(2, 1001, 100)
+    participant.commit_debit(2, ('Alice', 'transfer_out', 100, 1003))
+    assert local.read_balance(account) == account.balance == committed - 95
+
+
+class RefusingShard:
+    """Stands in for a shard that refuses (or fails) every create and add_holder."""
+
+    def call(self, op, data_dict):
+        return False, f"Request failed: {op} could not be completed"
+
+
+def test_directory_changes_only_when_the_shard_confirms(bank, monkeypatch):
+    monkeypatch.setattr(bank, 'shard_for', lambda acct_num: RefusingShard())
+    assert call(bank, 'Nova', 'create_account', 7777, amount='5').startswith("Request failed")
+    assert 7777 not in bank.directory and 'Nova' not in bank.accounts_by_init_holder
+    assert call(bank, 'Alice', 'add_holder', 1001, holder='Nova').startswith("Request failed")
+    assert 'Nova' not in bank.holders[1001] and 'Nova' not in bank.accounts_by_holder
+    monkeypatch.undo()
+    assert call(bank, 'Nova', 'create_account', 7777, amount='5').startswith("Successfully created")
+    assert bank.directory[7777] == ('checking', 'Nova')
+
+
+def test_last_report_page_has_no_cursor(bank):
+    page = call(bank, 'Audit', 'show_bank', limit=str(len(bank.directory)))
+    assert "cursor=" not in page
+    cursor, pages = '0:0', 0
+    while cursor is not None:
+        page = call(bank, 'Audit', 'show_bank', cursor=cursor, limit='7')
+        pages += 1
+        cursor = page.rsplit("cursor=", 1)[1].strip() if "cursor=" in page else None
+    assert pages == -(-len(bank.directory) // 7)
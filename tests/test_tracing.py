@@ -0,0 +1,88 @@
+"""Slow-request tracing and the sampling profiler."""
+import os
+import time
+
+import pytest
+
+import admission
+import server
+import tracing
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+    tracing.configure(0)
+
+
+def audit(bank, command, **fields):
+    return server.dispatch(bank, dict(fields, user='Audit', command=command))
+
+
+def traced(bank, pool, data_dict):
+    trace = tracing.begin()
+    trace.label(data_dict)
+    trace.mark('parse')
+    response = server.dispatch_admitted(bank, data_dict, pool, trace)
+    trace.mark('send')
+    tracing.finish(trace)
+    return response, trace
+
+
+def test_requests_are_traced_phase_by_phase(bank):
+    assert audit(bank, 'trace_dump') == "Tracing is off; turn it on with trace_dump -o slowest=N"
+    assert audit(bank, 'trace_dump', slowest='2') == "Tracing on: keeping the 2 slowest requests"
+    pool = admission.WorkerPool(1)
+    try:
+        for amount in ('1', '2', '3'):
+            response, trace = traced(bank, pool, {'user': 'Alice', 'command': 'withdraw', 'acct_num': '1001',
+                                                  'amount': amount})
+            assert response.startswith("Alice successfully withdrew")
+        assert {'parse', 'queue', 'lookup', 'lock_wait', 'critical_section', 'format', 'send'} <= set(trace.phases)
+        assert sum(trace.phases.values()) == pytest.approx(trace.total())
+    finally:
+        pool.shutdown()
+    dump = audit(bank, 'trace_dump', reset='1').splitlines()
+    assert dump[0].startswith("The 2 slowest of 3 requests traced since")
+    assert len(dump) == 4 and all(" withdraw " in line and " Alice " in line for line in dump[2:])
+    assert audit(bank, 'trace_dump').splitlines()[0].startswith("The 0 slowest of 0 requests")
+    assert audit(bank, 'trace_dump', slowest='0') == "Tracing off"
+    assert tracing.begin() is None
+
+
+def test_slowest_requests_keeps_the_n_slowest():
+    slowest = tracing.SlowestRequests(2)
+    for total in (0.3, 0.1, 0.5, 0.2):
+        trace = tracing.Trace()
+        trace.last = trace.started + total
+        slowest.add(trace)
+    traces, count, _ = slowest.slowest()
+    assert [trace.total() for trace in traces] == pytest.approx([0.5, 0.3]) and count == 4
+
+
+def test_trace_dump_and_profile_are_audit_only(bank):
+    for command in ('trace_dump', 'profile'):
+        assert server.dispatch(bank, {'user': 'Alice', 'command': command}).startswith("Access denied")
+    assert audit(bank, 'trace_dump', slowest='-1') == f"slowest must be between 0 and {server.MAX_TRACED}"
+
+
+def test_profile_writes_folded_stacks(bank, tmp_path, monkeypatch):
+    monkeypatch.setitem(server.config, "profile_dir", str(tmp_path))
+    assert audit(bank, 'profile', seconds='0').startswith("seconds must be between 1")
+    response = audit(bank, 'profile', seconds='1', hz='50')
+    path = response.rsplit(" ", 1)[1]
+    assert response.startswith("Profiling every thread at 50 Hz for 1 seconds") and path.startswith(str(tmp_path))
+    assert audit(bank, 'profile', seconds='1') == "A profile is already running"
+    deadline = time.monotonic() + 10
+    while not tracing._profiling.acquire(blocking=False):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    tracing._profiling.release()
+    with open(path) as f:
+        lines = f.read().splitlines()
+    # Root first, frames joined by ";", then the sample count; this test's thread is among them.
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("test_tracing.py:test_profile_writes_folded_stacks" in line for line in lines)
+    assert os.path.basename(path).startswith("profile-")
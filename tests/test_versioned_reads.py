@@ -0,0 +1,69 @@
+"""The lock-free read path: committed balances from account versions, as of one commit."""
+import threading
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def bank():
+    bank = server.Bank()
+    yield bank
+    bank.history.close()
+
+
+@pytest.mark.parametrize("version, seq, balance", [
+    (500, 3, 500),                  # never written: the opening balance
+    ((7, 40, 4, 30), 7, 40),        # the newest version is committed
+    ((7, 40, 4, 30), 6, 30),        # only the one before it is
+    ((7, 40, 4, 30), 3, None),      # both are newer than the read
+])
+def test_committed_balance(version, seq, balance):
+    assert server.committed_balance(version, seq) == balance
+
+
+def test_reads_see_a_commit_whole(bank):
+    """Money moving between two accounts never shows as missing or doubled to a reader."""
+    a, b = bank.find_account(1001), bank.find_account(1003)
+    total = sum(bank.read_balances([a, b]))
+    stop = threading.Event()
+    seen = []
+
+    def move():
+        while not stop.is_set():
+            bank.post([(a, -5, ('Alice', 'transfer_out', 5, 1003)), (b, 5, ('Alice', 'transfer_in', 5, 1001))], 'test')
+            bank.post([(b, -5, ('Bob', 'transfer_out', 5, 1001)), (a, 5, ('Bob', 'transfer_in', 5, 1003))], 'test')
+
+    writers = [threading.Thread(target=move) for _ in range(2)]
+    for writer in writers:
+        writer.start()
+    try:
+        for _ in range(20000):
+            seen.append(sum(bank.read_balances([a, b])))
+    finally:
+        stop.set()
+        for writer in writers:
+            writer.join()
+    assert set(seen) == {total}
+    assert bank.commit_seq > 0
+
+
+def test_read_balance_follows_commits(bank):
+    account = bank.find_account(1001)
+    opening = bank.read_balance(account)
+    server.dispatch(bank, {'user': 'Alice', 'command': 'deposit', 'acct_num': '1001', 'amount': '40'})
+    assert bank.read_balance(account) == opening + 40
+    assert account.version[0] == bank.commit_seq
+
+
+def test_show_balances(bank):
+    response = server.dispatch(bank, {'user': 'Audit', 'command': 'show_balances', 'acct_num': '0',
+                                      'acct_nums': '1001,1002'})
+    assert '2100' in response and '-300' in response
+    response = server.dispatch(bank, {'user': 'Alice', 'command': 'show_balances', 'acct_num': '0',
+                                      'acct_nums': '1001'})
+    assert response == "Access denied: only Audit can view balances"
+    response = server.dispatch(bank, {'user': 'Audit', 'command': 'show_balances', 'acct_num': '0',
+                                      'acct_nums': '1001,999'})
+    assert response == "Account 999 was not found"
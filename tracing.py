@@ -0,0 +1,201 @@
+"""
+Opt-in request tracing and an on-demand sampling profiler.
+
+With tracing on (trace_slowest N > 0, or trace_dump slowest=N while the
+server runs), every request carries a Trace. Each time the request
+crosses from one phase to the next, the time since the previous
+crossing is added to the phase it just left:
+
+    parse             request bytes to fields, and the request's log line
+    queue             waiting for a worker (admission.py), and the hand back
+    lookup            finding and checking accounts (Bank.find_account)
+    lock_wait         waiting for account locks, or for a write batch's combiner
+    critical_section  holding account locks
+    durable           waiting for the write-ahead log to reach disk
+    format            the rest of the command: reading and formatting the reply
+    send              writing the reply (for streamed reports, also making it;
+                      for pipelined frames, also the requests sent with it)
+
+The N slowest requests are kept with their phases, and trace_dump lists
+them. Code below the front end marks phases with mark(), which finds the
+request's Trace through a thread-local set by run() for the length of a
+dispatch. When tracing is off, mark() costs a thread-local lookup.
+
+profile (Audit, seconds=S, hz=H) samples every thread's stack H times a
+second for S seconds in a background thread. It then writes the samples
+to profile_dir in the folded format of flamegraph.pl and speedscope: one
+line per distinct stack, root first, frames joined by ";", then a count.
+"""
+import collections
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+
+PHASES = ('parse', 'queue', 'lookup', 'lock_wait', 'critical_section', 'durable', 'format', 'send')
+
+MAX_PROFILE_SECONDS = 600
+MAX_PROFILE_HZ = 1000
+
+_local = threading.local()
+
+
+class Trace:
+    __slots__ = ('command', 'user', 'acct_num', 'ts', 'started', 'last', 'phases')
+
+    def __init__(self):
+        self.ts = time.time()
+        self.started = self.last = time.perf_counter()
+        self.command = self.user = self.acct_num = None
+        self.phases = {}
+
+    def mark(self, phase):
+        """Add the time since the last mark to phase."""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def label(self, data_dict):
+        self.command = data_dict.get('command')
+        self.user = data_dict.get('user')
+        self.acct_num = data_dict.get('acct_num')
+
+    def total(self):
+        return self.last - self.started
+
+
+class SlowestRequests:
+    """The n slowest finished traces, in a min-heap so a faster request is turned away in O(1)."""
+
+    def __init__(self, n):
+        self.n = n
+        self.lock = threading.Lock()
+        self.heap = []                 # (total, tiebreak, trace)
+        self.order = itertools.count()
+        self.since = time.time()
+        self.count = 0
+
+    def add(self, trace):
+        total = trace.total()
+        with self.lock:
+            self.count += 1
+            if len(self.heap) < self.n:
+                heapq.heappush(self.heap, (total, next(self.order), trace))
+            elif total > self.heap[0][0]:
+                heapq.heapreplace(self.heap, (total, next(self.order), trace))
+
+    def slowest(self):
+        with self.lock:
+            return [trace for _, _, trace in sorted(self.heap, reverse=True)], self.count, self.since
+
+
+SLOWEST = None   # SlowestRequests while tracing is on
+
+
+def configure(n):
+    """Keep the n slowest requests from now on (0 turns tracing off)."""
+    global SLOWEST
+    SLOWEST = SlowestRequests(n) if n > 0 else None
+
+
+def begin():
+    """A Trace for a request arriving now, or None if tracing is off."""
+    return Trace() if SLOWEST is not None else None
+
+
+def finish(trace):
+    slowest = SLOWEST
+    if slowest is not None:
+        slowest.add(trace)
+
+
+def run(trace, fn, *args):
+    """fn(*args) with trace receiving the marks made on this thread meanwhile."""
+    trace.mark('queue')
+    _local.trace = trace
+    try:
+        return fn(*args)
+    finally:
+        _local.trace = None
+        trace.mark('format')
+
+
+def mark(phase):
+    """End the current request's phase here (no-op if the request is not traced)."""
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.mark(phase)
+
+
+def format_slowest():
+    slowest = SLOWEST
+    if slowest is None:
+        return "Tracing is off; turn it on with trace_dump -o slowest=N"
+    traces, count, since = slowest.slowest()
+    lines = [f"The {len(traces)} slowest of {count} requests traced since "
+             f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(since))} (ms):",
+             f"{'time':<23} {'command':<21} {'user':<10} {'acct_num':>8} {'total':>9} "
+             + " ".join(f"{phase:>{max(9, len(phase))}}" for phase in PHASES)]
+    for trace in traces:
+        ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(trace.ts)) + f".{int(trace.ts % 1 * 1000):03d}"
+        lines.append(f"{ts:<23} {str(trace.command):<21} {str(trace.user):<10} {str(trace.acct_num):>8} "
+                     f"{trace.total() * 1000:>9.3f} "
+                     + " ".join(f"{trace.phases.get(phase, 0.0) * 1000:>{max(9, len(phase))}.3f}" for phase in PHASES))
+    return "\n".join(lines)
+
+
+# --------------------- Sampling profiler ---------------------
+
+_profiling = threading.Lock()   # held while a profile runs: one at a time
+
+
+def frame_name(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def sample_stacks(seconds, hz):
+    """Every other thread's stack, sampled hz times a second for seconds: Counter of root-first frame tuples."""
+    stacks = collections.Counter()
+    interval = 1.0 / hz
+    deadline = time.perf_counter() + seconds
+    me = threading.get_ident()
+    while time.perf_counter() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            stacks[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def write_folded(stacks, path):
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(";".join(stack) + f" {count}\n")
+
+
+def start_profile(seconds, hz, directory):
+    """Profile in the background; returns the path the stacks will be written to, or None if one is running."""
+    if not _profiling.acquire(blocking=False):
+        return None
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        _profiling.release()
+        raise
+    path = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+
+    def profile():
+        try:
+            write_folded(sample_stacks(seconds, hz), path)
+        finally:
+            _profiling.release()
+
+    threading.Thread(target=profile, name="profiler", daemon=True).start()
+    return path